@@ -0,0 +1,82 @@
+"""
+Micro-benchmark del motor de asignación de distribuir_leads_vtiger.py.
+
+Compara la selección de asesor con heap (cola_asesores/elegir_asesor) con
+la versión anterior, que ordenaba todos los asesores en cada lead, y mide
+cómo escala el heap al duplicar el número de leads.
+
+Uso:
+    python bench_asignacion.py [--asesores 500] [--leads 20000]
+"""
+import argparse
+import time
+
+import distribuir_leads_vtiger as dl
+
+
+def asignar_ordenando(capacidad, n_leads):
+    """Selección original: ordenar todos los candidatos en cada lead, O(A log A)."""
+    asignados = []
+    for _ in range(n_leads):
+        candidatos = sorted(
+            [(uid, capacidad[uid]) for uid in capacidad if capacidad[uid] > 0],
+            key=lambda x: (-x[1], x[0])
+        )
+        if not candidatos:
+            break
+        asesor_id = candidatos[0][0]
+        capacidad[asesor_id] -= 1
+        asignados.append(asesor_id)
+    return asignados
+
+
+def asignar_heap(capacidad, n_leads):
+    """Selección con heap, O(log A) por lead."""
+    asignados = []
+    heap = dl.cola_asesores(capacidad)
+    for _ in range(n_leads):
+        asesor_id = dl.elegir_asesor(heap, capacidad)
+        if asesor_id is None:
+            break
+        asignados.append(asesor_id)
+    return asignados
+
+
+def capacidades(n_asesores, n_leads):
+    # capacidad suficiente para todos los leads, con asesores desiguales
+    base = n_leads // n_asesores + 1
+    return {f"19x{i}": base + (i % 7) for i in range(n_asesores)}
+
+
+def medir(func, n_asesores, n_leads):
+    capacidad = capacidades(n_asesores, n_leads)
+    inicio = time.perf_counter()
+    asignados = func(capacidad, n_leads)
+    return time.perf_counter() - inicio, asignados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la selección de asesor")
+    parser.add_argument("--asesores", type=int, default=500)
+    parser.add_argument("--leads", type=int, default=20000)
+    args = parser.parse_args()
+
+    t_sort, a_sort = medir(asignar_ordenando, args.asesores, args.leads)
+    t_heap, a_heap = medir(asignar_heap, args.asesores, args.leads)
+    assert a_sort == a_heap, "el heap debe asignar exactamente igual que la ordenación"
+    print(f"{args.asesores} asesores, {args.leads} leads")
+    print(f"  ordenando por lead: {t_sort * 1000:9.1f} ms")
+    print(f"  heap:               {t_heap * 1000:9.1f} ms  (x{t_sort / t_heap:.0f})")
+
+    print("Escalado del heap en N leads:")
+    anterior = None
+    for factor in (1, 2, 4, 8):
+        n = args.leads * factor
+        t, _ = medir(asignar_heap, args.asesores, n)
+        ratio = f"  x{t / anterior:.2f} vs N/2" if anterior else ""
+        print(f"  N={n:>8}: {t * 1000:9.1f} ms  {t / n * 1e6:.2f} us/lead{ratio}")
+        anterior = t
+
+
+if __name__ == "__main__":
+    main()
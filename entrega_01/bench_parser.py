@@ -0,0 +1,81 @@
+"""
+Benchmark de los lectores de CSV de distribuir_leads_vtiger.py.
+
+Genera un CSV sintético (por defecto 1M filas, ~5% duplicados, separador
+';' como los exports de Excel) y mide cuánto tarda cada parser disponible
+(stdlib, pyarrow, polars) en producir todos los leads normalizados
+(los duplicados del fichero se cuentan aparte, con un set).
+
+Uso:
+    python bench_parser.py [--filas 1000000] [--csv /tmp/leads_bench.csv]
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+
+import distribuir_leads_vtiger as dl
+
+CURSOS = ["Salud", "Electricidad", "Hostelería", "Informática", "Idiomas"]
+ORIGENES = ["Google_ads", "Facebook_ads", "TikTok_ads", "SEO", "Portales", "Referido"]
+
+
+def generar_csv(path, filas, semilla=42):
+    rnd = random.Random(semilla)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["Nombre", "Email", "Teléfono", "Curso Interesado", "Fecha entrada", "Origen del leads"])
+        for i in range(filas):
+            # ~5% de filas repiten un lead anterior (con mayúsculas/espacios distintos)
+            j = rnd.randrange(i) if i and rnd.random() < 0.05 else i
+            writer.writerow([
+                f"Lead {j}",
+                f" Lead{j}@Example.com " if j != i else f"lead{j}@example.com",
+                f"6{j:08d}",
+                CURSOS[j % len(CURSOS)],
+                "28/07/2025",
+                ORIGENES[j % len(ORIGENES)],
+            ])
+
+
+def medir(path, parser):
+    inicio = time.perf_counter()
+    total = 0
+    duplicados = 0
+    vistos = set()
+    for lead in dl.leer_leads(path, parser=parser):
+        total += 1
+        # los duplicados se cuentan con un set, como en asignar_leads()
+        clave = (lead["email"].lower(), lead["telefono"])
+        duplicados += clave in vistos
+        vistos.add(clave)
+    return time.perf_counter() - inicio, total, duplicados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de los parsers de CSV")
+    parser.add_argument("--filas", type=int, default=1_000_000)
+    parser.add_argument("--csv", help="CSV a reutilizar/generar (por defecto un temporal)")
+    args = parser.parse_args()
+
+    path = args.csv or os.path.join(tempfile.gettempdir(), f"leads_bench_{args.filas}.csv")
+    if not os.path.exists(path):
+        inicio = time.perf_counter()
+        generar_csv(path, args.filas)
+        print(f"Generado {path} ({args.filas} filas) en {time.perf_counter() - inicio:.1f}s")
+
+    disponibles = ["stdlib"] + [p for p, mod in (("pyarrow", dl.pa), ("polars", dl.pl)) if mod is not None]
+    base = None
+    for nombre in disponibles:
+        segundos, total, duplicados = medir(path, nombre)
+        base = base or segundos
+        print(
+            f"  {nombre:8s}: {segundos:6.2f}s  {total / segundos:>10,.0f} filas/s  "
+            f"{duplicados} duplicados  (x{base / segundos:.1f} vs stdlib)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,66 @@
-import requests
+import os
 import csv
 import hashlib
 import argparse
 from datetime import datetime, date
 from dateutil import tz
 import time
+import math
 import sys
 import logging
+import json
+import sqlite3
+import threading
+import heapq
+import glob
+import gzip
+import queue
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+# paquete común vtiger_http en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vtiger_http import ensure_pool_size, get_limiter, get_session, iter_query, iter_query_since, vtql_literal
+
+# parsers columnares opcionales para CSV grandes (ver leer_leads)
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+except ImportError:  # pragma: no cover - depende del entorno
+    pa = None
+try:
+    import polars as pl
+except ImportError:  # pragma: no cover - depende del entorno
+    pl = None
 
 # -------- CONFIGURAR AQUI ----------
 VTIGER_URL = "https://crm.albali.com/webservice.php"
 USERNAME = "usuario_api"
 ACCESS_KEY = "access_key"
 MAX_LEADS_POR_DIA = 25
+BULK_CHUNK = 50  # valores por consulta IN (...) en la deduplicación en bloque
+LOTE_STREAMING = 500  # filas del CSV que se deduplican juntas en el pipeline en streaming
+HILOS_LECTURA = 4  # ficheros de entrada que se parsean en paralelo
+COLA_LECTURA = 1000  # filas leídas por adelantado por fichero (cola acotada)
+SNAPSHOT_PAGINA = 100  # registros por página al exportar Leads (máximo de la API query)
+PARSER = "auto"  # lector de CSV: auto | stdlib | pyarrow | polars
+BLOQUE_COLUMNAR = 1 << 20  # bytes de CSV por bloque en los lectores pyarrow/polars
+JOURNAL_PATH = "distribucion_journal.sqlite"  # checkpoint local para reanudar ejecuciones con --apply
+CONTADORES_PATH = "contadores_leads.sqlite"  # leads por asesor y día, mantenidos por el propio script
+RECONCILIAR_CADA = 600  # segundos entre reconciliaciones de los contadores con VTiger
 # ------------------------------------
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
+# sesión HTTP con pool keep-alive, timeouts y reintentos compartida por todas las llamadas
+http_session = get_session()
+
 
 def get_challenge():
     params = {"operation": "getchallenge", "username": USERNAME}
-    r = requests.get(VTIGER_URL, params=params)
+    r = http_session.get(VTIGER_URL, params=params)
     r.raise_for_status()
     data = r.json()
     if data.get("success"):
@@ -37,7 +77,7 @@ def login():
         "username": USERNAME,
         "accessKey": key
     }
-    r = requests.post(VTIGER_URL, data=payload)
+    r = http_session.post(VTIGER_URL, data=payload)
     r.raise_for_status()
     data = r.json()
     if data.get("success"):
@@ -53,9 +93,9 @@ def vtiger_query(session, query):
     params = {
         "operation": "query",
         "sessionName": session,
-        "query": query + " ;"  # vtiger exige punto y coma
+        "query": query.rstrip().rstrip(";") + " ;"  # vtiger exige punto y coma
     }
-    r = requests.get(VTIGER_URL, params=params)
+    r = http_session.get(VTIGER_URL, params=params)
     r.raise_for_status()
     data = r.json()
     if not data.get("success"):
@@ -79,7 +119,7 @@ def lookup_email_or_phone(session, value, typ="email", modules=None):
     if modules:
         # buscar en módulos concretos
         params["searchIn"] = str(modules)  # vtiger espera array-like
-    r = requests.get(VTIGER_URL, params=params)
+    r = http_session.get(VTIGER_URL, params=params)
     if r.status_code != 200:
         return []
     data = r.json()
@@ -88,6 +128,49 @@ def lookup_email_or_phone(session, value, typ="email", modules=None):
     return []
 
 
+def buscar_existentes_bulk(session, emails, telefonos, chunk=BULK_CHUNK):
+    """
+    Resuelve en bloque qué emails y teléfonos ya existen en Leads usando
+    consultas WHERE email IN (...) / phone IN (...) troceadas en grupos de `chunk`.
+    Devuelve (set de emails en minúsculas, set de teléfonos).
+    Si alguna consulta falla se propaga la excepción para que el llamante
+    pueda volver a la búsqueda fila a fila.
+    """
+    existentes = {"email": set(), "phone": set()}
+    for campo, valores in (("email", sorted(emails)), ("phone", sorted(telefonos))):
+        for i in range(0, len(valores), chunk):
+            trozo = valores[i:i + chunk]
+            q = "SELECT id, {0} FROM Leads WHERE {0} IN ({1})".format(
+                campo, ", ".join(vtql_literal(v) for v in trozo)
+            )
+            # un mismo email/teléfono puede estar en varios Leads: el resultado puede pasar de 100 filas
+            for r in vtiger_query_paginada(session, q):
+                valor = (r.get(campo) or "").strip()
+                if campo == "email":
+                    valor = valor.lower()
+                if valor:
+                    existentes[campo].add(valor)
+    return existentes["email"], existentes["phone"]
+
+
+def existe_en_vtiger(session, lead):
+    """
+    Comprobación fila a fila vía lookup (dos peticiones como máximo).
+    Solo se usa como fallback cuando la deduplicación en bloque falla.
+    """
+    if lead["email"]:
+        res = lookup_email_or_phone(session, lead["email"], typ="email", modules=["Leads"])
+        if res:
+            logging.info("Lead con email ya existe, se omite: %s", lead["email"])
+            return True
+    if lead["telefono"]:
+        res = lookup_email_or_phone(session, lead["telefono"], typ="phone", modules=["Leads"])
+        if res:
+            logging.info("Lead con teléfono ya existe, se omite: %s", lead["telefono"])
+            return True
+    return False
+
+
 def create_record(session, module, data):
     payload = {
         "operation": "create",
@@ -95,7 +178,7 @@ def create_record(session, module, data):
         "element": str(data).replace("'", '"'),  # vtiger acepta JSON con comillas dobles
         "elementType": module
     }
-    r = requests.post(VTIGER_URL, data=payload)
+    r = http_session.post(VTIGER_URL, data=payload)
     r.raise_for_status()
     data_resp = r.json()
     if not data_resp.get("success"):
@@ -106,7 +189,7 @@ def create_record(session, module, data):
 def get_asesores_activos(session):
     # Obtener usuarios activos (status=Active y no eliminados)
     q = "SELECT id, user_name FROM Users WHERE status='Active' AND deleted=0"
-    rows = vtiger_query(session, q)
+    rows = vtiger_query_paginada(session, q)
     # map de id a nombre
     return {r["id"]: r["user_name"] for r in rows}
 
@@ -122,125 +205,989 @@ def contar_leads_hoy_por_asesor(session):
         "WHERE deleted=0 AND setype='Leads' AND DATE(createdtime) = '{0}' "
         "GROUP BY smownerid"
     ).format(hoy)
-    rows = vtiger_query(session, q)
+    rows = vtiger_query_paginada(session, q)
     result = {}
     for r in rows:
         result[r["smownerid"]] = int(r["cnt"])
     return result  # {user_id: count}
 
 
-def repartir_leads(session, csv_path, dry_run=True):
-    asesores = get_asesores_activos(session)
-    if not asesores:
-        logging.error("No se encontraron asesores activos.")
-        return []
+def vtiger_query_paginada(session, query, pagina=None, columnas=None):
+    """
+    Generador sobre una consulta sin LIMIT, paginada con LIMIT offset, n
+    (la API query devuelve como máximo 100 registros por llamada). La
+    página siguiente se pide en segundo plano mientras se consume la actual;
+    `columnas` sustituye la lista del SELECT (ver vtiger_http.iter_query).
+    """
+    return iter_query(
+        lambda q: vtiger_query(session, q), query, page_size=pagina or SNAPSHOT_PAGINA, columns=columnas
+    )
 
-    leads_por_asesor = contar_leads_hoy_por_asesor(session)
-    capacidad = {}
-    for uid in asesores:
-        usados = leads_por_asesor.get(uid, 0)
-        capacidad[uid] = max(0, MAX_LEADS_POR_DIA - usados)
-    logging.info("Capacidades iniciales (restantes hoy) por asesor: %s", capacidad)
 
-    asignaciones = []  # lista de dicts con lead + asignado
-    usado_keys = set()  # (email.lower(), phone) para dedup en batch
+def iterar_leads_existentes(session, desde=None):
+    """
+    Generador paginado de los Leads de VTiger (id, email, phone, modifiedtime).
+    Con `desde` solo devuelve los modificados a partir de esa fecha.
+    Se pagina por modifiedtime (ver vtiger_http.iter_query_since) y no por
+    offset: un Lead modificado durante el recorrido no desplaza a los demás
+    ni hace que la marca ultima_modificacion pase por encima de uno sin leer.
+    """
+    return iter_query_since(
+        lambda q: vtiger_query(session, q), "SELECT id, email, phone, modifiedtime FROM Leads",
+        "modifiedtime", since=desde, page_size=SNAPSHOT_PAGINA,
+    )
+
+
+class ContadorLeads:
+    """
+    Contadores persistentes (SQLite) de leads asignados hoy por asesor, que
+    sustituyen a la consulta GROUP BY de contar_leads_hoy_por_asesor().
+    Se guarda cada lead contado (fecha, leadid), así que los creados por el
+    propio script y los que llegan al reconciliar no se cuentan dos veces.
+    La reconciliación solo pide a VTiger los Leads con createdtime a partir
+    del último visto, y se hace como mucho cada `intervalo` segundos.
+    """
+
+    def __init__(self, path, intervalo=RECONCILIAR_CADA):
+        self.path = path
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS leads_dia (
+                fecha TEXT NOT NULL,
+                leadid TEXT NOT NULL,
+                asesor_id TEXT NOT NULL,
+                PRIMARY KEY (fecha, leadid)
+            );
+            CREATE TABLE IF NOT EXISTS sync_estado (
+                fecha TEXT PRIMARY KEY,
+                ultima_creacion TEXT,
+                reconciliado REAL
+            );
+            """
+        )
+        hoy = date.today().isoformat()
+        self._conn.execute("DELETE FROM leads_dia WHERE fecha < ?", (hoy,))
+        self._conn.execute("DELETE FROM sync_estado WHERE fecha < ?", (hoy,))
+        self._conn.commit()
+
+    def _estado(self, fecha):
+        fila = self._conn.execute(
+            "SELECT ultima_creacion, reconciliado FROM sync_estado WHERE fecha = ?", (fecha,)
+        ).fetchone()
+        return fila or (None, None)
 
+    def reconciliar(self, session):
+        """Incorpora los Leads creados en VTiger desde la última reconciliación."""
+        fecha = date.today().isoformat()
+        with self._lock:
+            ultima, _ = self._estado(fecha)
+        # >= en vez de > para no perder leads con el mismo segundo; los repetidos se ignoran
+        desde = ultima or f"{fecha} 00:00:00"
+        q = (
+            "SELECT id, assigned_user_id, createdtime FROM Leads "
+            "WHERE createdtime >= {0} ORDER BY createdtime"
+        ).format(vtql_literal(desde))
+        filas = [r for r in vtiger_query_paginada(session, q) if (r.get("createdtime") or "").startswith(fecha)]
+        nuevos = 0
+        with self._lock:
+            for r in filas:
+                creado = r["createdtime"]
+                cur = self._conn.execute(
+                    "INSERT OR IGNORE INTO leads_dia (fecha, leadid, asesor_id) VALUES (?, ?, ?)",
+                    (fecha, r["id"], r.get("assigned_user_id") or ""),
+                )
+                nuevos += cur.rowcount
+                if ultima is None or creado > ultima:
+                    ultima = creado
+            self._conn.execute(
+                """
+                INSERT INTO sync_estado (fecha, ultima_creacion, reconciliado) VALUES (?, ?, ?)
+                ON CONFLICT(fecha) DO UPDATE SET
+                    ultima_creacion = excluded.ultima_creacion,
+                    reconciliado = excluded.reconciliado
+                """,
+                (fecha, ultima, time.time()),
+            )
+            self._conn.commit()
+        logging.info("Contadores reconciliados desde %s: %d leads nuevos", desde, nuevos)
+        return nuevos
+
+    def leads_hoy(self, session):
+        """Leads de hoy por asesor; reconcilia antes si toca según `intervalo`."""
+        fecha = date.today().isoformat()
+        with self._lock:
+            _, reconciliado = self._estado(fecha)
+        if reconciliado is None or time.time() - reconciliado >= self.intervalo:
+            self.reconciliar(session)
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT asesor_id, COUNT(*) FROM leads_dia WHERE fecha = ? GROUP BY asesor_id", (fecha,)
+            )
+            return {asesor_id: n for asesor_id, n in filas}
+
+    def registrar(self, leadid, asesor_id):
+        """Cuenta un lead creado por el script (idempotente)."""
+        if not leadid:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO leads_dia (fecha, leadid, asesor_id) VALUES (?, ?, ?)",
+                (date.today().isoformat(), leadid, asesor_id),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Snapshot:
+    """
+    Copia local del estado del CRM que necesita el planificador: asesores
+    activos, leads de hoy por asesor y claves email/teléfono de los Leads
+    existentes. Se guarda como JSON comprimido (gzip) y permite planificar
+    en memoria sin ninguna llamada a VTiger.
+    """
+
+    VERSION = 1
+
+    def __init__(self, asesores, leads_hoy, emails, telefonos, fecha=None, ultima_modificacion=None):
+        self.asesores = asesores
+        self.leads_hoy = leads_hoy
+        self.emails = set(emails)
+        self.telefonos = set(telefonos)
+        self.fecha = fecha or date.today().isoformat()
+        self.ultima_modificacion = ultima_modificacion
+
+    @classmethod
+    def desde_vtiger(cls, session):
+        snap = cls(get_asesores_activos(session), contar_leads_hoy_por_asesor(session), (), ())
+        snap._añadir_leads(iterar_leads_existentes(session))
+        return snap
+
+    def _añadir_leads(self, filas):
+        n = 0
+        for r in filas:
+            email = (r.get("email") or "").strip().lower()
+            telefono = (r.get("phone") or "").strip()
+            if email:
+                self.emails.add(email)
+            if telefono:
+                self.telefonos.add(telefono)
+            modificado = r.get("modifiedtime")
+            if modificado and (self.ultima_modificacion is None or modificado > self.ultima_modificacion):
+                self.ultima_modificacion = modificado
+            n += 1
+        return n
+
+    def reconciliar(self, session):
+        """
+        Actualiza el snapshot de forma incremental: solo los Leads modificados
+        desde la última modificación vista, más asesores y conteos de hoy
+        (dos consultas pequeñas).
+        """
+        nuevos = self._añadir_leads(iterar_leads_existentes(session, desde=self.ultima_modificacion))
+        self.asesores = get_asesores_activos(session)
+        self.leads_hoy = contar_leads_hoy_por_asesor(session)
+        self.fecha = date.today().isoformat()
+        logging.info("Snapshot reconciliado: %d leads modificados desde %s", nuevos, self.ultima_modificacion)
+        return nuevos
+
+    def leads_hoy_vigentes(self):
+        """Conteos de hoy; si el snapshot es de otro día no aplican."""
+        if self.fecha != date.today().isoformat():
+            logging.warning("El snapshot es del %s: se ignoran sus conteos de leads por asesor.", self.fecha)
+            return {}
+        return dict(self.leads_hoy)
+
+    def buscar_existentes(self, emails, telefonos):
+        """Equivalente en memoria de buscar_existentes_bulk()."""
+        return {e for e in emails if e in self.emails}, {t for t in telefonos if t in self.telefonos}
+
+    def registrar(self, lead):
+        """Añade al snapshot un lead recién creado."""
+        if lead["email"]:
+            self.emails.add(lead["email"].lower())
+        if lead["telefono"]:
+            self.telefonos.add(lead["telefono"])
+
+    def guardar(self, path):
+        datos = {
+            "version": self.VERSION,
+            "fecha": self.fecha,
+            "ultima_modificacion": self.ultima_modificacion,
+            "asesores": self.asesores,
+            "leads_hoy": self.leads_hoy,
+            "emails": sorted(self.emails),
+            "telefonos": sorted(self.telefonos),
+        }
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(datos, f, ensure_ascii=False, separators=(",", ":"))
+        logging.info(
+            "Snapshot guardado en %s: %d asesores, %d emails, %d teléfonos",
+            path, len(self.asesores), len(self.emails), len(self.telefonos),
+        )
+
+    @classmethod
+    def cargar(cls, path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            datos = json.load(f)
+        if datos.get("version") != cls.VERSION:
+            raise ValueError(f"Versión de snapshot no soportada: {datos.get('version')}")
+        return cls(
+            datos["asesores"], datos["leads_hoy"], datos["emails"], datos["telefonos"],
+            fecha=datos["fecha"], ultima_modificacion=datos["ultima_modificacion"],
+        )
+
+
+COLUMNAS = {
+    "nombre": "Nombre",
+    "email": "Email",
+    "telefono": "Teléfono",
+    "curso": "Curso Interesado",
+    "entrada": "Fecha entrada",
+    "origen": "Origen del leads",
+}
+
+
+def detectar_delimitador(csv_path):
+    """Delimitador del CSV según la cabecera (',' por defecto; los exports de Excel usan ';')."""
     with open(csv_path, newline="", encoding="utf-8-sig") as f:
-        reader = csv.DictReader(f)
+        cabecera = f.readline()
+    return max([",", ";", "\t", "|"], key=cabecera.count) if cabecera.strip() else ","
+
+
+def elegir_parser(parser=None):
+    """
+    Resuelve --parser: 'auto' usa pyarrow si está instalado y si no el csv
+    estándar; polars solo se usa si se pide (ver leer_leads()).
+    """
+    parser = parser or PARSER
+    if parser == "auto":
+        return "pyarrow" if pa is not None else "stdlib"
+    if parser == "pyarrow" and pa is None or parser == "polars" and pl is None:
+        raise RuntimeError(f"El parser '{parser}' no está instalado (pip install {parser})")
+    return parser
+
+
+def leer_leads(csv_path, parser=None):
+    """
+    Generador: lee el CSV y devuelve cada lead normalizado.
+    Con el parser estándar se lee fila a fila; con pyarrow/polars se lee
+    por bloques de BLOQUE_COLUMNAR bytes y email/teléfono se normalizan de
+    forma vectorizada en cada bloque. Con stdlib y pyarrow la memoria no
+    depende del tamaño del fichero; polars lee por delante de quien consume
+    los bloques y su memoria crece con el fichero. Los duplicados dentro
+    del fichero no se marcan aquí: los resuelve asignar_leads() igual sea
+    cual sea el parser.
+    """
+    parser = elegir_parser(parser)
+    archivo = os.path.basename(csv_path)
+    delimitador = detectar_delimitador(csv_path)
+    if parser == "stdlib":
+        filas = _leer_stdlib(csv_path, delimitador)
+    elif parser == "pyarrow":
+        filas = _leer_pyarrow(csv_path, delimitador)
+    else:
+        filas = _leer_polars(csv_path, delimitador)
+    for fila in filas:
+        fila["archivo"] = archivo
+        yield fila
+
+
+def _leer_stdlib(csv_path, delimitador):
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f, delimiter=delimitador)
         for row in reader:
-            lead = {
+            yield {
                 "nombre": row.get("Nombre"),
-                "email": (row.get("Email")).strip(),
-                "telefono": (row.get("Teléfono")).strip(),
+                "email": (row.get("Email") or "").strip(),
+                "telefono": (row.get("Teléfono") or "").strip(),
                 "curso": row.get("Curso Interesado"),
                 "entrada" : row.get("Fecha entrada"),
                 "origen": row.get("Origen del leads", ""),
             }
+
+
+def _filas_columnares(columnas, n):
+    """Convierte listas por columna (claves de COLUMNAS) de un bloque en dicts de lead."""
+    vacias = [None] * n
+    cols = [columnas[c] if columnas[c] is not None else vacias for c in COLUMNAS]
+    for nombre, email, telefono, curso, entrada, origen in zip(*cols):
+        yield {
+            "nombre": nombre,
+            "email": email,
+            "telefono": telefono,
+            "curso": curso,
+            "entrada": entrada,
+            "origen": origen,
+        }
+
+
+def _leer_pyarrow(csv_path, delimitador):
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        cabecera = next(csv.reader(f, delimiter=delimitador), [])
+    lector = pa_csv.open_csv(
+        csv_path,
+        read_options=pa_csv.ReadOptions(block_size=BLOQUE_COLUMNAR),
+        parse_options=pa_csv.ParseOptions(delimiter=delimitador),
+        convert_options=pa_csv.ConvertOptions(column_types={c: pa.string() for c in cabecera}),
+    )
+    nombres = {c.lstrip("\ufeff"): i for i, c in enumerate(lector.schema.names)}
+    for bloque in lector:
+        n = bloque.num_rows
+
+        def columna(clave):
+            i = nombres.get(COLUMNAS[clave])
+            return bloque.column(i) if i is not None else None
+
+        columnas = {}
+        for clave in COLUMNAS:
+            col = columna(clave)
+            if clave in ("email", "telefono"):
+                col = pc.utf8_trim_whitespace(pc.fill_null(col, "")) if col is not None else None
+            columnas[clave] = col.to_pylist() if col is not None else None
+        for clave in ("email", "telefono", "origen"):
+            if columnas[clave] is None:
+                columnas[clave] = [""] * n
+        yield from _filas_columnares(columnas, n)
+
+
+def _leer_polars(csv_path, delimitador):
+    lf = pl.scan_csv(csv_path, separator=delimitador, infer_schema=False, encoding="utf8-lossy")
+    lf = lf.rename({c: c.lstrip("\ufeff") for c in lf.collect_schema().names()})
+    presentes = lf.collect_schema().names()
+    # polars lee los campos vacíos como null; el csv estándar los deja en ""
+    lf = lf.with_columns(pl.all().fill_null(""))
+    for clave, nombre in COLUMNAS.items():
+        if nombre not in presentes:
+            lf = lf.with_columns(pl.lit("" if clave in ("email", "telefono", "origen") else None, pl.String).alias(nombre))
+    lf = lf.with_columns(
+        pl.col(COLUMNAS["email"]).str.strip_chars(),
+        pl.col(COLUMNAS["telefono"]).str.strip_chars(),
+    )
+    # chunk_size en filas: ~100 bytes por fila de CSV, como el bloque de pyarrow.
+    # El motor streaming de polars no espera al consumidor: sigue leyendo y
+    # encolando bloques, por eso 'auto' no lo elige.
+    for df in lf.collect_batches(chunk_size=BLOQUE_COLUMNAR // 100):
+        columnas = {clave: df.get_column(nombre).to_list() for clave, nombre in COLUMNAS.items()}
+        yield from _filas_columnares(columnas, df.height)
+
+
+def resolver_entradas(entrada):
+    """
+    Convierte el argumento de entrada (CSV, directorio o patrón glob) en la
+    lista ordenada de ficheros CSV a procesar.
+    """
+    if os.path.isdir(entrada):
+        rutas = sorted(glob.glob(os.path.join(entrada, "*.csv")))
+    elif glob.has_magic(entrada):
+        rutas = sorted(glob.glob(entrada))
+    else:
+        rutas = [entrada]
+    if not rutas:
+        raise FileNotFoundError(f"No hay ficheros CSV en {entrada}")
+    return rutas
+
+
+def leer_entradas(rutas, hilos=HILOS_LECTURA, leidas=None, parser=None):
+    """
+    Generador: lee varios CSV en paralelo (un hilo por fichero, hasta `hilos`)
+    y devuelve sus leads en el orden de `rutas`, fichero a fichero.
+    Cada hilo llena una cola acotada, así la lectura de los siguientes
+    ficheros se solapa con el procesamiento del actual sin cargarlos enteros.
+    `leidas` (dict) acumula las filas consumidas por archivo y `parser`
+    se pasa a leer_leads().
+    """
+    if isinstance(rutas, str):
+        rutas = [rutas]
+    if leidas is None:
+        leidas = {}
+    if len(rutas) == 1:
+        for lead in leer_leads(rutas[0], parser):
+            leidas[lead["archivo"]] = leidas.get(lead["archivo"], 0) + 1
+            yield lead
+        return
+
+    fin = object()
+    parar = threading.Event()
+
+    def poner(cola, item):
+        # put con espera acotada para no bloquear el hilo si el consumidor ya paró
+        while not parar.is_set():
+            try:
+                cola.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def volcar(ruta, cola):
+        try:
+            for lead in leer_leads(ruta, parser):
+                if not poner(cola, lead):
+                    return
+            poner(cola, fin)
+        except Exception as e:
+            poner(cola, e)
+
+    colas = [queue.Queue(maxsize=COLA_LECTURA) for _ in rutas]
+    pool = ThreadPoolExecutor(max_workers=max(1, hilos))
+    try:
+        for ruta, cola in zip(rutas, colas):
+            pool.submit(volcar, ruta, cola)
+        for ruta, cola in zip(rutas, colas):
+            while True:
+                item = cola.get()
+                if item is fin:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                leidas[item["archivo"]] = leidas.get(item["archivo"], 0) + 1
+                yield item
+            logging.info("Leído %s (%d filas)", ruta, leidas.get(os.path.basename(ruta), 0))
+    finally:
+        # si el consumo se corta (capacidad agotada, error) se liberan los hilos lectores
+        parar.set()
+        pool.shutdown(wait=True)
+
+
+def en_lotes(iterable, tamano):
+    """Agrupa un iterable en listas de hasta `tamano` elementos."""
+    lote = []
+    for item in iterable:
+        lote.append(item)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def hash_lead(lead):
+    """Huella estable de una fila del CSV (clave del journal)."""
+    campos = ("nombre", "email", "telefono", "curso", "entrada", "origen")
+    bruto = "\x1f".join((lead.get(c) or "").strip().lower() for c in campos)
+    return hashlib.sha256(bruto.encode("utf-8")).hexdigest()
+
+
+class Journal:
+    """
+    Checkpoint local (SQLite) de una ejecución, indexado por hash de fila.
+    Estados: 'existe' (duplicado en VTiger), 'creando' (create en curso),
+    'creado' (con leadid) y 'error'. Con --resume se saltan las filas
+    'existe'/'creado'; las 'creando' vuelven a pasar por la deduplicación
+    contra VTiger, que detecta si el create llegó a completarse.
+    """
+
+    COMPLETADOS = ("existe", "creado")
+
+    def __init__(self, path, reanudar=False):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS filas (
+                hash TEXT PRIMARY KEY,
+                email TEXT,
+                telefono TEXT,
+                estado TEXT NOT NULL,
+                asesor_id TEXT,
+                leadid TEXT,
+                actualizado TEXT NOT NULL
+            )
+            """
+        )
+        if not reanudar:
+            self._conn.execute("DELETE FROM filas")
+        self._conn.commit()
+
+    def marcar(self, lead, estado, asesor_id=None, leadid=None):
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO filas (hash, email, telefono, estado, asesor_id, leadid, actualizado)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(hash) DO UPDATE SET
+                    estado = excluded.estado,
+                    asesor_id = COALESCE(excluded.asesor_id, filas.asesor_id),
+                    leadid = COALESCE(excluded.leadid, filas.leadid),
+                    actualizado = excluded.actualizado
+                """,
+                (hash_lead(lead), lead["email"], lead["telefono"], estado, asesor_id, leadid,
+                 datetime.now().isoformat(timespec="seconds")),
+            )
+            self._conn.commit()
+
+    def completados(self, hashes):
+        """Subconjunto de `hashes` ya resuelto en una ejecución anterior."""
+        hechos = set()
+        hashes = list(hashes)
+        with self._lock:
+            for i in range(0, len(hashes), 500):
+                trozo = hashes[i:i + 500]
+                marcas = ",".join("?" * len(trozo))
+                filas = self._conn.execute(
+                    f"SELECT hash FROM filas WHERE estado IN ('existe', 'creado') AND hash IN ({marcas})",
+                    trozo,
+                )
+                hechos.update(h for (h,) in filas)
+        return hechos
+
+    def resumen(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT estado, COUNT(*) FROM filas GROUP BY estado"))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def cola_asesores(capacidad):
+    """
+    Cola de prioridad (heap) de asesores con capacidad restante, ordenada
+    por (-capacidad, uid): el mismo criterio que ordenar todos los asesores
+    por fila, pero con coste O(log A) por asignación.
+    """
+    heap = [(-restante, uid) for uid, restante in capacidad.items() if restante > 0]
+    heapq.heapify(heap)
+    return heap
+
+
+def elegir_asesor(heap, capacidad):
+    """
+    Saca del heap el asesor con más capacidad restante (desempate por uid),
+    descuenta una unidad en `capacidad` y lo vuelve a encolar si le queda
+    espacio. Devuelve None si no queda ningún asesor con capacidad.
+    """
+    if not heap:
+        return None
+    _, asesor_id = heapq.heappop(heap)
+    capacidad[asesor_id] -= 1
+    if capacidad[asesor_id] > 0:
+        heapq.heappush(heap, (-capacidad[asesor_id], asesor_id))
+    return asesor_id
+
+
+class Estrategia(ABC):
+    """
+    Política de asignación de leads a asesores.
+    Recibe la capacidad restante de hoy por asesor y la configuración de
+    --config-asesores; elegir(lead) devuelve el uid elegido (descontando su
+    capacidad) o None si ningún asesor puede recibir ese lead.
+    """
+
+    nombre = None
+
+    def __init__(self, capacidad, config=None, usados=None):
+        self.capacidad = capacidad
+        self.config = config or {}
+        self.usados = usados or {}
+
+    @abstractmethod
+    def elegir(self, lead):
+        """uid del asesor que recibe `lead` (ya descontado de su capacidad) o None."""
+
+    def agotada(self):
+        """True si ya no queda capacidad para ningún lead."""
+        return all(restante <= 0 for restante in self.capacidad.values())
+
+
+class EstrategiaCapacidad(Estrategia):
+    """Asesor con más capacidad restante; desempate por uid (política por defecto)."""
+
+    nombre = "capacidad"
+
+    def __init__(self, capacidad, config=None, usados=None):
+        super().__init__(capacidad, config, usados)
+        self.heap = cola_asesores(capacidad)
+
+    def elegir(self, lead):
+        return elegir_asesor(self.heap, self.capacidad)
+
+
+class EstrategiaPonderada(Estrategia):
+    """
+    Reparto proporcional al "peso" de cada asesor (por defecto 1): se elige
+    el asesor con menor (asignados_hoy + 1) / peso, desempate por uid.
+    """
+
+    nombre = "ponderada"
+
+    def __init__(self, capacidad, config=None, usados=None):
+        super().__init__(capacidad, config, usados)
+        self.asignados = {uid: self.usados.get(uid, 0) for uid in capacidad}
+        self.heap = [
+            (self._turno(uid), uid) for uid, restante in capacidad.items() if restante > 0
+        ]
+        heapq.heapify(self.heap)
+
+    def _turno(self, uid):
+        peso = float(self.config.get(uid, {}).get("peso", 1)) or 1.0
+        return (self.asignados[uid] + 1) / peso
+
+    def elegir(self, lead):
+        if not self.heap:
+            return None
+        _, uid = heapq.heappop(self.heap)
+        self.capacidad[uid] -= 1
+        self.asignados[uid] += 1
+        if self.capacidad[uid] > 0:
+            heapq.heappush(self.heap, (self._turno(uid), uid))
+        return uid
+
+
+class EstrategiaCurso(Estrategia):
+    """
+    Enruta cada lead a los asesores que venden su "Curso Interesado" (clave
+    "cursos" de la configuración) y, entre ellos, al de más capacidad.
+    Los asesores sin "cursos" son generalistas: reciben los cursos sin
+    especialista o cuyos especialistas están completos.
+    Un heap por curso con invalidación perezosa: un asesor puede estar en
+    varios heaps y sus entradas antiguas se descartan al salir.
+    """
+
+    nombre = "curso"
+
+    def __init__(self, capacidad, config=None, usados=None):
+        super().__init__(capacidad, config, usados)
+        self.heaps = defaultdict(list)
+        self.generalistas = []
+        for uid, restante in capacidad.items():
+            if restante <= 0:
+                continue
+            cursos = self.config.get(uid, {}).get("cursos") or []
+            for curso in cursos:
+                self.heaps[self._clave(curso)].append((-restante, uid))
+            if not cursos:
+                self.generalistas.append((-restante, uid))
+        for heap in self.heaps.values():
+            heapq.heapify(heap)
+        heapq.heapify(self.generalistas)
+
+    @staticmethod
+    def _clave(curso):
+        return (curso or "").strip().lower()
+
+    def _sacar(self, heap):
+        while heap:
+            neg, uid = heapq.heappop(heap)
+            restante = self.capacidad[uid]
+            if restante <= 0:
+                continue
+            if -neg != restante:
+                # entrada obsoleta: el asesor se eligió desde otro curso
+                heapq.heappush(heap, (-restante, uid))
+                continue
+            self.capacidad[uid] -= 1
+            if self.capacidad[uid] > 0:
+                heapq.heappush(heap, (-self.capacidad[uid], uid))
+            return uid
+        return None
+
+    def elegir(self, lead):
+        heap = self.heaps.get(self._clave(lead.get("curso")))
+        uid = self._sacar(heap) if heap else None
+        if uid is None:
+            uid = self._sacar(self.generalistas)
+        return uid
+
+
+class EstrategiaRoundRobin(Estrategia):
+    """Turno rotatorio entre los asesores con capacidad, O(1) por lead."""
+
+    nombre = "round-robin"
+
+    def __init__(self, capacidad, config=None, usados=None):
+        super().__init__(capacidad, config, usados)
+        self.turnos = deque(sorted(uid for uid, restante in capacidad.items() if restante > 0))
+
+    def elegir(self, lead):
+        if not self.turnos:
+            return None
+        uid = self.turnos.popleft()
+        self.capacidad[uid] -= 1
+        if self.capacidad[uid] > 0:
+            self.turnos.append(uid)
+        return uid
+
+
+ESTRATEGIAS = {
+    cls.nombre: cls
+    for cls in (EstrategiaCapacidad, EstrategiaPonderada, EstrategiaCurso, EstrategiaRoundRobin)
+}
+
+
+def cargar_config_asesores(path, asesores):
+    """
+    Lee el JSON de --config-asesores: {asesor: {"max": 30, "peso": 2,
+    "cursos": ["Salud"]}}, donde asesor es el id de VTiger o el user_name.
+    Devuelve la configuración indexada por id.
+    """
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        bruto = json.load(f)
+    por_nombre = {nombre: uid for uid, nombre in asesores.items()}
+    config = {}
+    for clave, valores in bruto.items():
+        uid = clave if clave in asesores else por_nombre.get(clave)
+        if uid is None:
+            logging.warning("Asesor '%s' de la configuración no está activo; se ignora.", clave)
+            continue
+        config[uid] = valores
+    return config
+
+
+def asignar_leads(session, leads, estrategia, lote=None, journal=None, snapshot=None):
+    """
+    Generador: deduplica (CSV y VTiger) y asigna asesor a cada lead.
+    Los leads se consumen en lotes de `lote` filas: cada lote se resuelve
+    contra VTiger con buscar_existentes_bulk() y después se asigna fila a
+    fila con `estrategia` (ver Estrategia). Se detiene al agotarse la capacidad.
+    Con `journal`, las filas ya resueltas en otra ejecución se saltan sin
+    consultar VTiger y los duplicados encontrados quedan registrados.
+    Con `snapshot` la deduplicación contra VTiger se resuelve en memoria.
+    """
+    usado_keys = set()  # (email.lower(), phone) asignados; acotado por la capacidad diaria
+
+    for bloque in en_lotes(leads, lote or LOTE_STREAMING):
+        if journal is not None:
+            hechos = journal.completados(hash_lead(lead) for lead in bloque)
+            if hechos:
+                pendientes = []
+                for lead in bloque:
+                    if hash_lead(lead) in hechos:
+                        usado_keys.add((lead["email"].lower(), lead["telefono"]))
+                    else:
+                        pendientes.append(lead)
+                logging.info("Journal: %d filas ya completadas, se saltan.", len(bloque) - len(pendientes))
+                bloque = pendientes
+                if not bloque:
+                    continue
+
+        emails = {lead["email"].lower() for lead in bloque if lead["email"]}
+        telefonos = {lead["telefono"] for lead in bloque if lead["telefono"]}
+
+        # resolver duplicados contra VTiger con pocas consultas en bloque
+        try:
+            if snapshot is not None:
+                emails_existentes, telefonos_existentes = snapshot.buscar_existentes(emails, telefonos)
+            else:
+                emails_existentes, telefonos_existentes = buscar_existentes_bulk(session, emails, telefonos)
+            bulk_ok = True
+        except Exception as e:
+            logging.warning("Fallo en la deduplicación en bloque (%s); se usa lookup fila a fila.", e)
+            bulk_ok = False
+
+        for lead in bloque:
             key = (lead["email"].lower(), lead["telefono"])
             if key in usado_keys:
                 logging.info("Saltando duplicado en CSV: %s / %s", lead["email"], lead["telefono"])
                 continue
 
             # Verificar duplicado en VTiger por email o teléfono
-            existe = False
-            if lead["email"]:
-                res = lookup_email_or_phone(session, lead["email"], typ="email", modules=["Leads"])
-                if res:
+            if bulk_ok:
+                existe = False
+                if lead["email"] and key[0] in emails_existentes:
                     logging.info("Lead con email ya existe, se omite: %s", lead["email"])
                     existe = True
-            if not existe and lead["telefono"]:
-                res = lookup_email_or_phone(session, lead["telefono"], typ="phone", modules=["Leads"])
-                if res:
+                elif lead["telefono"] and lead["telefono"] in telefonos_existentes:
                     logging.info("Lead con teléfono ya existe, se omite: %s", lead["telefono"])
                     existe = True
+            else:
+                existe = existe_en_vtiger(session, lead)
             if existe:
+                if journal is not None:
+                    journal.marcar(lead, "existe")
                 continue
 
-            # elegir asesor con más capacidad restante
-            candidatos = sorted(
-                [(uid, capacidad[uid]) for uid in capacidad if capacidad[uid] > 0],
-                key=lambda x: (-x[1], x[0])
-            )
-            if not candidatos:
-                logging.warning("Se agotó la capacidad diaria: no quedan asesores con espacio.")
-                break
-            asesor_id, restante = candidatos[0]
-            asignaciones.append({"lead": lead, "asesor_id": asesor_id})
-            capacidad[asesor_id] -= 1
+            asesor_id = estrategia.elegir(lead)
+            if asesor_id is None:
+                if estrategia.agotada():
+                    logging.warning("Se agotó la capacidad diaria: no quedan asesores con espacio.")
+                    return
+                logging.warning("Sin asesor disponible para %s (curso %s); se omite.", lead["email"], lead["curso"])
+                continue
             usado_keys.add(key)
-            logging.info("Asignado lead %s/%s a asesor %s (queda %d)", lead["email"], lead["phone"], asesor_id, capacidad[asesor_id])
-
-    resultados = []
-    for item in asignaciones:
-        lead = item["lead"]
-        asesor_id = item["asesor_id"]
-        if dry_run:
-            resultados.append({
-                **lead,
-                "assigned_to": asesor_id,
-                "assigned_to_name": asesores[asesor_id],
+            logging.info("Asignado lead %s/%s a asesor %s (queda %d)", lead["email"], lead["telefono"], asesor_id, estrategia.capacidad[asesor_id])
+            yield {"lead": lead, "asesor_id": asesor_id}
+
+
+def procesar_leads(session, csv_path, dry_run=True, workers=1, journal=None,
+                   estrategia="capacidad", config_asesores=None, leidas=None,
+                   hilos_lectura=HILOS_LECTURA, parser=None, snapshot=None, contadores=None):
+    """
+    Pipeline en streaming: leer -> normalizar -> deduplicar -> asignar -> crear.
+    Generador que devuelve cada fila de resultado, en el orden del CSV, en
+    cuanto es definitiva; la memoria no depende del tamaño del fichero.
+    Con `journal` (ver Journal) cada paso queda registrado para poder reanudar.
+    `estrategia` es una clave de ESTRATEGIAS y `config_asesores` la ruta del
+    JSON con máximo diario, peso y cursos por asesor.
+    `csv_path` puede ser una ruta o una lista de rutas: todos los ficheros
+    comparten deduplicación y capacidad; se leen en paralelo con hasta
+    `hilos_lectura` hilos y `leidas` acumula las filas leídas por archivo.
+    `parser` elige el lector de CSV (ver leer_leads(); por defecto PARSER).
+    Con `snapshot` (ver Snapshot) asesores, conteos y duplicados salen del
+    snapshot local: en dry-run no se hace ninguna llamada a VTiger.
+    Con `contadores` (ver ContadorLeads) los leads de hoy por asesor salen
+    del almacén local en vez de la consulta GROUP BY.
+    """
+    asesores = snapshot.asesores if snapshot is not None else get_asesores_activos(session)
+    if not asesores:
+        logging.error("No se encontraron asesores activos.")
+        return
+
+    config = cargar_config_asesores(config_asesores, asesores)
+    if snapshot is not None:
+        leads_por_asesor = snapshot.leads_hoy_vigentes()
+    elif contadores is not None:
+        leads_por_asesor = contadores.leads_hoy(session)
+    else:
+        leads_por_asesor = contar_leads_hoy_por_asesor(session)
+    capacidad = {}
+    for uid in asesores:
+        usados = leads_por_asesor.get(uid, 0)
+        maximo = int(config.get(uid, {}).get("max", MAX_LEADS_POR_DIA))
+        capacidad[uid] = max(0, maximo - usados)
+    logging.info("Capacidades iniciales (restantes hoy) por asesor: %s", capacidad)
+
+    selector = ESTRATEGIAS[estrategia](capacidad, config, leads_por_asesor)
+    leads = leer_entradas(csv_path, hilos=hilos_lectura, leidas=leidas, parser=parser)
+    asignaciones = asignar_leads(session, leads, selector, journal=journal, snapshot=snapshot)
+
+    if dry_run:
+        for item in asignaciones:
+            yield {
+                **item["lead"],
+                "assigned_to": item["asesor_id"],
+                "assigned_to_name": asesores[item["asesor_id"]],
                 "leadid": None,
                 "status": "planned"
-            })
-            continue
+            }
+        return
+
+    def crear(item):
+        if journal is not None:
+            journal.marcar(item["lead"], "creando", asesor_id=item["asesor_id"])
+        resultado = crear_lead_asignado(session, item["lead"], item["asesor_id"], asesores)
+        creado = resultado["status"] == "created"
+        if journal is not None:
+            journal.marcar(item["lead"], "creado" if creado else "error", leadid=resultado["leadid"])
+        if creado and snapshot is not None:
+            snapshot.registrar(item["lead"])
+        if creado and contadores is not None:
+            contadores.registrar(resultado["leadid"], item["asesor_id"])
+        return resultado
 
-        # montar payload para crear lead con assigned_user_id
-        element = {
-            "nombre": lead["nombre"],
-            "curso": lead["curso"],
-            "email": lead["email"],
-            "telefono": lead["telefono"],
-            "assigned_user_id": asesor_id,
-            "origen": lead["origen"],
+    if workers <= 1:
+        for item in asignaciones:
+            yield crear(item)
+        return
+
+    # la capacidad ya está descontada al asignar, así que las creaciones se lanzan
+    # en paralelo; la cola de futures (acotada) devuelve los resultados en orden
+    pendientes = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for item in asignaciones:
+            pendientes.append(pool.submit(crear, item))
+            while pendientes and (len(pendientes) >= workers * 2 or pendientes[0].done()):
+                yield pendientes.popleft().result()
+        while pendientes:
+            yield pendientes.popleft().result()
+
+
+def repartir_leads(session, csv_path, dry_run=True, workers=1, journal=None,
+                   estrategia="capacidad", config_asesores=None, leidas=None,
+                   hilos_lectura=HILOS_LECTURA, parser=None, snapshot=None, contadores=None):
+    """Versión en lista de procesar_leads() (útil para ficheros pequeños y tests)."""
+    return list(procesar_leads(
+        session, csv_path, dry_run=dry_run, workers=workers, journal=journal,
+        estrategia=estrategia, config_asesores=config_asesores, leidas=leidas,
+        hilos_lectura=hilos_lectura, parser=parser, snapshot=snapshot, contadores=contadores,
+    ))
+
+
+def crear_lead_asignado(session, lead, asesor_id, asesores):
+    """
+    Crea en VTiger un lead ya asignado y devuelve la fila de resultado,
+    incluyendo la latencia de la llamada create (segundos) en "latencia".
+    """
+    # montar payload para crear lead con assigned_user_id
+    element = {
+        "nombre": lead["nombre"],
+        "curso": lead["curso"],
+        "email": lead["email"],
+        "telefono": lead["telefono"],
+        "assigned_user_id": asesor_id,
+        "origen": lead["origen"],
+    }
+    inicio = time.perf_counter()
+    try:
+        created = create_record(session, "Leads", element)
+        resultado = {
+            **lead,
+            "assigned_to": asesor_id,
+            "assigned_to_name": asesores[asesor_id],
+            "leadid": created.get("id"),
+            "status": "created"
         }
-        try:
-            created = create_record(session, "Leads", element)
-            resultados.append({
-                **lead,
-                "assigned_to": asesor_id,
-                "assigned_to_name": asesores[asesor_id],
-                "leadid": created.get("id"),
-                "status": "created"
-            })
-            logging.info("Lead creado: %s -> %s (ID: %s)", lead["email"], asesores[asesor_id], created.get("id"))
-        except Exception as e:
-            logging.error("Error creando lead %s: %s", lead["email"], str(e))
-            resultados.append({
-                **lead,
-                "assigned_to": asesor_id,
-                "assigned_to_name": asesores[asesor_id],
-                "leadid": None,
-                "status": f"error: {e}"
-            })
+        logging.info("Lead creado: %s -> %s (ID: %s)", lead["email"], asesores[asesor_id], created.get("id"))
+    except Exception as e:
+        logging.error("Error creando lead %s: %s", lead["email"], str(e))
+        resultado = {
+            **lead,
+            "assigned_to": asesor_id,
+            "assigned_to_name": asesores[asesor_id],
+            "leadid": None,
+            "status": f"error: {e}"
+        }
+    resultado["latencia"] = time.perf_counter() - inicio
+    return resultado
 
-    return resultados
 
+def percentil(valores, p):
+    """Percentil p (0-100) por rango más cercano sobre una lista ordenada."""
+    if not valores:
+        return 0.0
+    idx = max(0, min(len(valores) - 1, math.ceil(p / 100.0 * len(valores)) - 1))
+    return valores[idx]
 
-def escribir_csv(resultados, salida):
-    campos = ["Nombre", "Email", "Teléfono", "Curso Interesado", "AssignedToID", "AssignedToName", "LeadID", "Status"]
-    with open(salida, "w", newline="", encoding="utf-8") as f:
+
+def resumen_rendimiento(resultados, segundos):
+    """
+    Throughput de la ejecución: leads creados por segundo y latencias
+    p50/p95 (ms) de las llamadas create.
+    """
+    latencias = sorted(r["latencia"] for r in resultados if "latencia" in r)
+    return {
+        "creates": len(latencias),
+        "leads_por_segundo": len(latencias) / segundos if segundos > 0 else 0.0,
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p95_ms": percentil(latencias, 95) * 1000,
+    }
+
+
+def escribir_csv(resultados, salida, anexar=False):
+    """
+    Escribe el CSV de resultados. `resultados` puede ser una lista o el
+    generador de procesar_leads(): cada fila se vuelca a disco en cuanto
+    llega, de modo que la salida parcial sobrevive si la ejecución se corta.
+    Con `anexar` (--resume) las filas se añaden a la salida de la ejecución
+    interrumpida, que ya tiene las filas que el journal da por terminadas.
+    """
+    campos = ["Nombre", "Email", "Teléfono", "Curso Interesado", "AssignedToID", "AssignedToName", "LeadID", "Status", "Archivo"]
+    anexar = anexar and os.path.exists(salida) and os.path.getsize(salida) > 0
+    with open(salida, "a" if anexar else "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
-        writer.writerow(campos)
+        if not anexar:
+            writer.writerow(campos)
         for r in resultados:
             writer.writerow([
                 r.get("nombre", ""),
@@ -251,24 +1198,134 @@ def escribir_csv(resultados, salida):
                 r.get("assigned_to_name", ""),
                 r.get("leadid", ""),
                 r.get("status", ""),
+                r.get("archivo", ""),
             ])
+            f.flush()
     logging.info("Se escribió CSV de salida en %s", salida)
 
 
+def resumen_por_archivo(resultados, leidas):
+    """
+    Resumen por fichero de entrada: filas leídas, asignadas (created o
+    planned), errores y omitidas (duplicados o sin capacidad/asesor).
+    """
+    resumen = {archivo: {"leidas": n, "asignadas": 0, "errores": 0} for archivo, n in leidas.items()}
+    for r in resultados:
+        fila = resumen.setdefault(r.get("archivo", ""), {"leidas": 0, "asignadas": 0, "errores": 0})
+        if r["status"] in ("created", "planned"):
+            fila["asignadas"] += 1
+        else:
+            fila["errores"] += 1
+    for fila in resumen.values():
+        fila["omitidas"] = max(0, fila["leidas"] - fila["asignadas"] - fila["errores"])
+    return resumen
+
+
+def escribir_resumen_por_archivo(resumen, salida):
+    with open(salida, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Archivo", "Leidas", "Asignadas", "Errores", "Omitidas"])
+        for archivo in sorted(resumen):
+            fila = resumen[archivo]
+            writer.writerow([archivo, fila["leidas"], fila["asignadas"], fila["errores"], fila["omitidas"]])
+    logging.info("Se escribió el resumen por archivo en %s", salida)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Distribución de leads usando API VTiger 8.1")
-    parser.add_argument("csv", help="Archivo CSV de entrada con leads")
+    parser.add_argument("csv", nargs="?", help="CSV de entrada con leads, directorio con CSVs o patrón glob (entre comillas)")
     parser.add_argument("--apply", action="store_true", help="Crear realmente los leads (sin esto es dry-run)")
     parser.add_argument("--output", default="output.csv", help="CSV de resultados")
+    parser.add_argument("--workers", type=int, default=1, help="Creaciones concurrentes en VTiger con --apply (por defecto 1)")
+    parser.add_argument("--journal", default=JOURNAL_PATH, help="Journal SQLite de la ejecución con --apply")
+    parser.add_argument("--resume", action="store_true", help="Reanudar con --apply saltando las filas ya completadas en el journal")
+    parser.add_argument("--estrategia", choices=sorted(ESTRATEGIAS), default="capacidad", help="Política de asignación (por defecto capacidad)")
+    parser.add_argument("--config-asesores", help="JSON con máximo diario, peso y cursos por asesor (id o user_name)")
+    parser.add_argument("--hilos-lectura", type=int, default=HILOS_LECTURA, help="Ficheros de entrada leídos en paralelo")
+    parser.add_argument("--parser", choices=["auto", "stdlib", "pyarrow", "polars"], default=PARSER, help="Lector de CSV (auto usa pyarrow si está instalado)")
+    parser.add_argument("--snapshot", metavar="RUTA", help="Exportar asesores, conteos de hoy y claves de Leads a RUTA (.json.gz) y salir")
+    parser.add_argument("--desde-snapshot", metavar="RUTA", help="Planificar contra un snapshot local en vez de consultar VTiger")
+    parser.add_argument("--reconciliar", action="store_true", help="Con --desde-snapshot: actualizar el snapshot de forma incremental antes de repartir")
+    parser.add_argument("--contadores", default=CONTADORES_PATH, help="SQLite con los leads de hoy por asesor ('' para usar la consulta GROUP BY)")
+    parser.add_argument("--reconciliar-cada", type=int, default=RECONCILIAR_CADA, help="Segundos entre reconciliaciones de los contadores con VTiger")
     args = parser.parse_args()
 
-    session = login()
-    resultados = repartir_leads(session, args.csv, dry_run=not args.apply)
-    escribir_csv(resultados, args.output)
+    if args.snapshot:
+        snap = Snapshot.desde_vtiger(login())
+        snap.guardar(args.snapshot)
+        return
+    if not args.csv:
+        parser.error("falta el CSV de entrada")
+    if args.apply and args.desde_snapshot and not args.reconciliar:
+        parser.error("--apply con --desde-snapshot requiere --reconciliar (el snapshot puede estar desactualizado)")
+
+    entradas = resolver_entradas(args.csv)
+    logging.info("Ficheros de entrada (%d): %s", len(entradas), ", ".join(entradas))
+
+    journal = None
+    if args.apply:
+        journal = Journal(args.journal, reanudar=args.resume)
+        if args.resume:
+            logging.info("Reanudando desde %s: %s", args.journal, journal.resumen())
+    elif args.resume:
+        logging.warning("--resume solo tiene efecto junto con --apply; se ignora.")
+
+    snapshot = Snapshot.cargar(args.desde_snapshot) if args.desde_snapshot else None
+    contadores = None
+    # con --desde-snapshot los conteos salen del snapshot, pero lo que se crea
+    # con --apply se registra igual para las ejecuciones que usen los contadores
+    if args.contadores and (snapshot is None or args.apply):
+        contadores = ContadorLeads(args.contadores, intervalo=args.reconciliar_cada)
+    session = None
+    if snapshot is None or args.reconciliar or args.apply:
+        ensure_pool_size(http_session, args.workers)
+        session = login()
+        if snapshot is not None:
+            snapshot.reconciliar(session)
+            snapshot.guardar(args.desde_snapshot)
+    inicio = time.perf_counter()
+    conteo = {"created": 0, "planned": 0}
+    aplicados = []  # filas con latencia de create (acotadas por la capacidad diaria)
+    leidas = {}
+    estados = []  # archivo y status de cada fila, para el resumen por archivo
+
+    def contar(resultados):
+        for r in resultados:
+            if r["status"] in conteo:
+                conteo[r["status"]] += 1
+            if "latencia" in r:
+                aplicados.append(r)
+            estados.append({"archivo": r.get("archivo", ""), "status": r["status"]})
+            yield r
+
+    try:
+        escribir_csv(contar(procesar_leads(
+            session, entradas, dry_run=not args.apply, workers=args.workers, journal=journal,
+            estrategia=args.estrategia, config_asesores=args.config_asesores, leidas=leidas,
+            hilos_lectura=args.hilos_lectura, parser=args.parser, snapshot=snapshot,
+            contadores=contadores,
+        )), args.output, anexar=args.apply and args.resume)
+    finally:
+        if journal is not None:
+            journal.close()
+        if contadores is not None:
+            contadores.close()
+        if snapshot is not None and args.apply:
+            snapshot.guardar(args.desde_snapshot)
+    duracion = time.perf_counter() - inicio
     # resumen
-    creados = [r for r in resultados if r["status"] == "created"]
-    planificados = [r for r in resultados if r["status"] == "planned"]
-    logging.info("Resumen: %d creados, %d planeados/omitidos.", len(creados), len(planificados))
+    logging.info("Resumen: %d creados, %d planeados/omitidos.", conteo["created"], conteo["planned"])
+    if len(entradas) > 1:
+        resumen = resumen_por_archivo(estados, leidas)
+        base, ext = os.path.splitext(args.output)
+        escribir_resumen_por_archivo(resumen, f"{base}_por_archivo{ext or '.csv'}")
+    if args.apply:
+        rend = resumen_rendimiento(aplicados, duracion)
+        logging.info(
+            "Rendimiento (%d workers): %d creates en %.1fs, %.1f leads/s, latencia p50 %.0f ms, p95 %.0f ms",
+            args.workers, rend["creates"], duracion, rend["leads_por_segundo"], rend["p50_ms"], rend["p95_ms"],
+        )
+        logging.info("Ritmo hacia VTiger (token bucket/AIMD): %s", get_limiter().stats())
 
 
 if __name__ == "__main__":
@@ -1,5 +1,7 @@
 import csv
 import os
+import re
+import sys
 import pytest
 from pathlib import Path
 import builtins
@@ -24,7 +26,7 @@ class DummyResponse:
 @pytest.fixture(autouse=True)
 def patch_requests(monkeypatch):
     """
-    Intercepta requests.get y requests.post usadas en login/query/create.
+    Intercepta get y post de la sesión HTTP compartida usadas en login/query/create.
     Se delega el comportamiento a funciones reemplazadas durante cada test.
     """
     # Default fallback, individual tests pueden sobreescribir estos dicts
@@ -39,8 +41,18 @@ def patch_requests(monkeypatch):
         "lookup_email": [],
         "lookup_phone": [],
         "created_leads": [],
+        "lookup_calls": 0,  # número de llamadas a operation=lookup
+        "bulk_queries": [],  # consultas WHERE ... IN (...) recibidas
+        "bulk_fails": False,  # simular fallo de la consulta en bloque
+        "leads_existentes": [],  # filas de Leads para la exportación paginada (snapshot)
+        "snapshot_queries": [],  # consultas paginadas sobre Leads (snapshot y contadores)
     }
 
+    def paginar(q, filas):
+        # como vtiger: LIMIT offset, n recorta el resultado
+        m = re.search(r"LIMIT (\d+), (\d+)", q)
+        return filas[int(m.group(1)):int(m.group(1)) + int(m.group(2))] if m else filas
+
     def fake_get(url, params=None, **kwargs):
         op = params.get("operation")
         if op == "getchallenge":
@@ -49,14 +61,35 @@ def patch_requests(monkeypatch):
             q = params.get("query", "")
             # Usuarios activos
             if "FROM Users" in q:
-                return DummyResponse({"success": True, "result": state["users"]})
+                return DummyResponse({"success": True, "result": paginar(q, state["users"])})
             # Leads hoy por asesor
             if "FROM vtiger_crmentity" in q and "setype='Leads'" in q:
                 # Devuelve filas con smownerid y cnt
-                return DummyResponse({"success": True, "result": state["leads_count_today"]})
+                return DummyResponse({"success": True, "result": paginar(q, state["leads_count_today"])})
+            # Exportación paginada de Leads (snapshot)
+            m = re.search(r"FROM Leads(?: WHERE (\w+) >= '([^']*)')? ORDER BY \w+ LIMIT (\d+), (\d+)", q)
+            if m:
+                state["snapshot_queries"].append(q)
+                filas = [r for r in state["leads_existentes"] if not m.group(1) or r.get(m.group(1), "") >= m.group(2)]
+                offset, limite = int(m.group(3)), int(m.group(4))
+                return DummyResponse({"success": True, "result": filas[offset:offset + limite]})
+            # Deduplicación en bloque sobre Leads
+            m = re.search(r"FROM Leads WHERE (email|phone) IN \((.*)\)", q)
+            if m:
+                state["bulk_queries"].append(q)
+                if state["bulk_fails"]:
+                    return DummyResponse({"success": False, "error": "query error"})
+                campo = m.group(1)
+                valores = re.findall(r"'((?:[^'\\]|\\.)*)'", m.group(2))
+                conocidos = state["lookup_email"] if campo == "email" else state["lookup_phone"]
+                conocidos = [c.lower() for c in conocidos]
+                return DummyResponse({"success": True, "result": paginar(q, [
+                    {"id": "dummy_existing", campo: v} for v in valores if v.lower() in conocidos
+                ])})
             # Fallback
             return DummyResponse({"success": True, "result": []})
         elif op == "lookup":
+            state["lookup_calls"] += 1
             typ = params.get("type")
             val = params.get("value", "")
             if typ == "email" and val.lower() in [e.lower() for e in state["lookup_email"]]:
@@ -80,8 +113,8 @@ def patch_requests(monkeypatch):
             return DummyResponse({"success": True, "result": result})
         return DummyResponse({"success": False, "error": "unknown operation"}, status_code=400)
 
-    monkeypatch.setattr(dl.requests, "get", fake_get)
-    monkeypatch.setattr(dl.requests, "post", fake_post)
+    monkeypatch.setattr(dl.http_session, "get", fake_get)
+    monkeypatch.setattr(dl.http_session, "post", fake_post)
     # Exponer el estado al test si lo quiere modificar
     return state
 
@@ -182,3 +215,389 @@ def test_real_creation_creates_leads_and_writes_csv(patch_requests, sample_csv,
     headers = reader[0]
     assert "AssignedToID" in headers
     assert "LeadID" in headers
+
+def test_bulk_dedup_avoids_per_row_lookups(patch_requests, sample_csv):
+    state = patch_requests
+    state["lookup_phone"] = ["600654321"]
+    session = dl.login()
+    resultados = dl.repartir_leads(session, sample_csv, dry_run=True)
+    # Ana se omite por teléfono existente, sin ninguna llamada a lookup
+    assert [r["email"] for r in resultados] == ["juan.perez@example.com"]
+    assert state["lookup_calls"] == 0
+    # una consulta para emails y otra para teléfonos
+    assert len(state["bulk_queries"]) == 2
+
+def test_bulk_dedup_chunks_queries(patch_requests, sample_csv):
+    state = patch_requests
+    session = dl.login()
+    emails, telefonos = dl.buscar_existentes_bulk(
+        session, {"a@x.com", "b@x.com", "c@x.com"}, set(), chunk=2
+    )
+    assert emails == set() and telefonos == set()
+    assert len(state["bulk_queries"]) == 2
+
+def test_active_advisors_are_paged_past_100(patch_requests):
+    state = patch_requests
+    state["users"] = [{"id": f"19x{i}", "user_name": f"asesor.{i}"} for i in range(230)]
+    session = dl.login()
+    asesores = dl.get_asesores_activos(session)
+    # vtiger devuelve 100 filas por consulta: sin paginar se perderían 130 asesores
+    assert len(asesores) == 230
+
+def test_bulk_dedup_falls_back_to_lookup(patch_requests, sample_csv):
+    state = patch_requests
+    state["bulk_fails"] = True
+    state["lookup_email"] = ["juan.perez@example.com"]
+    session = dl.login()
+    resultados = dl.repartir_leads(session, sample_csv, dry_run=True)
+    assert [r["email"] for r in resultados] == ["ana.gomez@example.com"]
+    assert state["lookup_calls"] > 0
+
+def test_concurrent_creation_keeps_input_order(patch_requests, tmp_path):
+    state = patch_requests
+    path = tmp_path / "leads_many.csv"
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Nombre", "Email", "Teléfono", "Curso Interesado", "Fecha entrada", "Origen del leads"])
+        for i in range(30):
+            writer.writerow([f"Lead {i}", f"lead{i}@example.com", f"6000000{i:02d}", "Salud", "28/07/2025", "SEO"])
+    session = dl.login()
+    resultados = dl.repartir_leads(session, str(path), dry_run=False, workers=8)
+    assert [r["email"] for r in resultados] == [f"lead{i}@example.com" for i in range(30)]
+    assert all(r["status"] == "created" for r in resultados)
+    assert len(state["created_leads"]) == 30
+    # la capacidad se reparte igual que en modo secuencial (15 + 15)
+    por_asesor = {}
+    for r in resultados:
+        por_asesor[r["assigned_to"]] = por_asesor.get(r["assigned_to"], 0) + 1
+    assert sorted(por_asesor.values()) == [15, 15]
+
+def test_resumen_rendimiento():
+    resultados = [{"latencia": v / 1000.0} for v in range(1, 101)]
+    rend = dl.resumen_rendimiento(resultados, 2.0)
+    assert rend["creates"] == 100
+    assert rend["leads_por_segundo"] == 50.0
+    assert rend["p50_ms"] == pytest.approx(50)
+    assert rend["p95_ms"] == pytest.approx(95)
+
+def test_streaming_pipeline_dedups_per_chunk(patch_requests, tmp_path, monkeypatch):
+    state = patch_requests
+    monkeypatch.setattr(dl, "LOTE_STREAMING", 2)
+    path = tmp_path / "leads_stream.csv"
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Nombre", "Email", "Teléfono", "Curso Interesado", "Fecha entrada", "Origen del leads"])
+        for i in range(5):
+            writer.writerow([f"Lead {i}", f"lead{i}@example.com", f"6000000{i:02d}", "Salud", "28/07/2025", "SEO"])
+    session = dl.login()
+    pipeline = dl.procesar_leads(session, str(path), dry_run=True)
+    # el generador es perezoso: nada se consulta hasta pedir la primera fila
+    assert state["bulk_queries"] == []
+    primero = next(pipeline)
+    assert primero["email"] == "lead0@example.com"
+    assert len(state["bulk_queries"]) == 2  # solo el primer lote (emails + teléfonos)
+    resto = list(pipeline)
+    assert [r["email"] for r in resto] == [f"lead{i}@example.com" for i in range(1, 5)]
+    assert len(state["bulk_queries"]) == 6  # 3 lotes
+
+def test_resume_skips_rows_completed_in_journal(patch_requests, sample_csv, tmp_path):
+    state = patch_requests
+    session = dl.login()
+    journal_path = str(tmp_path / "journal.sqlite")
+
+    # primera ejecución: solo se completa Juan (simulamos un corte tras el primer create)
+    journal = dl.Journal(journal_path)
+    pipeline = dl.procesar_leads(session, sample_csv, dry_run=False, journal=journal)
+    assert next(pipeline)["email"] == "juan.perez@example.com"
+    pipeline.close()
+    journal.close()
+    assert len(state["created_leads"]) == 1
+
+    # reanudación: Juan se salta sin tocar VTiger; solo se crea Ana
+    state["bulk_queries"].clear()
+    journal = dl.Journal(journal_path, reanudar=True)
+    resultados = dl.repartir_leads(session, sample_csv, dry_run=False, journal=journal)
+    assert [r["email"] for r in resultados] == ["ana.gomez@example.com"]
+    assert len(state["created_leads"]) == 2
+    assert all("juan.perez" not in q for q in state["bulk_queries"])
+    assert journal.resumen() == {"creado": 2}
+    journal.close()
+
+    # sin --resume el journal se reinicia
+    journal = dl.Journal(journal_path)
+    assert journal.resumen() == {}
+    journal.close()
+
+def test_resume_appends_to_output_of_interrupted_run(patch_requests, sample_csv, tmp_path, monkeypatch):
+    state = patch_requests
+    salida = tmp_path / "out.csv"
+    argv = ["distribuir_leads_vtiger.py", sample_csv, "--apply", "--contadores", "",
+            "--journal", str(tmp_path / "journal.sqlite"), "--output", str(salida)]
+    post = dl.http_session.post
+
+    def cortar_en_segundo_create(url, data=None, **kwargs):
+        if data.get("operation") == "create" and state["created_leads"]:
+            raise KeyboardInterrupt
+        return post(url, data=data, **kwargs)
+
+    monkeypatch.setattr(dl.http_session, "post", cortar_en_segundo_create)
+    monkeypatch.setattr(sys, "argv", argv)
+    with pytest.raises(KeyboardInterrupt):
+        dl.main()
+
+    monkeypatch.setattr(dl.http_session, "post", post)
+    monkeypatch.setattr(sys, "argv", argv + ["--resume"])
+    dl.main()
+    with open(salida, newline="", encoding="utf-8") as f:
+        filas = list(csv.DictReader(f))
+    # la fila creada en la primera ejecución sigue en la salida, con su LeadID
+    assert [(r["Email"], r["LeadID"], r["Status"]) for r in filas] == [
+        ("juan.perez@example.com", "created-id-1", "created"),
+        ("ana.gomez@example.com", "created-id-2", "created"),
+    ]
+
+def test_heap_selection_matches_sorted_selection():
+    capacidad = {"19x3": 2, "19x1": 3, "19x2": 3, "19x4": 0}
+    esperado = []
+    copia = dict(capacidad)
+    while any(c > 0 for c in copia.values()):
+        uid = sorted([u for u in copia if copia[u] > 0], key=lambda u: (-copia[u], u))[0]
+        copia[uid] -= 1
+        esperado.append(uid)
+    heap = dl.cola_asesores(capacidad)
+    obtenido = []
+    while (uid := dl.elegir_asesor(heap, capacidad)) is not None:
+        obtenido.append(uid)
+    assert obtenido == esperado
+    assert all(c == 0 for c in capacidad.values())
+
+def test_strategy_base_is_abstract():
+    with pytest.raises(TypeError):
+        dl.Estrategia({"19x1": 1})
+    assert all(not cls.__abstractmethods__ for cls in dl.ESTRATEGIAS.values())
+
+def test_round_robin_strategy_alternates():
+    rr = dl.EstrategiaRoundRobin({"19x2": 2, "19x1": 1, "19x3": 0})
+    elegidos = [rr.elegir({}) for _ in range(4)]
+    assert elegidos == ["19x1", "19x2", "19x2", None]
+    assert rr.agotada()
+
+def test_weighted_strategy_follows_weights():
+    capacidad = {"19x1": 100, "20x1": 100}
+    config = {"19x1": {"peso": 3}, "20x1": {"peso": 1}}
+    pond = dl.EstrategiaPonderada(capacidad, config)
+    elegidos = [pond.elegir({}) for _ in range(40)]
+    assert elegidos.count("19x1") == 30
+    assert elegidos.count("20x1") == 10
+
+def test_course_strategy_routes_by_curso(patch_requests, sample_csv, tmp_path):
+    config_path = tmp_path / "asesores.json"
+    config_path.write_text(
+        '{"asesor.uno": {"cursos": ["Electricidad"], "max": 5}, "20x1": {"cursos": ["salud"]}}',
+        encoding="utf-8",
+    )
+    session = dl.login()
+    resultados = dl.repartir_leads(
+        session, sample_csv, dry_run=True, estrategia="curso", config_asesores=str(config_path)
+    )
+    por_email = {r["email"]: r["assigned_to"] for r in resultados}
+    assert por_email == {"juan.perez@example.com": "20x1", "ana.gomez@example.com": "19x1"}
+
+def test_course_strategy_skips_lead_without_advisor():
+    estrategia = dl.EstrategiaCurso({"19x1": 1, "20x1": 1}, {"19x1": {"cursos": ["Salud"]}, "20x1": {"cursos": ["Salud"]}})
+    assert estrategia.elegir({"curso": "Hostelería"}) is None
+    assert not estrategia.agotada()
+    assert estrategia.elegir({"curso": "Salud"}) == "19x1"
+    assert estrategia.elegir({"curso": "Salud"}) == "20x1"
+    assert estrategia.agotada()
+
+def _write_leads(path, filas):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Nombre", "Email", "Teléfono", "Curso Interesado", "Fecha entrada", "Origen del leads"])
+        writer.writerows(filas)
+
+def test_multi_file_ingestion_dedups_across_files(patch_requests, tmp_path):
+    entrada = tmp_path / "feeds"
+    entrada.mkdir()
+    _write_leads(entrada / "google_ads.csv", [
+        ["Juan Pérez", "juan.perez@example.com", "600123456", "Salud", "28/07/2025", "Google_ads"],
+        ["Ana Gómez", "ana.gomez@example.com", "600654321", "Electricidad", "28/07/2025", "Google_ads"],
+    ])
+    _write_leads(entrada / "tiktok_ads.csv", [
+        ["Juan Pérez", "juan.perez@example.com", "600123456", "Salud", "29/07/2025", "TikTok_ads"],
+        ["Sara López", "sara@example.com", "600000004", "Salud", "29/07/2025", "TikTok_ads"],
+    ])
+    rutas = dl.resolver_entradas(str(entrada))
+    assert [os.path.basename(r) for r in rutas] == ["google_ads.csv", "tiktok_ads.csv"]
+    assert dl.resolver_entradas(str(entrada / "tik*.csv")) == rutas[1:]
+
+    session = dl.login()
+    leidas = {}
+    resultados = dl.repartir_leads(session, rutas, dry_run=True, leidas=leidas, hilos_lectura=2)
+    assert [(r["archivo"], r["email"]) for r in resultados] == [
+        ("google_ads.csv", "juan.perez@example.com"),
+        ("google_ads.csv", "ana.gomez@example.com"),
+        ("tiktok_ads.csv", "sara@example.com"),
+    ]
+    resumen = dl.resumen_por_archivo(resultados, leidas)
+    assert resumen["google_ads.csv"] == {"leidas": 2, "asignadas": 2, "errores": 0, "omitidas": 0}
+    assert resumen["tiktok_ads.csv"] == {"leidas": 2, "asignadas": 1, "errores": 0, "omitidas": 1}
+
+def test_multi_file_reader_stops_when_consumer_stops(tmp_path, monkeypatch):
+    monkeypatch.setattr(dl, "COLA_LECTURA", 2)
+    rutas = []
+    for n in range(3):
+        path = tmp_path / f"f{n}.csv"
+        _write_leads(path, [[f"L{i}", f"l{n}_{i}@x.com", f"6{n}{i:05d}", "Salud", "", ""] for i in range(50)])
+        rutas.append(str(path))
+    lector = dl.leer_entradas(rutas, hilos=3)
+    assert next(lector)["email"] == "l0_0@x.com"
+    lector.close()  # no debe quedarse bloqueado esperando a los hilos lectores
+
+@pytest.mark.parametrize("parser", ["stdlib", "pyarrow", "polars"])
+def test_parsers_read_semicolon_csv(parser, tmp_path):
+    if parser != "stdlib":
+        pytest.importorskip(parser)
+    path = tmp_path / "leads_excel.csv"
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["Nombre", "Email", "Teléfono", "Curso Interesado", "Fecha entrada", "Origen del leads"])
+        writer.writerow(["Juan Pérez", " Juan.Perez@example.com ", "600123456 ", "Salud", "28/07/2025", "SEO"])
+        writer.writerow(["Ana Gómez", "ana.gomez@example.com", "600654321", "Electricidad", "28/07/2025", ""])
+        writer.writerow(["Juan Pérez", "juan.perez@example.com", "600123456", "Salud", "29/07/2025", "Portales"])
+    leads = list(dl.leer_leads(str(path), parser=parser))
+    assert [(l["email"], l["telefono"]) for l in leads] == [
+        ("Juan.Perez@example.com", "600123456"),
+        ("ana.gomez@example.com", "600654321"),
+        ("juan.perez@example.com", "600123456"),
+    ]
+    assert leads[0]["curso"] == "Salud" and leads[1]["origen"] == ""
+    assert all(l["archivo"] == "leads_excel.csv" for l in leads)
+    # los duplicados del fichero no se marcan al leer: los resuelve asignar_leads()
+    assert all("duplicado" not in l for l in leads)
+
+@pytest.mark.parametrize("parser", ["pyarrow", "polars"])
+def test_columnar_parsers_read_in_blocks(parser, tmp_path, monkeypatch):
+    pytest.importorskip(parser)
+    monkeypatch.setattr(dl, "BLOQUE_COLUMNAR", 1024)
+    path = tmp_path / "leads.csv"
+    _write_leads(path, [
+        [f"Lead {i}", f" l{i}@x.com ", f"6{i:08d}", "Salud", "28/07/2025", ""] for i in range(500)
+    ])
+    leads = list(dl.leer_leads(str(path), parser=parser))
+    assert [(l["email"], l["telefono"]) for l in leads] == [(f"l{i}@x.com", f"6{i:08d}") for i in range(500)]
+
+@pytest.mark.parametrize("parser", ["stdlib", "pyarrow", "polars"])
+def test_duplicate_row_assigned_when_first_had_no_advisor(parser, patch_requests, tmp_path):
+    if parser != "stdlib":
+        pytest.importorskip(parser)
+    path = tmp_path / "leads.csv"
+    _write_leads(path, [
+        ["Juan Pérez", "juan.perez@example.com", "600123456", "Hostelería", "28/07/2025", ""],
+        ["Juan Pérez", "juan.perez@example.com", "600123456", "Salud", "29/07/2025", ""],
+        ["Juan Pérez", "juan.perez@example.com", "600123456", "Salud", "29/07/2025", ""],
+    ])
+    config_path = tmp_path / "asesores.json"
+    config_path.write_text('{"19x1": {"cursos": ["Salud"]}, "20x1": {"cursos": ["Salud"]}}', encoding="utf-8")
+    resultados = dl.repartir_leads(
+        dl.login(), str(path), dry_run=True, estrategia="curso", config_asesores=str(config_path), parser=parser
+    )
+    # la primera fila no tiene asesor, así que la segunda no cuenta como duplicado; la tercera sí
+    assert [(r["curso"], r["assigned_to"]) for r in resultados] == [("Salud", "19x1")]
+
+def test_snapshot_export_and_offline_planning(patch_requests, sample_csv, tmp_path, monkeypatch):
+    state = patch_requests
+    monkeypatch.setattr(dl, "SNAPSHOT_PAGINA", 2)
+    state["leads_existentes"] = [
+        {"id": "10x1", "email": "Juan.Perez@example.com", "phone": "", "modifiedtime": "2025-07-27 10:00:00"},
+        {"id": "10x2", "email": "", "phone": "699999999", "modifiedtime": "2025-07-27 11:00:00"},
+        {"id": "10x3", "email": "otro@example.com", "phone": "", "modifiedtime": "2025-07-27 12:00:00"},
+    ]
+    session = dl.login()
+    path = str(tmp_path / "crm.json.gz")
+    dl.Snapshot.desde_vtiger(session).guardar(path)
+    # páginas de 2 por modifiedtime: cada una vuelve a pedir desde la última marca vista
+    assert len(state["snapshot_queries"]) == 3
+    assert "modifiedtime >= '2025-07-27 11:00:00'" in state["snapshot_queries"][1]
+
+    snap = dl.Snapshot.cargar(path)
+    assert snap.emails == {"juan.perez@example.com", "otro@example.com"}
+    assert snap.ultima_modificacion == "2025-07-27 12:00:00"
+
+    # el planificador no hace ninguna llamada a VTiger
+    def sin_red(*args, **kwargs):
+        raise AssertionError("no debería llamar a VTiger")
+    monkeypatch.setattr(dl.http_session, "get", sin_red)
+    monkeypatch.setattr(dl.http_session, "post", sin_red)
+    resultados = dl.repartir_leads(None, sample_csv, dry_run=True, snapshot=snap)
+    assert [r["email"] for r in resultados] == ["ana.gomez@example.com"]
+    assert {r["assigned_to"] for r in resultados} <= set(snap.asesores)
+
+def test_snapshot_reconcile_is_incremental(patch_requests, tmp_path):
+    state = patch_requests
+    snap = dl.Snapshot({"19x1": "asesor.uno"}, {}, {"a@x.com"}, set(), ultima_modificacion="2025-07-27 12:00:00")
+    state["leads_existentes"] = [
+        {"id": "10x1", "email": "viejo@x.com", "phone": "", "modifiedtime": "2025-07-26 09:00:00"},
+        {"id": "10x2", "email": "nuevo@x.com", "phone": "600000000", "modifiedtime": "2025-07-28 09:00:00"},
+    ]
+    session = dl.login()
+    assert snap.reconciliar(session) == 1
+    assert "modifiedtime >= '2025-07-27 12:00:00'" in state["snapshot_queries"][0]
+    assert snap.emails == {"a@x.com", "nuevo@x.com"}
+    assert snap.telefonos == {"600000000"}
+    assert set(snap.asesores) == {"19x1", "20x1"}
+
+def test_counter_store_reconciles_incrementally(patch_requests, tmp_path):
+    state = patch_requests
+    hoy = dl.date.today().isoformat()
+    state["leads_existentes"] = [
+        {"id": "10x1", "assigned_user_id": "19x1", "createdtime": f"{hoy} 08:00:00"},
+        {"id": "10x2", "assigned_user_id": "20x1", "createdtime": f"{hoy} 09:00:00"},
+    ]
+    session = dl.login()
+    contadores = dl.ContadorLeads(str(tmp_path / "contadores.sqlite"), intervalo=3600)
+    assert contadores.leads_hoy(session) == {"19x1": 1, "20x1": 1}
+    assert f"createdtime >= '{hoy} 00:00:00'" in state["snapshot_queries"][0]
+
+    # el propio script cuenta lo que crea; dentro del intervalo no se consulta VTiger
+    contadores.registrar("10x3", "19x1")
+    assert contadores.leads_hoy(session) == {"19x1": 2, "20x1": 1}
+    assert len(state["snapshot_queries"]) == 1
+
+    # al reconciliar se parte de la última creación vista y no se duplica 10x3
+    state["leads_existentes"].append({"id": "10x3", "assigned_user_id": "19x1", "createdtime": f"{hoy} 10:00:00"})
+    assert contadores.reconciliar(session) == 0
+    assert f"createdtime >= '{hoy} 09:00:00'" in state["snapshot_queries"][-1]
+    assert contadores.leads_hoy(session) == {"19x1": 2, "20x1": 1}
+    contadores.close()
+
+def test_counter_store_feeds_capacity(patch_requests, sample_csv, tmp_path):
+    state = patch_requests
+    hoy = dl.date.today().isoformat()
+    state["leads_existentes"] = [
+        {"id": f"10x{i}", "assigned_user_id": "19x1", "createdtime": f"{hoy} 08:00:00"} for i in range(25)
+    ]
+    session = dl.login()
+    contadores = dl.ContadorLeads(str(tmp_path / "contadores.sqlite"))
+    resultados = dl.repartir_leads(session, sample_csv, dry_run=False, contadores=contadores)
+    # asesor.uno ya está al tope: todo va a 20x1 y queda contado
+    assert {r["assigned_to"] for r in resultados} == {"20x1"}
+    assert contadores.leads_hoy(session) == {"19x1": 25, "20x1": 2}
+    contadores.close()
+
+def test_snapshot_apply_registers_created_leads_in_counter_store(patch_requests, sample_csv, tmp_path, monkeypatch):
+    session = dl.login()
+    snap_path = str(tmp_path / "crm.json.gz")
+    dl.Snapshot.desde_vtiger(session).guardar(snap_path)
+    contadores_path = str(tmp_path / "contadores.sqlite")
+    monkeypatch.setattr(sys, "argv", [
+        "distribuir_leads_vtiger.py", sample_csv, "--apply", "--desde-snapshot", snap_path, "--reconciliar",
+        "--contadores", contadores_path, "--journal", str(tmp_path / "journal.sqlite"),
+        "--output", str(tmp_path / "out.csv"),
+    ])
+    dl.main()
+    contadores = dl.ContadorLeads(contadores_path)
+    creados = contadores._conn.execute("SELECT COUNT(*) FROM leads_dia").fetchone()[0]
+    contadores.close()
+    assert creados == 2
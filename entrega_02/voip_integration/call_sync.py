@@ -0,0 +1,79 @@
+from phone_index import index as phone_index
+
+
+def build_call_element(payload: dict, contact_id: str = None) -> dict:
+    """Elemento Call de vtiger a partir del payload normalizado de la centralita."""
+    from_num = payload.get("from")
+    to_num = payload.get("to")
+    call_element = {
+        "subject": f"Llamada {'entrante' if payload.get('direction')=='inbound' else 'saliente'} de {from_num or to_num}",
+        "assigned_user_id": payload.get("assigned_user_id", "19x1"),  # default si no viene
+        "calltype": "Inbound" if payload.get("direction") == "inbound" else "Outbound",
+        "date_start": payload.get("start_time", "")[:10].replace("T", " "),
+        "time_start": payload.get("start_time", "")[11:16] if payload.get("start_time") else "",
+        "duration": str(payload.get("duration_seconds", 0)),
+        "description": f"Grabación: {payload.get('recording_url','')}",
+        "cf_call_uuid": payload["call_uuid"],
+        "cf_from_number": from_num,
+        "cf_to_number": to_num,
+        "cf_recording_url": payload.get("recording_url", ""),
+        "cf_pbx_system": payload.get("pbx_system", "default"),
+        "cf_duration_seconds": payload.get("duration_seconds", 0),
+        "status": "Completed" if payload.get("status") in ("completed","answered") else "Planned"
+    }
+    if contact_id:
+        call_element["parent_id"] = contact_id
+    return call_element
+
+
+async def upsert_call_to_vtiger_async(vt, payload: dict, vtiger_call_id: str = None, reconcile: bool = False):
+    """
+    Crea o actualiza en vtiger el Call de una llamada del buffer, con el
+    AsyncVtigerClient `vt` compartido: el worker lanza muchas a la vez sin
+    ocupar un hilo por llamada.
+
+    - `vtiger_call_id`: id ya conocido (columna del buffer) -> update directo.
+    - `reconcile`: un intento anterior pudo crear el Call sin llegar a guardar
+      su id (reintento o worker caído) -> se busca por cf_call_uuid antes de crear.
+    """
+    from_num = payload.get("from")
+    to_num = payload.get("to")
+    call_uuid = payload["call_uuid"]
+
+    # Prioriza el número del cliente (suponiendo entrante: from es cliente);
+    # índice local normalizado y consulta a vtiger solo si no está indexado
+    contact_id = await phone_index.alookup(from_num, vt) or await phone_index.alookup(to_num, vt)
+    call_element = build_call_element(payload, contact_id)
+
+    # voip_call_buffer.vtiger_call_id es el mapeo call_uuid -> Call: si se conoce se actualiza
+    # directamente; la búsqueda por cf_call_uuid en vtiger solo se hace para reconciliar
+    if not vtiger_call_id and reconcile:
+        vtiger_call_id = await find_call_id_async(vt, call_uuid)
+
+    if vtiger_call_id:
+        call_element["id"] = vtiger_call_id
+        result = await vt.update("Call", call_element)
+        if result.get("success") or not _record_missing(result):
+            return result
+        # el Call se borró en el CRM: se vuelve a crear
+        del call_element["id"]
+
+    return await vt.create("Call", call_element)
+
+
+def _find_call_query(call_uuid: str) -> str:
+    return f"SELECT id FROM Calls WHERE cf_call_uuid = '{call_uuid}' LIMIT 1;"
+
+
+async def find_call_id_async(vt, call_uuid: str):
+    """Busca en vtiger un Call existente por cf_call_uuid (reconciliación)."""
+    existing = await vt.query(_find_call_query(call_uuid))
+    if existing.get("result"):
+        return existing["result"][0]["id"]
+    return None
+
+
+def _record_missing(result: dict) -> bool:
+    # vtiger responde ACCESS_DENIED/RECORD_NOT_FOUND al actualizar un id borrado
+    code = (result.get("error") or {}).get("code")
+    return code in ("RECORD_NOT_FOUND", "ACCESS_DENIED")
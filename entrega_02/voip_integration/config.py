@@ -13,7 +13,42 @@ class Settings(BaseSettings):
     DB_USER: str
     DB_PASSWORD: str
 
+    # pool de conexiones PostgreSQL (ver db.connection)
+    DB_POOL_MIN: int = 1
+    DB_POOL_MAX: int = 10
+    DB_POOL_TIMEOUT: float = 5  # segundos esperando conexión libre antes de fallar
+    DB_POOL_HEALTHCHECK_INTERVAL: float = 30  # SELECT 1 si la conexión lleva más tiempo ociosa
+
     MAX_RETRIES: int = 5
+    BATCH_MAX_ITEMS: int = 10000  # máximo de llamadas por petición a /webhook/calls/batch
+
+    # worker que drena voip_call_buffer (ver worker.py)
+    WORKER_ENABLED: bool = True  # False si el worker corre como proceso aparte
+    WORKER_CONCURRENCY: int = 8
+    WORKER_BATCH_SIZE: int = 50
+    WORKER_POLL_INTERVAL: float = 1.0
+    RETRY_BASE_SECONDS: float = 10  # backoff: RETRY_BASE_SECONDS * 2^retries
+    PROCESSING_TIMEOUT: int = 300  # segundos tras los que una fila 'processing' se reclama de nuevo
+
+    # índice local número -> contacto (ver phone_index.py)
+    PHONE_DEFAULT_COUNTRY_CODE: str = "34"
+    PHONE_CACHE_SIZE: int = 50000
+    PHONE_CACHE_TTL: int = 3600
+    PHONE_CACHE_NEGATIVE_TTL: int = 300
+    PHONE_SYNC_INTERVAL: int = 300  # segundos entre sincronizaciones incrementales; 0 = desactivada
+
+    # pool HTTP hacia vtiger (ver vtiger_http.build_session)
+    VTIGER_POOL_SIZE: int = 10
+    VTIGER_TIMEOUT: float = 10
+    VTIGER_RETRIES: int = 3
+    VTIGER_BACKOFF: float = 0.5
+    # peticiones en vuelo del cliente asíncrono (worker); las conexiones son VTIGER_POOL_SIZE
+    VTIGER_ASYNC_CONCURRENCY: int = 50
+    # presupuesto de peticiones/s a vtiger (token bucket con AIMD ante 429/5xx); 0 = sin límite
+    VTIGER_RATE_READ: float = 20
+    VTIGER_RATE_WRITE: float = 10
+    # segundos que se reutiliza un sessionName antes de volver a hacer login
+    VTIGER_SESSION_TTL: int = 1800
 
     class Config:
         env_file = ".env"
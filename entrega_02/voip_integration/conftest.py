@@ -0,0 +1,15 @@
+import os
+
+# config.Settings exige estas variables al importar; en los tests no se conecta a nada
+for nombre, valor in {
+    "VTIGER_URL": "http://vtiger.test/webservice.php",
+    "VTIGER_USERNAME": "admin",
+    "VTIGER_ACCESS_KEY": "clave",
+    "WEBHOOK_SECRET": "secreto",
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+    "DB_NAME": "voip",
+    "DB_USER": "voip",
+    "DB_PASSWORD": "voip",
+}.items():
+    os.environ.setdefault(nombre, valor)
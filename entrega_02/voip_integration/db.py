@@ -1,10 +1,14 @@
 import os
+import time
+import threading
+from contextlib import contextmanager
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from config import settings
 
-def get_conn():
-    return psycopg2.connect(
+def _dsn():
+    return dict(
         host=settings.DB_HOST,
         port=settings.DB_PORT,
         dbname=settings.DB_NAME,
@@ -12,14 +16,229 @@ def get_conn():
         password=settings.DB_PASSWORD
     )
 
+def get_conn():
+    # conexión suelta (scripts/psql); el servicio usa connection() del pool
+    return psycopg2.connect(**_dsn())
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = None  # semáforo de DB_POOL_MAX: se espera turno en vez de recibir PoolError
+_last_used = {}  # id(conn) -> monotonic del último uso, para el health check
+_metrics_lock = threading.Lock()
+_metrics = {"checkouts": 0, "in_use": 0, "idle": 0, "waits": 0, "wait_seconds": 0.0, "timeouts": 0, "health_failures": 0}
+
+def init_pool():
+    """Crea (una vez) el ThreadedConnectionPool con DB_POOL_MIN/DB_POOL_MAX."""
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(settings.DB_POOL_MIN, settings.DB_POOL_MAX, **_dsn())
+            _slots = threading.BoundedSemaphore(settings.DB_POOL_MAX)
+            # el pool abre DB_POOL_MIN conexiones al crearse
+            with _metrics_lock:
+                _metrics["idle"] = settings.DB_POOL_MIN
+        return _pool
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _last_used.clear()
+            with _metrics_lock:
+                _metrics["idle"] = 0
+
+def _healthy(conn):
+    # solo se comprueba con SELECT 1 si la conexión lleva un rato ociosa
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0) < settings.DB_POOL_HEALTHCHECK_INTERVAL:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def _getconn(pool):
+    conn = pool.getconn()
+    with _metrics_lock:
+        # getconn reutiliza una ociosa si la hay y si no abre otra
+        _metrics["idle"] = max(_metrics["idle"] - 1, 0)
+    return conn
+
+def _putconn(pool, conn, close=False):
+    if not close:
+        _last_used[id(conn)] = time.monotonic()
+    pool.putconn(conn, close=close)
+    # putconn también cierra la conexión si ya hay DB_POOL_MIN ociosas
+    if conn.closed:
+        _last_used.pop(id(conn), None)
+    else:
+        with _metrics_lock:
+            _metrics["idle"] += 1
+
+@contextmanager
+def connection():
+    """
+    Presta una conexión del pool dentro de una transacción (commit al salir,
+    rollback si hay excepción) y la devuelve siempre al pool. Las conexiones
+    rotas se cierran en lugar de reutilizarse.
+    """
+    pool = init_pool()
+    start = time.monotonic()
+    if not _slots.acquire(blocking=False):
+        with _metrics_lock:
+            _metrics["waits"] += 1
+        if not _slots.acquire(timeout=settings.DB_POOL_TIMEOUT):
+            with _metrics_lock:
+                _metrics["timeouts"] += 1
+            raise PoolError("Timeout esperando una conexión libre del pool")
+    conn = None
+    broken = False
+    try:
+        conn = _getconn(pool)
+        if not _healthy(conn):
+            with _metrics_lock:
+                _metrics["health_failures"] += 1
+            _putconn(pool, conn, close=True)
+            conn = None  # si el siguiente getconn falla, no se devuelve dos veces
+            conn = _getconn(pool)
+        with _metrics_lock:
+            _metrics["checkouts"] += 1
+            _metrics["in_use"] += 1
+            _metrics["wait_seconds"] += time.monotonic() - start
+        try:
+            with conn:
+                yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+    finally:
+        if conn is not None:
+            _putconn(pool, conn, close=broken or bool(conn.closed))
+            with _metrics_lock:
+                _metrics["in_use"] -= 1
+        _slots.release()
+
+def pool_stats():
+    """Utilización del pool para /metrics."""
+    with _metrics_lock:
+        stats = dict(_metrics)
+    stats["min"] = settings.DB_POOL_MIN
+    stats["max"] = settings.DB_POOL_MAX
+    stats["utilisation"] = round(stats["in_use"] / settings.DB_POOL_MAX, 3)
+    stats["avg_wait_ms"] = round(1000 * stats.pop("wait_seconds") / stats["checkouts"], 2) if stats["checkouts"] else 0.0
+    return stats
+
 def insert_buffer(call_uuid, raw_payload):
-    conn = get_conn()
-    with conn:
+    """
+    Encola una llamada en voip_call_buffer. Si el call_uuid ya existe y el
+    payload ha cambiado (p. ej. la PBX manda la actualización de estado),
+    se vuelve a poner en 'pending' para que el worker la sincronice otra vez.
+    last_attempt no se toca: si ya hubo un intento, el worker sabe que debe
+    reconciliar con vtiger antes de crear (ver claim_calls()).
+    Devuelve None si era un reenvío idéntico.
+    """
+    with connection() as conn:
         with conn.cursor() as cur:
             cur.execute("""
                 INSERT INTO voip_call_buffer (call_uuid, raw_payload)
                 VALUES (%s, %s)
-                ON CONFLICT (call_uuid) DO NOTHING
+                ON CONFLICT (call_uuid) DO UPDATE
+                SET raw_payload = EXCLUDED.raw_payload, status = 'pending', retries = 0
+                WHERE voip_call_buffer.raw_payload IS DISTINCT FROM EXCLUDED.raw_payload
                 RETURNING id;
             """, (call_uuid, raw_payload))
             return cur.fetchone()
+
+def insert_buffer_batch(items):
+    """
+    Encola varias llamadas con un único INSERT ... ON CONFLICT multi-fila.
+    `items` es una lista de (call_uuid, raw_payload) sin call_uuid repetidos.
+    Devuelve {call_uuid: 'accepted' | 'updated' | 'duplicate'}: nueva fila,
+    fila re-encolada porque el payload cambió, o reenvío idéntico.
+    """
+    if not items:
+        return {}
+    with connection() as conn:
+        with conn.cursor() as cur:
+            rows = execute_values(cur, """
+                INSERT INTO voip_call_buffer (call_uuid, raw_payload)
+                VALUES %s
+                ON CONFLICT (call_uuid) DO UPDATE
+                SET raw_payload = EXCLUDED.raw_payload, status = 'pending', retries = 0
+                WHERE voip_call_buffer.raw_payload IS DISTINCT FROM EXCLUDED.raw_payload
+                RETURNING call_uuid, (xmax = 0) AS inserted;
+            """, items, template="(%s, %s::jsonb)", page_size=len(items), fetch=True)
+    result = {call_uuid: "duplicate" for call_uuid, _ in items}
+    for call_uuid, inserted in rows:
+        result[call_uuid] = "accepted" if inserted else "updated"
+    return result
+
+def claim_calls(limit):
+    """
+    Reserva hasta `limit` filas para sincronizar y las marca 'processing'.
+
+    Se reclaman las pendientes, las fallidas cuyo backoff exponencial
+    (RETRY_BASE_SECONDS * 2^retries) ya ha vencido sin superar MAX_RETRIES,
+    y las 'processing' abandonadas por un worker caído. FOR UPDATE SKIP LOCKED
+    permite varios workers (o procesos) sin que dos tomen la misma fila.
+
+    `attempted` indica si la fila ya se reservó antes (last_attempt no nulo):
+    un intento anterior pudo crear el Call sin llegar a guardar su id, aunque
+    la fila se haya re-encolado después con retries a 0.
+    """
+    with connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                WITH claimable AS (
+                    SELECT id, last_attempt IS NOT NULL AS attempted FROM voip_call_buffer
+                    WHERE status = 'pending'
+                       OR (status = 'failed' AND retries < %(max_retries)s
+                           AND last_attempt < now() - make_interval(secs => %(base)s * power(2, retries)))
+                       OR (status = 'processing'
+                           AND last_attempt < now() - make_interval(secs => %(stale)s))
+                    ORDER BY created_at
+                    LIMIT %(limit)s
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE voip_call_buffer b
+                SET status = 'processing', last_attempt = now()
+                FROM claimable c
+                WHERE b.id = c.id
+                RETURNING b.id, b.call_uuid, b.raw_payload, b.retries, b.vtiger_call_id, c.attempted;
+            """, {
+                "max_retries": settings.MAX_RETRIES,
+                "base": settings.RETRY_BASE_SECONDS,
+                "stale": settings.PROCESSING_TIMEOUT,
+                "limit": limit,
+            })
+            return cur.fetchall()
+
+def mark_sent(buffer_id, vtiger_call_id):
+    # si la fila se re-encoló mientras se procesaba, se conserva 'pending'
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE voip_call_buffer
+                SET status = CASE WHEN status = 'processing' THEN 'sent' ELSE status END,
+                    vtiger_call_id = %s, last_attempt = now()
+                WHERE id = %s;
+            """, (vtiger_call_id, buffer_id))
+
+def mark_failed(buffer_id):
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE voip_call_buffer
+                SET status = 'failed', retries = retries + 1, last_attempt = now()
+                WHERE id = %s AND status = 'processing'
+                RETURNING retries;
+            """, (buffer_id,))
+            row = cur.fetchone()
+            return row[0] if row else None
@@ -1,72 +1,52 @@
-import time
+import asyncio
 import logging
 from fastapi import FastAPI, Request, HTTPException, Header
-from vtiger_client import VtigerClient
+from fastapi.concurrency import run_in_threadpool
+from vtiger_client import rate_limiter, session_cache
 from config import settings
 from security import verify_hmac_signature
-from db import get_conn
+from db import init_pool, close_pool, insert_buffer, insert_buffer_batch, pool_stats
+from datetime import datetime
+import worker
+import phone_index
 import json
 
 app = FastAPI()
 logger = logging.getLogger("voip_integration")
 logging.basicConfig(level=logging.INFO)
 
-def upsert_call_to_vtiger(payload: dict):
-    vt = VtigerClient()
-    vt.login()
-
-    # resolver contacto por número (simple: buscar en Contacts)
-    from_num = payload.get("from")
-    to_num = payload.get("to")
-    call_uuid = payload["call_uuid"]
-
-    contact_id = None
-    # Prioriza el número del cliente (suponiendo entrante: from es cliente)
-    if from_num:
-        q = f"SELECT * FROM Contacts WHERE phone LIKE '{from_num}%' LIMIT 1;"
-        res = vt.query(q)
-        if res.get("result"):
-            contact_id = res["result"][0]["id"]
-    if not contact_id and to_num:
-        q = f"SELECT * FROM Contacts WHERE phone LIKE '{to_num}%' LIMIT 1;"
-        res = vt.query(q)
-        if res.get("result"):
-            contact_id = res["result"][0]["id"]
-
-    # Verificar si ya existe llamada con cf_call_uuid
-    soql_call = f"SELECT * FROM Calls WHERE cf_call_uuid = '{call_uuid}' LIMIT 1;"
-    existing = vt.query(soql_call)
-    call_element = {
-        "subject": f"Llamada {'entrante' if payload.get('direction')=='inbound' else 'saliente'} de {from_num or to_num}",
-        "assigned_user_id": payload.get("assigned_user_id", "19x1"),  # default si no viene
-        "calltype": "Inbound" if payload.get("direction") == "inbound" else "Outbound",
-        "date_start": payload.get("start_time", "")[:10].replace("T", " "),
-        "time_start": payload.get("start_time", "")[11:16] if payload.get("start_time") else "",
-        "duration": str(payload.get("duration_seconds", 0)),
-        "description": f"Grabación: {payload.get('recording_url','')}",
-        "cf_call_uuid": call_uuid,
-        "cf_from_number": from_num,
-        "cf_to_number": to_num,
-        "cf_recording_url": payload.get("recording_url", ""),
-        "cf_pbx_system": payload.get("pbx_system", "default"),
-        "cf_duration_seconds": payload.get("duration_seconds", 0),
-        "status": "Completed" if payload.get("status") in ("completed","answered") else "Planned"
-    }
+_stop_background = asyncio.Event()
+_background_tasks = []
 
-    if contact_id:
-        call_element["parent_id"] = contact_id
+@app.on_event("startup")
+async def on_startup():
+    # pool de PostgreSQL, worker de sincronización y refresco del índice de teléfonos
+    await run_in_threadpool(init_pool)
+    if settings.WORKER_ENABLED:
+        _background_tasks.append(asyncio.create_task(worker.run_worker(_stop_background)))
+    if settings.PHONE_SYNC_INTERVAL > 0:
+        _background_tasks.append(asyncio.create_task(phone_index.run_phone_sync(_stop_background)))
 
-    if existing.get("result"):
-        # actualizar
-        existing_id = existing["result"][0]["id"]
-        call_element["id"] = existing_id
-        result = vt.update("Call", call_element)
-    else:
-        result = vt.create("Call", call_element)
+@app.on_event("shutdown")
+async def on_shutdown():
+    _stop_background.set()
+    await asyncio.gather(*_background_tasks)
+    close_pool()
 
-    return result
+def normalize_payload(payload: dict) -> dict:
+    # Normalizar y calcular duración si no viene
+    if "start_time" in payload and "end_time" in payload:
+        fmt = "%Y-%m-%dT%H:%M:%SZ"  # esperar UTC
+        try:
+            st = datetime.strptime(payload["start_time"], fmt)
+            et = datetime.strptime(payload["end_time"], fmt)
+            duration = int((et - st).total_seconds())
+            payload["duration_seconds"] = duration
+        except Exception:
+            payload["duration_seconds"] = 0
+    return payload
 
-@app.post("/webhook/call")
+@app.post("/webhook/call", status_code=202)
 async def receive_call(request: Request, x_signature: str = Header(...)):
     body_bytes = await request.body()
     # validar HMAC
@@ -82,49 +62,61 @@ async def receive_call(request: Request, x_signature: str = Header(...)):
     if not call_uuid:
         raise HTTPException(status_code=422, detail="Missing call_uuid")
 
-    # Normalizar y calcular duración si no viene
-    if "start_time" in payload and "end_time" in payload:
-        fmt = "%Y-%m-%dT%H:%M:%SZ"  # esperar UTC
-        try:
-            from datetime import datetime
-            st = datetime.strptime(payload["start_time"], fmt)
-            et = datetime.strptime(payload["end_time"], fmt)
-            duration = int((et - st).total_seconds())
-            payload["duration_seconds"] = duration
-        except Exception:
-            payload["duration_seconds"] = 0
+    normalize_payload(payload)
+
+    # Encolar en el buffer; el worker (worker.py) lo enviará a vtiger con reintentos
+    row = await run_in_threadpool(insert_buffer, call_uuid, json.dumps(payload))
+    return {"status": "accepted", "call_uuid": call_uuid, "queued": row is not None}
+
+@app.post("/webhook/calls/batch", status_code=202)
+async def receive_calls_batch(request: Request, x_signature: str = Header(...)):
+    """
+    Recibe un lote de llamadas (array JSON o NDJSON, una llamada por línea)
+    firmado con HMAC sobre el cuerpo completo, y lo encola con un solo
+    INSERT multi-fila. Devuelve el estado de cada elemento en su posición.
+    """
+    body_bytes = await request.body()
+    if not verify_hmac_signature(body_bytes, x_signature):
+        raise HTTPException(status_code=401, detail="Invalid signature")
 
-    # Insertar en buffer si nuevo
-    conn = get_conn()
-    with conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO voip_call_buffer (call_uuid, raw_payload)
-                VALUES (%s, %s)
-                ON CONFLICT (call_uuid) DO NOTHING;
-            """, (call_uuid, json.dumps(payload)))
-
-    # Procesar (síncrono básico; en producción mover a cola/background job)
     try:
-        result = upsert_call_to_vtiger(payload)
-        # actualizar buffer
-        with conn:
-            with conn.cursor() as cur:
-                vtiger_id = result.get("result", {}).get("id") if result.get("result") else None
-                cur.execute("""
-                    UPDATE voip_call_buffer
-                    SET status='sent', vtiger_call_id=%s, last_attempt=now()
-                    WHERE call_uuid=%s;
-                """, (vtiger_id, call_uuid))
-        return {"status": "ok", "vtiger": result}
-    except Exception as e:
-        logging.exception("Error al enviar a Vtiger")
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    UPDATE voip_call_buffer
-                    SET status='failed', retries = retries + 1, last_attempt=now()
-                    WHERE call_uuid=%s;
-                """, (call_uuid,))
-        # implementar lógica de reintento en background / scheduler aparte
-        raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+        if body_bytes.lstrip().startswith(b"["):
+            calls = json.loads(body_bytes)
+        else:
+            calls = [json.loads(line) for line in body_bytes.splitlines() if line.strip()]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid JSON / NDJSON")
+    if len(calls) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {settings.BATCH_MAX_ITEMS})")
+
+    items = [{"index": i, "call_uuid": None, "status": "invalid"} for i in range(len(calls))]
+    last_index = {}  # call_uuid -> última posición en el lote (la más reciente gana)
+    for i, payload in enumerate(calls):
+        if isinstance(payload, dict) and payload.get("call_uuid"):
+            items[i]["call_uuid"] = payload["call_uuid"]
+            last_index[payload["call_uuid"]] = i
+    for i, item in enumerate(items):
+        if item["call_uuid"] and last_index[item["call_uuid"]] != i:
+            item["status"] = "duplicate"
+
+    rows = [(call_uuid, json.dumps(normalize_payload(calls[i]))) for call_uuid, i in last_index.items()]
+    result = await run_in_threadpool(insert_buffer_batch, rows)
+    for call_uuid, i in last_index.items():
+        items[i]["status"] = result[call_uuid]
+
+    summary = {status: 0 for status in ("accepted", "updated", "duplicate", "invalid")}
+    for item in items:
+        summary[item["status"]] += 1
+    return {**summary, "items": items}
+
+
+@app.get("/metrics")
+def metrics():
+    # contadores de la cache de sesión vtiger, del limitador de ritmo, del worker, del pool de PostgreSQL y del índice de teléfonos
+    return {
+        "vtiger_session": session_cache.stats(),
+        "vtiger_rate": rate_limiter.stats(),
+        "worker": worker.stats,
+        "db_pool": pool_stats(),
+        "phone_index": phone_index.index.stats(),
+    }
@@ -0,0 +1,240 @@
+import re
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+from config import settings
+from db import connection
+from vtiger_client import VtigerClient
+
+logger = logging.getLogger("voip_integration.phone_index")
+
+# módulos de vtiger indexados y campos de teléfono de cada uno (Contacts tiene prioridad)
+INDEXED_MODULES = {
+    "Contacts": ("phone", "mobile"),
+    "Leads": ("phone", "mobile"),
+}
+PAGE_SIZE = 100  # vtiger limita cada query a 100 filas
+MIN_PHONE_DIGITS = 6  # por debajo es una extensión interna, no un teléfono
+
+
+def phone_variants(key, default_cc=None):
+    """
+    Formas habituales de escribir en el CRM un número E.164: +34600111222,
+    0034600111222, 34600111222 y, si es del país por defecto, 600111222.
+    """
+    default_cc = default_cc or settings.PHONE_DEFAULT_COUNTRY_CODE
+    digits = key[1:]
+    variants = [key, "00" + digits, digits]
+    if digits.startswith(default_cc):
+        variants.append(digits[len(default_cc):])
+    return variants
+
+
+def normalize_phone(number, default_cc=None):
+    """
+    Normaliza un número a E.164 (+34600111222). Quita espacios, guiones y
+    paréntesis; '00' inicial equivale a '+'; los números nacionales (sin
+    prefijo y de hasta 10 dígitos) reciben PHONE_DEFAULT_COUNTRY_CODE.
+    Devuelve None si no hay número o es demasiado corto para serlo (menos de
+    MIN_PHONE_DIGITS dígitos: extensiones internas, "anonymous"...).
+    """
+    if not number:
+        return None
+    default_cc = default_cc or settings.PHONE_DEFAULT_COUNTRY_CODE
+    raw = str(number).strip()
+    digits = re.sub(r"\D", "", raw)
+    if len(digits) < MIN_PHONE_DIGITS:
+        return None
+    if raw.startswith("+"):
+        return "+" + digits
+    if digits.startswith("00"):
+        return "+" + digits[2:]
+    if len(digits) <= 10:
+        return "+" + default_cc + digits.lstrip("0")
+    return "+" + digits
+
+
+class PhoneIndex:
+    """
+    Índice número E.164 -> id de vtiger (Contacts o Leads) en tres niveles:
+    LRU en memoria con TTL, tabla number_contact_map en PostgreSQL y, solo
+    si ambos fallan, una consulta a vtiger cuyo resultado se guarda en los
+    dos niveles anteriores. Los números sin contacto también se cachean
+    (con NEGATIVE_TTL) para no repetir la consulta remota en cada llamada.
+    """
+
+    def __init__(self, maxsize, ttl, negative_ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lru = OrderedDict()  # phone -> (contact_id | None, expires_at)
+        self._lock = threading.Lock()
+        self.counters = {"lru_hits": 0, "db_hits": 0, "remote_lookups": 0, "remote_hits": 0, "synced": 0}
+
+    # ---- LRU ----
+    def _lru_get(self, key):
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                return False, None
+            if entry[1] < time.monotonic():
+                del self._lru[key]
+                return False, None
+            self._lru.move_to_end(key)
+            self.counters["lru_hits"] += 1
+            return True, entry[0]
+
+    def _lru_put(self, key, contact_id):
+        ttl = self.ttl if contact_id else self.negative_ttl
+        with self._lock:
+            self._lru[key] = (contact_id, time.monotonic() + ttl)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+
+    def _lru_discard(self, keys):
+        with self._lock:
+            for key in keys:
+                self._lru.pop(key, None)
+
+    # ---- tabla number_contact_map ----
+    def _db_get(self, key):
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT vtiger_contact_id FROM number_contact_map WHERE phone_number = %s;", (key,))
+                row = cur.fetchone()
+                return row[0] if row else None
+
+    def _db_put(self, cur, key, contact_id, module):
+        # un contacto nunca es sustituido por un lead con el mismo número
+        cur.execute("""
+            INSERT INTO number_contact_map (phone_number, vtiger_contact_id, module, last_verified)
+            VALUES (%s, %s, %s, now())
+            ON CONFLICT (phone_number) DO UPDATE
+            SET vtiger_contact_id = EXCLUDED.vtiger_contact_id, module = EXCLUDED.module, last_verified = now()
+            WHERE EXCLUDED.module = 'Contacts' OR number_contact_map.module = 'Leads';
+        """, (key, contact_id, module))
+
+    # ---- vtiger ----
+    @staticmethod
+    def _remote_query(key, module, fields):
+        # igualdad (IN) en vez de LIKE '%...': sin comodín inicial el CRM puede usar el índice.
+        # Los números guardados con espacios o guiones no casan aquí; esos los trae sync().
+        valores = ", ".join(f"'{v}'" for v in phone_variants(key))
+        where = " OR ".join(f"{f} IN ({valores})" for f in fields)
+        return f"SELECT id, {', '.join(fields)} FROM {module} WHERE {where} LIMIT 5;"
+
+    @staticmethod
+    def _remote_match(res, key, fields):
+        for record in res.get("result") or []:
+            if any(normalize_phone(record.get(f)) == key for f in fields):
+                return record["id"]
+        return None
+
+    async def _remote_get_async(self, vt, key):
+        self.counters["remote_lookups"] += 1
+        for module, fields in INDEXED_MODULES.items():
+            contact_id = self._remote_match(await vt.query(self._remote_query(key, module, fields)), key, fields)
+            if contact_id:
+                return contact_id, module
+        return None, None
+
+    def _db_put_one(self, key, contact_id, module):
+        with connection() as conn:
+            with conn.cursor() as cur:
+                self._db_put(cur, key, contact_id, module)
+
+    async def alookup(self, number, vt=None):
+        """
+        Devuelve el id de vtiger asociado al número, o None. La consulta
+        remota va por el AsyncVtigerClient `vt` del worker y solo los
+        accesos a PostgreSQL usan un hilo.
+        """
+        key = normalize_phone(number)
+        if not key:
+            return None
+        found, contact_id = self._lru_get(key)
+        if found:
+            return contact_id
+        contact_id = await asyncio.to_thread(self._db_get, key)
+        if contact_id:
+            self.counters["db_hits"] += 1
+        elif vt is not None:
+            contact_id, module = await self._remote_get_async(vt, key)
+            if contact_id:
+                self.counters["remote_hits"] += 1
+                await asyncio.to_thread(self._db_put_one, key, contact_id, module)
+        self._lru_put(key, contact_id)
+        return contact_id
+
+    def sync(self, vt):
+        """
+        Sincronización incremental: trae de vtiger los registros con
+        modifiedtime posterior a la última marca guardada para cada módulo
+        y actualiza number_contact_map. Devuelve el nº de números indexados.
+        Las páginas se piden con vt.iter_pages_since() desde el último
+        modifiedtime visto (no por offset: un registro modificado durante la
+        sincronización no hace saltarse otro); la marca se guarda por
+        página, así que una sincronización interrumpida continúa donde quedó.
+        """
+        total = 0
+        for module, fields in INDEXED_MODULES.items():
+            with connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT last_modified FROM phone_index_sync_state WHERE module = %s;", (module,))
+                    row = cur.fetchone()
+            watermark = row[0].strftime("%Y-%m-%d %H:%M:%S") if row else "1970-01-01 00:00:00"
+            pages = vt.iter_pages_since(
+                f"SELECT id, {', '.join(fields)}, modifiedtime FROM {module}",
+                "modifiedtime", since=watermark, page_size=PAGE_SIZE,
+            )
+            for records in pages:
+                keys = []
+                with connection() as conn:
+                    with conn.cursor() as cur:
+                        for record in records:
+                            for field in fields:
+                                key = normalize_phone(record.get(field))
+                                if key:
+                                    self._db_put(cur, key, record["id"], module)
+                                    keys.append(key)
+                        cur.execute("""
+                            INSERT INTO phone_index_sync_state (module, last_modified) VALUES (%s, %s)
+                            ON CONFLICT (module) DO UPDATE SET last_modified = EXCLUDED.last_modified;
+                        """, (module, records[-1]["modifiedtime"]))
+                self._lru_discard(keys)
+                total += len(keys)
+        self.counters["synced"] += total
+        return total
+
+    def stats(self):
+        with self._lock:
+            size = len(self._lru)
+        return {**self.counters, "lru_size": size, "lru_maxsize": self.maxsize}
+
+
+index = PhoneIndex(settings.PHONE_CACHE_SIZE, settings.PHONE_CACHE_TTL, settings.PHONE_CACHE_NEGATIVE_TTL)
+
+
+def _sync_once():
+    vt = VtigerClient()
+    vt.login()
+    return index.sync(vt)
+
+
+async def run_phone_sync(stop: asyncio.Event):
+    """Sincroniza el índice cada PHONE_SYNC_INTERVAL segundos hasta que se pare la app."""
+    while not stop.is_set():
+        try:
+            n = await asyncio.to_thread(_sync_once)
+            if n:
+                logger.info("Índice de teléfonos: %d números actualizados", n)
+        except Exception:
+            logger.exception("Error sincronizando el índice de teléfonos")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=settings.PHONE_SYNC_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,190 @@
+import threading
+
+import psycopg2
+import pytest
+from psycopg2.pool import PoolError
+
+import db
+from config import settings
+
+
+class FakeConn:
+    def __init__(self, pool):
+        self.pool = pool
+        self.closed = 0
+        self.roto = False  # el SELECT 1 del health check falla
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql):
+                if conn.roto:
+                    raise psycopg2.OperationalError("server closed the connection")
+
+        return Cursor()
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakePool:
+    """Mismo reparto que psycopg2.pool: reutiliza ociosas y cierra las que sobran de minconn."""
+
+    def __init__(self, minconn, maxconn, **dsn):
+        self.minconn = minconn
+        self.libres = [FakeConn(self) for _ in range(minconn)]
+        self.abiertas = minconn
+        self.fallar_tras = None  # getconn() que funcionan antes de perder el servidor
+        self.putconns = []
+
+    def getconn(self):
+        if self.fallar_tras is not None:
+            if self.fallar_tras == 0:
+                raise psycopg2.OperationalError("could not connect to server")
+            self.fallar_tras -= 1
+        if self.libres:
+            return self.libres.pop()
+        self.abiertas += 1
+        return FakeConn(self)
+
+    def putconn(self, conn, close=False):
+        self.putconns.append(conn)
+        if len(self.libres) < self.minconn and not close and not conn.closed:
+            self.libres.append(conn)
+        else:
+            conn.close()
+
+    def closeall(self):
+        for conn in self.libres:
+            conn.close()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(db, "ThreadedConnectionPool", FakePool)
+    monkeypatch.setattr(db, "_pool", None)
+    monkeypatch.setattr(db, "_last_used", {})
+    monkeypatch.setattr(db, "_metrics", {k: 0 for k in db._metrics})
+    monkeypatch.setattr(settings, "DB_POOL_MIN", 1)
+    monkeypatch.setattr(settings, "DB_POOL_MAX", 2)
+    monkeypatch.setattr(settings, "DB_POOL_TIMEOUT", 0.05)
+    monkeypatch.setattr(settings, "DB_POOL_HEALTHCHECK_INTERVAL", 30)
+    yield db.init_pool()
+    db.close_pool()
+
+
+def test_idle_and_in_use_are_counted_without_pool_internals(pool):
+    assert db.pool_stats()["idle"] == 1
+    with db.connection() as c1:
+        with db.connection() as c2:
+            stats = db.pool_stats()
+            assert (stats["in_use"], stats["idle"], stats["utilisation"]) == (2, 0, 1.0)
+    # el pool se queda con DB_POOL_MIN ociosas y cierra el resto
+    stats = db.pool_stats()
+    assert (stats["in_use"], stats["idle"], stats["checkouts"]) == (0, 1, 2)
+    assert c1.closed and not c2.closed
+    assert set(db._last_used) == {id(c2)}
+
+
+def test_unhealthy_connection_is_replaced(pool):
+    with db.connection() as conn:
+        pass
+    conn.roto = True
+    db._last_used[id(conn)] -= 60  # ociosa más de DB_POOL_HEALTHCHECK_INTERVAL
+    with db.connection() as nueva:
+        assert nueva is not conn
+    assert conn.closed
+    assert id(conn) not in db._last_used
+    assert db.pool_stats()["health_failures"] == 1
+
+
+def test_failed_reconnect_does_not_return_closed_connection_twice(pool):
+    with db.connection() as conn:
+        pass
+    conn.roto = True
+    db._last_used[id(conn)] -= 60
+    pool.putconns.clear()
+    pool.fallar_tras = 1  # el getconn que sustituye a la conexión rota falla
+    with pytest.raises(psycopg2.OperationalError):
+        with db.connection():
+            pass
+    assert pool.putconns == [conn]
+    assert db.pool_stats()["in_use"] == 0
+    # el semáforo se libera igualmente
+    pool.fallar_tras = None
+    with db.connection(), db.connection():
+        pass
+
+
+def test_broken_connection_is_closed_and_forgotten(pool):
+    with pytest.raises(psycopg2.OperationalError):
+        with db.connection() as conn:
+            raise psycopg2.OperationalError("server closed the connection")
+    assert conn.closed
+    assert id(conn) not in db._last_used
+    assert db.pool_stats()["idle"] == 0
+    with db.connection() as nueva:
+        assert not nueva.closed
+
+
+def test_waits_for_free_slot_then_times_out(pool):
+    ocupado = threading.Event()
+    liberar = threading.Event()
+
+    def ocupar():
+        with db.connection():
+            ocupado.set()
+            liberar.wait(5)
+
+    hilo = threading.Thread(target=ocupar)
+    with db.connection():
+        hilo.start()
+        assert ocupado.wait(5)
+        # sin hueco en el semáforo: espera DB_POOL_TIMEOUT y falla sin llegar al pool
+        with pytest.raises(PoolError, match="Timeout"):
+            with db.connection():
+                pass
+    liberar.set()
+    hilo.join(5)
+    stats = db.pool_stats()
+    assert (stats["waits"], stats["timeouts"], stats["checkouts"], stats["in_use"]) == (1, 1, 2, 0)
+    assert pool.abiertas == 2  # nunca más de DB_POOL_MAX conexiones
+
+
+def test_waiter_gets_connection_released_in_time(pool, monkeypatch):
+    monkeypatch.setattr(settings, "DB_POOL_TIMEOUT", 5)
+    ocupados = threading.Barrier(3)
+    liberar = threading.Event()
+
+    def ocupar():
+        with db.connection():
+            ocupados.wait(5)
+            liberar.wait(5)
+
+    hilos = [threading.Thread(target=ocupar) for _ in range(2)]
+    for h in hilos:
+        h.start()
+    ocupados.wait(5)
+    threading.Timer(0.05, liberar.set).start()
+    with db.connection():
+        pass
+    for h in hilos:
+        h.join(5)
+    stats = db.pool_stats()
+    assert (stats["waits"], stats["timeouts"], stats["checkouts"]) == (1, 0, 3)
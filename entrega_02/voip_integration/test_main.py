@@ -0,0 +1,101 @@
+import hashlib
+import hmac
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from config import settings
+
+
+class Lotes(list):
+    """Lotes recibidos por insert_buffer_batch()."""
+
+
+@pytest.fixture
+def encolados(monkeypatch):
+    """Sustituye insert_buffer_batch: registra cada lote y responde según `existentes`."""
+    lotes = Lotes()
+    lotes.existentes = {}  # call_uuid -> 'updated' | 'duplicate'
+
+    def insert_buffer_batch(rows):
+        lotes.append(rows)
+        return {call_uuid: lotes.existentes.get(call_uuid, "accepted") for call_uuid, _ in rows}
+
+    monkeypatch.setattr(main, "insert_buffer_batch", insert_buffer_batch)
+    return lotes
+
+
+@pytest.fixture
+def client():
+    # sin `with`: no arrancan el pool de PostgreSQL ni las tareas de fondo
+    return TestClient(main.app)
+
+
+def enviar(client, body):
+    firma = hmac.new(settings.WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return client.post("/webhook/calls/batch", content=body, headers={"X-Signature": firma})
+
+
+def llamada(call_uuid, **kwargs):
+    return {"call_uuid": call_uuid, "from": "600111222", "to": "910000000", **kwargs}
+
+
+def test_json_array_and_ndjson_are_equivalent(client, encolados):
+    calls = [llamada("a"), llamada("b")]
+    r1 = enviar(client, json.dumps(calls).encode())
+    r2 = enviar(client, b"\n".join(json.dumps(c).encode() for c in calls) + b"\n\n")
+    assert r1.status_code == r2.status_code == 202
+    assert r1.json() == r2.json()
+    assert r1.json()["accepted"] == 2
+    assert encolados[0] == encolados[1]
+    assert [call_uuid for call_uuid, _ in encolados[0]] == ["a", "b"]
+
+
+def test_per_item_statuses(client, encolados):
+    encolados.existentes = {"b": "updated", "c": "duplicate"}
+    body = json.dumps([llamada("a"), {"from": "600"}, llamada("b"), "no es un objeto", llamada("c")]).encode()
+    data = enviar(client, body).json()
+    assert [(i["index"], i["call_uuid"], i["status"]) for i in data["items"]] == [
+        (0, "a", "accepted"),
+        (1, None, "invalid"),
+        (2, "b", "updated"),
+        (3, None, "invalid"),
+        (4, "c", "duplicate"),
+    ]
+    assert {k: data[k] for k in ("accepted", "updated", "duplicate", "invalid")} == {
+        "accepted": 1, "updated": 1, "duplicate": 1, "invalid": 2,
+    }
+
+
+def test_last_duplicate_in_batch_wins(client, encolados):
+    body = json.dumps([
+        llamada("a", status="ringing"),
+        llamada("b"),
+        llamada("a", status="completed", start_time="2025-07-28T10:00:00Z", end_time="2025-07-28T10:01:30Z"),
+    ]).encode()
+    data = enviar(client, body).json()
+    assert [i["status"] for i in data["items"]] == ["duplicate", "accepted", "accepted"]
+    (rows,) = encolados
+    payloads = {call_uuid: json.loads(raw) for call_uuid, raw in rows}
+    # un solo INSERT por call_uuid, con el payload más reciente (y normalizado)
+    assert len(rows) == 2
+    assert payloads["a"]["status"] == "completed"
+    assert payloads["a"]["duration_seconds"] == 90
+
+
+def test_batch_max_items(client, encolados, monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_MAX_ITEMS", 2)
+    r = enviar(client, json.dumps([llamada("a"), llamada("b"), llamada("c")]).encode())
+    assert r.status_code == 413
+    assert encolados == []
+    assert enviar(client, json.dumps([llamada("a"), llamada("b")]).encode()).status_code == 202
+
+
+def test_invalid_body_and_signature(client, encolados):
+    assert enviar(client, b'{"call_uuid": "a"}\n{roto').status_code == 400
+    assert enviar(client, b"[1, 2").status_code == 400
+    r = client.post("/webhook/calls/batch", content=b"[]", headers={"X-Signature": "mala"})
+    assert r.status_code == 401
+    assert encolados == []
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+import phone_index
+from phone_index import PhoneIndex, normalize_phone, phone_variants
+
+
+@pytest.mark.parametrize("numero, esperado", [
+    ("600111222", "+34600111222"),
+    ("600 11 12 22", "+34600111222"),
+    ("600-111-222", "+34600111222"),
+    ("(91) 000 00 00", "+34910000000"),
+    ("+34 600 111 222", "+34600111222"),
+    ("0034600111222", "+34600111222"),
+    ("+44 20 7946 0000", "+442079460000"),
+    ("34600111222", "+34600111222"),
+    ("", None),
+    (None, None),
+    ("anonymous", None),
+    ("2001", None),
+    ("+34 12", None),
+])
+def test_normalize_phone(numero, esperado):
+    assert normalize_phone(numero, default_cc="34") == esperado
+
+
+def test_phone_variants_and_remote_query_use_equality():
+    assert phone_variants("+34600111222", default_cc="34") == [
+        "+34600111222", "0034600111222", "34600111222", "600111222",
+    ]
+    assert phone_variants("+442079460000", default_cc="34") == ["+442079460000", "00442079460000", "442079460000"]
+    q = PhoneIndex._remote_query("+34600111222", "Contacts", ("phone", "mobile"))
+    assert "LIKE" not in q
+    assert "phone IN ('+34600111222', '0034600111222', '34600111222', '600111222')" in q
+
+
+class FakeVtiger:
+    def __init__(self, registros):
+        self.registros = registros  # módulo -> lista de registros
+        self.consultas = []
+
+    async def query(self, q):
+        self.consultas.append(q)
+        module = q.split(" FROM ")[1].split(" ")[0]
+        return {"success": True, "result": self.registros.get(module, [])}
+
+
+@pytest.fixture
+def index(monkeypatch):
+    idx = PhoneIndex(maxsize=2, ttl=60, negative_ttl=5)
+    idx.db = {}
+    monkeypatch.setattr(idx, "_db_get", lambda key: idx.db.get(key))
+    monkeypatch.setattr(idx, "_db_put_one", lambda key, contact_id, module: idx.db.__setitem__(key, contact_id))
+    reloj = [1000.0]
+    monkeypatch.setattr(phone_index.time, "monotonic", lambda: reloj[0])
+    idx.reloj = reloj
+    return idx
+
+
+def test_alookup_remote_hit_is_stored_and_cached(index):
+    vt = FakeVtiger({"Contacts": [{"id": "12x1", "phone": "600 111 222", "mobile": ""}]})
+    assert asyncio.run(index.alookup("+34 600111222", vt)) == "12x1"
+    assert index.db == {"+34600111222": "12x1"}
+    # segunda vez desde la LRU, sin PostgreSQL ni vtiger
+    assert asyncio.run(index.alookup("600111222", vt)) == "12x1"
+    assert len(vt.consultas) == 1
+    assert index.counters["lru_hits"] == 1 and index.counters["remote_hits"] == 1
+
+
+def test_alookup_negative_ttl(index):
+    vt = FakeVtiger({})
+    assert asyncio.run(index.alookup("600999999", vt)) is None
+    assert len(vt.consultas) == 2  # Contacts y Leads
+    # el "sin contacto" se cachea NEGATIVE_TTL segundos
+    assert asyncio.run(index.alookup("600999999", vt)) is None
+    assert len(vt.consultas) == 2
+    index.reloj[0] += 6
+    vt.registros["Leads"] = [{"id": "10x5", "phone": "", "mobile": "+34600999999"}]
+    assert asyncio.run(index.alookup("600999999", vt)) == "10x5"
+    assert len(vt.consultas) == 4
+
+
+def test_alookup_lru_eviction_falls_back_to_table(index):
+    index.db.update({"+34600000001": "12x1", "+34600000002": "12x2", "+34600000003": "12x3"})
+    for n in ("600000001", "600000002", "600000003"):
+        asyncio.run(index.alookup(n))
+    assert index.stats()["lru_size"] == 2
+    assert index.counters["db_hits"] == 3
+    # el más antiguo salió de la LRU: vuelve a leerse de number_contact_map
+    assert asyncio.run(index.alookup("600000001")) == "12x1"
+    assert index.counters["db_hits"] == 4 and index.counters["lru_hits"] == 0
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+import worker
+
+
+class Llamadas(list):
+    """Envíos a vtiger registrados, con las filas marcadas sent/failed."""
+
+
+@pytest.fixture
+def upserts(monkeypatch):
+    """Sustituye vtiger y PostgreSQL: registra el `reconcile` de cada envío y las marcas."""
+    llamadas = Llamadas()
+    llamadas.sent = []
+    llamadas.failed = []
+    llamadas.error = None
+
+    async def upsert(vt, payload, vtiger_call_id, reconcile):
+        llamadas.append({"vtiger_call_id": vtiger_call_id, "reconcile": reconcile})
+        if llamadas.error:
+            return {"success": False, "error": llamadas.error}
+        return {"success": True, "result": {"id": vtiger_call_id or "9x1"}}
+
+    def mark_failed(buffer_id):
+        llamadas.failed.append(buffer_id)
+        return len(llamadas.failed)
+
+    monkeypatch.setattr(worker, "upsert_call_to_vtiger_async", upsert)
+    monkeypatch.setattr(worker, "mark_sent", lambda buffer_id, vtiger_call_id: llamadas.sent.append((buffer_id, vtiger_call_id)))
+    monkeypatch.setattr(worker, "mark_failed", mark_failed)
+    monkeypatch.setattr(worker, "stats", {k: 0 for k in worker.stats})
+    return llamadas
+
+
+def fila(**kwargs):
+    row = {"id": 1, "call_uuid": "abc", "raw_payload": {"call_uuid": "abc"}, "retries": 0,
+           "vtiger_call_id": None, "attempted": False}
+    row.update(kwargs)
+    return row
+
+
+def procesar(row):
+    asyncio.run(worker.process_call(row, asyncio.Semaphore(1), vt=None))
+
+
+def test_requeued_row_reconciles_even_with_retries_reset(upserts):
+    # el Call se creó, mark_sent falló y luego la PBX re-encoló la fila: retries vuelve a 0
+    procesar(fila(retries=0, attempted=True))
+    assert upserts == [{"vtiger_call_id": None, "reconcile": True}]
+
+
+@pytest.mark.parametrize("caso, row, reconcile", [
+    ("primer intento", fila(), False),
+    ("reintento tras fallo", fila(retries=2, attempted=True), True),
+    ("'processing' recuperada de un worker caído", fila(retries=0, attempted=True), True),
+    ("re-encolada por la PBX", fila(retries=0, attempted=True, raw_payload={"call_uuid": "abc", "status": "completed"}), True),
+    ("reintento con el Call ya conocido", fila(retries=1, attempted=True, vtiger_call_id="9x7"), False),
+])
+def test_reconcile_decision(upserts, caso, row, reconcile):
+    procesar(row)
+    assert upserts == [{"vtiger_call_id": row["vtiger_call_id"], "reconcile": reconcile}], caso
+    assert upserts.sent == [(1, row["vtiger_call_id"] or "9x1")]
+
+
+def test_vtiger_error_marks_failed_and_gives_up(upserts, monkeypatch):
+    monkeypatch.setattr(worker.settings, "MAX_RETRIES", 2)
+    upserts.error = {"code": "ACCESS_DENIED"}
+    procesar(fila())
+    assert upserts.failed == [1] and worker.stats["gave_up"] == 0
+    procesar(fila(retries=1, attempted=True))
+    assert upserts.failed == [1, 1] and worker.stats["gave_up"] == 1
+    assert upserts.sent == [] and worker.stats["failed"] == 2 and worker.stats["in_flight"] == 0
+
+
+def test_run_worker_processes_claimed_rows(upserts, monkeypatch):
+    lotes = [[fila(id=1), fila(id=2, call_uuid="def", retries=1, attempted=True)], []]
+    stop = asyncio.Event()
+
+    def claim_calls(limit):
+        assert limit == worker.settings.WORKER_BATCH_SIZE
+        if not lotes:
+            stop.set()
+            return []
+        return lotes.pop(0)
+
+    class Cliente:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+    monkeypatch.setattr(worker, "claim_calls", claim_calls)
+    monkeypatch.setattr(worker, "build_async_client", Cliente)
+    monkeypatch.setattr(worker.settings, "WORKER_POLL_INTERVAL", 0.01)
+    asyncio.run(worker.run_worker(stop))
+    assert [u["reconcile"] for u in upserts] == [False, True]
+    assert [s[0] for s in upserts.sent] == [1, 2]
+    assert worker.stats["claimed"] == 2
@@ -1,65 +1,161 @@
-import requests
+import os
+import sys
+import json
 import hashlib
 from config import settings
 
+# paquete común vtiger_http en la raíz del repositorio
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from vtiger_http import (
+    MAX_PAGE_SIZE,
+    AsyncVtigerClient,
+    RateLimiter,
+    SessionCache,
+    build_session,
+    is_invalid_session,
+    iter_pages,
+    iter_pages_since,
+    iter_query,
+)
+
+# presupuesto de peticiones a vtiger compartido por el cliente síncrono y el asíncrono
+rate_limiter = RateLimiter(read_rate=settings.VTIGER_RATE_READ, write_rate=settings.VTIGER_RATE_WRITE)
+
+# pool keep-alive compartido por todas las instancias de VtigerClient del proceso
+http_session = build_session(
+    pool_size=settings.VTIGER_POOL_SIZE,
+    timeout=settings.VTIGER_TIMEOUT,
+    retries=settings.VTIGER_RETRIES,
+    backoff=settings.VTIGER_BACKOFF,
+    limiter=rate_limiter,
+)
+
+
+def vtiger_login(http=None):
+    """getchallenge + login contra vtiger; devuelve el sessionName."""
+    http = http or http_session
+    base = settings.VTIGER_URL.rstrip("/")
+    # 1. getchallenge
+    r = http.get(base, params={
+        "operation": "getchallenge",
+        "username": settings.VTIGER_USERNAME
+    })
+    r.raise_for_status()
+    result = r.json().get("result", {})
+    token = result.get("token")
+    if not token:
+        raise RuntimeError("No challenge token received from Vtiger")
+
+    # 2. calcular accessKey
+    access_key = hashlib.md5((token + settings.VTIGER_ACCESS_KEY).encode()).hexdigest()
+    # 3. login
+    r2 = http.post(base, data={
+        "operation": "login",
+        "username": settings.VTIGER_USERNAME,
+        "accessKey": access_key
+    })
+    r2.raise_for_status()
+    login_result = r2.json().get("result", {})
+    session_name = login_result.get("sessionName")
+    if not session_name:
+        raise RuntimeError("Login failed to get sessionName")
+    return session_name
+
+
+# sessionName compartido por todas las peticiones atendidas por la app (TTL configurable)
+session_cache = SessionCache(vtiger_login, ttl=settings.VTIGER_SESSION_TTL)
+
+
+def build_async_client():
+    """
+    AsyncVtigerClient con la configuración de la app. Comparte session_cache
+    con VtigerClient, así que ambos usan el mismo sessionName.
+    """
+    return AsyncVtigerClient(
+        settings.VTIGER_URL,
+        cache=session_cache,
+        max_connections=settings.VTIGER_POOL_SIZE,
+        concurrency=settings.VTIGER_ASYNC_CONCURRENCY,
+        timeout=settings.VTIGER_TIMEOUT,
+        retries=settings.VTIGER_RETRIES,
+        backoff=settings.VTIGER_BACKOFF,
+        limiter=rate_limiter,
+    )
+
+
 class VtigerClient:
-    def __init__(self):
+    def __init__(self, http=None, cache=None):
         self.base = settings.VTIGER_URL.rstrip("/")
         self.session_name = None
+        self.http = http or http_session
+        self.cache = cache or session_cache
 
     def login(self):
-        # 1. getchallenge
-        r = requests.get(self.base, params={
-            "operation": "getchallenge",
-            "username": settings.VTIGER_USERNAME
-        }, timeout=10)
-        r.raise_for_status()
-        result = r.json().get("result", {})
-        token = result.get("token")
-        if not token:
-            raise RuntimeError("No challenge token received from Vtiger")
-
-        # 2. calcular accessKey
-        access_key = hashlib.md5((token + settings.VTIGER_ACCESS_KEY).encode()).hexdigest()
-        # 3. login
-        r2 = requests.post(self.base, data={
-            "operation": "login",
-            "username": settings.VTIGER_USERNAME,
-            "accessKey": access_key
-        }, timeout=10)
-        r2.raise_for_status()
-        login_result = r2.json().get("result", {})
-        self.session_name = login_result.get("sessionName")
+        # reutiliza la sesión cacheada; solo hace getchallenge + login si no hay ninguna vigente
+        self.session_name = self.cache.get()
+
+    def _call(self, method: str, payload: dict):
+        """
+        Ejecuta una operación con el sessionName actual. Si vtiger responde
+        que la sesión es inválida (caducada en el servidor), la renueva una
+        vez en la cache compartida y repite la operación.
+        """
         if not self.session_name:
-            raise RuntimeError("Login failed to get sessionName")
+            self.login()
+        for attempt in range(2):
+            payload["sessionName"] = self.session_name
+            if method == "GET":
+                r = self.http.get(self.base, params=payload)
+            else:
+                r = self.http.post(self.base, data=payload)
+            r.raise_for_status()
+            data = r.json()
+            if attempt == 0 and is_invalid_session(data):
+                self.session_name = self.cache.refresh(self.session_name)
+                continue
+            return data
 
     def query(self, soql: str):
-        resp = requests.get(self.base, params={
+        return self._call("GET", {
             "operation": "query",
-            "sessionName": self.session_name,
             "query": soql
-        }, timeout=10)
-        resp.raise_for_status()
-        return resp.json()
+        })
+
+    def query_records(self, soql: str):
+        """Lista `result` de una consulta; RuntimeError si vtiger no la acepta."""
+        data = self.query(soql)
+        if not data.get("success"):
+            raise RuntimeError(f"Query fallida: {data}")
+        return data["result"]
+
+    def iter_query(self, soql: str, page_size=MAX_PAGE_SIZE, columns=None, prefetch=True):
+        """
+        Todos los registros de `soql` (sin LIMIT), paginando de 100 en 100 y
+        pidiendo la página siguiente mientras se procesa la actual.
+        """
+        return iter_query(self.query_records, soql, page_size, columns, prefetch)
+
+    def iter_pages(self, soql: str, page_size=MAX_PAGE_SIZE, columns=None, prefetch=True):
+        """Como iter_query() pero por páginas (listas de registros)."""
+        return iter_pages(self.query_records, soql, page_size, columns, prefetch)
+
+    def iter_pages_since(self, soql: str, column: str, since=None, page_size=MAX_PAGE_SIZE, key="id"):
+        """
+        Páginas de `soql` recorridas por marca sobre `column` (p. ej.
+        modifiedtime) en vez de por offset; ver vtiger_http.iter_pages_since().
+        """
+        return iter_pages_since(self.query_records, soql, column, since, page_size, key)
 
     def create(self, element_type: str, element: dict):
-        payload = {
+        return self._call("POST", {
             "operation": "create",
-            "sessionName": self.session_name,
             "elementType": element_type,
-            "element": __import__("json").dumps(element)
-        }
-        r = requests.post(self.base, data=payload, timeout=10)
-        r.raise_for_status()
-        return r.json()
+            "element": json.dumps(element)
+        })
 
     def update(self, element_type: str, element: dict):
-        payload = {
+        return self._call("POST", {
             "operation": "update",
-            "sessionName": self.session_name,
             "elementType": element_type,
-            "element": __import__("json").dumps(element)
-        }
-        r = requests.post(self.base, data=payload, timeout=10)
-        r.raise_for_status()
-        return r.json()
+            "element": json.dumps(element)
+        })
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+
+from config import settings
+from db import claim_calls, close_pool, init_pool, mark_failed, mark_sent
+from call_sync import upsert_call_to_vtiger_async
+from vtiger_client import build_async_client
+
+logger = logging.getLogger("voip_integration.worker")
+
+# contadores expuestos en /metrics
+stats = {"claimed": 0, "sent": 0, "failed": 0, "gave_up": 0, "in_flight": 0}
+
+
+async def process_call(row: dict, sem: asyncio.Semaphore, vt):
+    """Sincroniza una fila reservada del buffer con vtiger y actualiza su estado."""
+    async with sem:
+        stats["in_flight"] += 1
+        try:
+            # reconciliar con vtiger solo si un intento previo pudo crear el Call sin guardar su id
+            # (fallido, worker caído o fila re-encolada por la PBX, aunque retries vuelva a 0)
+            reconcile = row["attempted"] and not row["vtiger_call_id"]
+            # cliente vtiger asíncrono compartido: sin un hilo por llamada
+            result = await upsert_call_to_vtiger_async(
+                vt, row["raw_payload"], row["vtiger_call_id"], reconcile
+            )
+            if not result.get("success"):
+                raise RuntimeError(f"Vtiger error: {result.get('error')}")
+            await asyncio.to_thread(mark_sent, row["id"], result["result"].get("id"))
+            stats["sent"] += 1
+        except Exception:
+            logger.exception("Error al enviar a Vtiger la llamada %s", row["call_uuid"])
+            retries = await asyncio.to_thread(mark_failed, row["id"])
+            stats["failed"] += 1
+            if retries is not None and retries >= settings.MAX_RETRIES:
+                stats["gave_up"] += 1
+                logger.error("Llamada %s descartada tras %d intentos", row["call_uuid"], retries)
+        finally:
+            stats["in_flight"] -= 1
+
+
+async def run_worker(stop: asyncio.Event):
+    """
+    Bucle que drena voip_call_buffer: reserva filas pendientes/fallidas con
+    FOR UPDATE SKIP LOCKED y las envía a vtiger con concurrencia acotada
+    (WORKER_CONCURRENCY). Si no hay trabajo espera WORKER_POLL_INTERVAL.
+    """
+    sem = asyncio.Semaphore(settings.WORKER_CONCURRENCY)
+    logger.info("Worker de sincronización arrancado (concurrencia %d)", settings.WORKER_CONCURRENCY)
+    async with build_async_client() as vt:
+        while not stop.is_set():
+            try:
+                rows = await asyncio.to_thread(claim_calls, settings.WORKER_BATCH_SIZE)
+            except Exception:
+                logger.exception("Error reservando llamadas del buffer")
+                rows = []
+            if rows:
+                stats["claimed"] += len(rows)
+                await asyncio.gather(*(process_call(row, sem, vt) for row in rows))
+                continue
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=settings.WORKER_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    logger.info("Worker de sincronización detenido")
+
+
+if __name__ == "__main__":
+    # modo proceso independiente: python worker.py (con WORKER_ENABLED=false en la app)
+    logging.basicConfig(level=logging.INFO)
+    init_pool()
+    try:
+        asyncio.run(run_worker(asyncio.Event()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_pool()
@@ -1,21 +1,36 @@
+import uuid
+
 import panel as pn
-from chatlogic import chatbot_callback  # your logic in a separate file is cleanest
+from chatlogic import chatbot_callback, session_store  # your logic in a separate file is cleanest
 
 
 
 
 pn.extension()
 
-chat_ui = pn.chat.ChatInterface(
-    callback=chatbot_callback,
-    callback_user="Assistant",
-)
 
-chat_ui.send(
-    "Buenos dias. Soy tu asistante, ¿como puedo ayudarte?",
-    user="Assistant",
-    respond=False
-)
-pn.serve(chat_ui, title="Albali Chatbot", port=5006, show=True)
+def create_chat_ui():
+    # una ChatInterface y un historial por sesión de Panel (pestaña del navegador)
+    context = pn.state.curdoc.session_context if pn.state.curdoc else None
+    session_id = context.id if context else uuid.uuid4().hex
+
+    async def callback(contents, user, instance):
+        # la respuesta llega en streaming: cada valor cedido sustituye al mensaje en curso
+        async for partial in chatbot_callback(contents, user, instance, session_id=session_id):
+            yield partial
+
+    chat_ui = pn.chat.ChatInterface(
+        callback=callback,
+        callback_user="Assistant",
+    )
+
+    chat_ui.send(
+        "Buenos dias. Soy tu asistante, ¿como puedo ayudarte?",
+        user="Assistant",
+        respond=False
+    )
+    pn.state.on_session_destroyed(lambda ctx: session_store.discard(session_id))
+    return chat_ui
 
 
+pn.serve(create_chat_ui, title="Albali Chatbot", port=5006, show=True)
@@ -1,8 +1,13 @@
 import os
 import time
-from openai import OpenAI
+import random
+import asyncio
+from openai import AsyncOpenAI, OpenAI
 from dotenv import load_dotenv
 from vtiger import get_leads_data, get_cursos_disponibles, get_precio_curso
+from session_store import IDLE_TTL, MAX_MESSAGES, MAX_SESSIONS, open_session_store
+from context_window import CONTEXT_TOKENS, SUMMARY_TOKENS, TOOL_RESULT_CHARS, ContextWindow, compact_tool_result
+from tool_cache import TOOL_CACHE_SIZE, TOOL_CACHE_TTL, ToolCache, cached_tool
 import json
 
 
@@ -14,8 +19,36 @@ client = OpenAI(
     api_key=api_key,
     base_url="https://openrouter.ai/api/v1"
 )
+# cliente asíncrono para las respuestas en streaming del chat
+aclient = AsyncOpenAI(
+    api_key=api_key,
+    base_url="https://openrouter.ai/api/v1"
+)
 model="gpt-3.5-turbo"
 
+# historial por sesión de Panel (en memoria o, con CHAT_STORE_PATH, en SQLite)
+session_store = open_session_store(
+    os.environ.get("CHAT_STORE_PATH") or None,
+    max_sessions=int(os.environ.get("CHAT_MAX_SESSIONS", MAX_SESSIONS)),
+    max_messages=int(os.environ.get("CHAT_MAX_MESSAGES", MAX_MESSAGES)),
+    idle_ttl=float(os.environ.get("CHAT_IDLE_TTL", IDLE_TTL)),
+)
+
+# presupuesto de tokens del prompt; los turnos que no caben se resumen
+context_window = ContextWindow(
+    budget=int(os.environ.get("CHAT_CONTEXT_TOKENS", CONTEXT_TOKENS)),
+    summary_tokens=int(os.environ.get("CHAT_SUMMARY_TOKENS", SUMMARY_TOKENS)),
+    model=model,
+)
+tool_result_chars = int(os.environ.get("CHAT_TOOL_RESULT_CHARS", TOOL_RESULT_CHARS))
+tool_timeout = float(os.environ.get("CHAT_TOOL_TIMEOUT", 10))  # segundos máximos por herramienta
+
+# catálogo y precios son iguales para todas las conversaciones: se cachean (ver invalidate_tool_cache)
+tool_cache = ToolCache(
+    maxsize=int(os.environ.get("CHAT_TOOL_CACHE_SIZE", TOOL_CACHE_SIZE)),
+    ttl=float(os.environ.get("CHAT_TOOL_CACHE_TTL", TOOL_CACHE_TTL)),
+)
+
 
 
 def retrieve_lead_data(data: str) -> str:
@@ -26,9 +59,11 @@ def retrieve_lead_data(data: str) -> str:
     return json.dumps({"error": "there is no lead corresponding to this data"})
 
 
+@cached_tool(tool_cache)
 def retrieve_courses() -> str:
     return json.dumps(get_cursos_disponibles())
 
+@cached_tool(tool_cache)
 def retrieve_prices(course_name: str) -> str:
     precio = get_precio_curso(course_name)
     if precio is not None:
@@ -36,6 +71,14 @@ def retrieve_prices(course_name: str) -> str:
     return json.dumps({f"{course_name}": "there is no course corresponding to this name"})
 
 
+def invalidate_tool_cache(name=None):
+    """
+    Olvida los resultados cacheados de una herramienta ("retrieve_courses",
+    "retrieve_prices") o de todas; llamar cuando cambie el catálogo en VTiger.
+    """
+    tool_cache.invalidate(name)
+
+
 tools_list = [
 {
     "type": "function",
@@ -88,9 +131,7 @@ functions_mapping = {
     "retrieve_prices": retrieve_prices,
 }
 
-chat_messages_history = []
-
-message = {"role": "system",
+system_message = {"role": "system",
            "content": """You are a helpful assistant working for a company providing courses.
                         You can answer normally to any general question.
                         You also have access to tools (functions) and should call them directly when appropriate. 
@@ -105,84 +146,224 @@ message = {"role": "system",
            }
 
 
-
-chat_messages_history.append(message)
-
-def call_llm(model, messages, tools=False):
+def llm_params(model, messages, tools=False, max_tokens=None):
 
     params = {"model": model,
               "messages": messages,}
+    if max_tokens:
+        params["max_tokens"] = max_tokens
 
     if tools:
         params["tools"] = tools_list
         params["tool_choice"] = "auto"
-
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            response = client.chat.completions.create(**params)
-            return response
-        except Exception as e:
-            error_msg = str(e).lower()
-            if "429" in error_msg or "rate limit" in error_msg:
-                print(f"[Retry {attempt + 1}/{max_retries}] Rate limit exceeded. Retrying in 5 seconds...")
-                time.sleep(5)
-
-    return None
+    return params
 
 
+def llm_should_retry(error):
+    """Solo se reintentan los límites de ritmo (429) y los errores 5xx del proveedor."""
+    error_msg = str(error).lower()
+    status = getattr(error, "status_code", None)
+    return status in (429, 500, 502, 503, 504) or "429" in error_msg or "rate limit" in error_msg
 
 
-def chatbot_callback(user_input, role, chat_interface):
+def llm_retry_wait(error, attempt):
+    # backoff exponencial con jitter; si el proveedor indica Retry-After se respeta
+    return llm_retry_after(error) or min(30, 2 ** attempt) * (0.5 + random.random())
 
-    message = {"role": "user",
-                "content": user_input,
-    }
 
-    chat_messages_history.append(message)
+def call_llm(model, messages, tools=False, max_tokens=None):
 
-    chat_response = call_llm(model, chat_messages_history, tools=True)
+    params = llm_params(model, messages, tools, max_tokens)
 
-    if chat_response.choices[0].message.content:
-        message = {"role": "assistant",
-                    "content": chat_response.choices[0].message.content,}
-        chat_messages_history.append(message)
-        return f"{chat_response.choices[0].message.content}"
-
-    elif chat_response.choices[0].message.tool_calls:
-
-        message = {"role": "assistant",
-                    "content": None,
-                    "tool_calls": chat_response.choices[0].message.tool_calls,}
-        chat_messages_history.append(message)
-
-        for call in chat_response.choices[0].message.tool_calls:
-            function_name = call.function.name
-            function_args = json.loads(call.function.arguments)
-
-            if function_name in functions_mapping:
-                tool_result = functions_mapping[function_name](**function_args)
-                print(f"{function_name} : {tool_result}")
-
-                message = {"tool_call_id": call.id,
-                            "role": "tool",
-                            "name": function_name,
-                            "content": tool_result,
-                            }
-                chat_messages_history.append(message)
+    max_retries = 5
+    for attempt in range(max_retries):
+        try:
+            response = client.chat.completions.create(**params)
+            return response
+        except Exception as e:
+            if not llm_should_retry(e):
+                print(f"LLM error: {e}")
+                return None
+            if attempt == max_retries - 1:
+                break
+            wait = llm_retry_wait(e, attempt)
+            print(f"[Retry {attempt + 1}/{max_retries}] Rate limit exceeded. Retrying in {wait:.1f} seconds...")
+            time.sleep(wait)
 
+    return None
 
-        chat_response = call_llm(model, chat_messages_history)
-        #print(f"le chat_response du dernier call avec resultats des tools : {chat_response.choices[0].message.content}")
 
-        message = {"role": "assistant",
-                    "content": chat_response.choices[0].message.content}
-        chat_messages_history.append(message)
-        #print("on envoie le content du response du tool")
-        return f"{chat_response.choices[0].message.content}"
+async def stream_llm(model, messages, tool_calls, tools=False):
+    """
+    Llamada al LLM en streaming (stream=True): cede el texto acumulado tras
+    cada trozo recibido. Los tool_calls llegan troceados en deltas con un
+    `index`; se van juntando en `tool_calls` (index -> dict con id, nombre y
+    argumentos) y el llamante los tiene completos al terminar el stream.
+    Los reintentos son los de call_llm() y solo antes del primer trozo.
+    """
+    params = llm_params(model, messages, tools)
+    params["stream"] = True
 
+    max_retries = 5
+    for attempt in range(max_retries):
+        try:
+            stream = await aclient.chat.completions.create(**params)
+            break
+        except Exception as e:
+            if not llm_should_retry(e) or attempt == max_retries - 1:
+                print(f"LLM error: {e}")
+                return
+            wait = llm_retry_wait(e, attempt)
+            print(f"[Retry {attempt + 1}/{max_retries}] Rate limit exceeded. Retrying in {wait:.1f} seconds...")
+            await asyncio.sleep(wait)
+
+    content = ""
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue  # p.ej. el trozo final con el uso de tokens
+            delta = chunk.choices[0].delta
+            for part in delta.tool_calls or []:
+                call = tool_calls.setdefault(part.index, {"id": "",
+                                                          "type": "function",
+                                                          "function": {"name": "", "arguments": ""}})
+                if part.id:
+                    call["id"] = part.id
+                if part.function:
+                    call["function"]["name"] += part.function.name or ""
+                    call["function"]["arguments"] += part.function.arguments or ""
+            if delta.content:
+                content += delta.content
+                yield content
+    except Exception as e:
+        # corte a mitad de respuesta: se queda con lo recibido hasta ahora
+        print(f"LLM stream error: {e}")
+    finally:
+        await stream.close()
+
+
+def llm_retry_after(error):
+    """Segundos de la cabecera Retry-After de un error de la API, si viene."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+
+
+def summarize_history(summary, messages):
+    """
+    Resumen acumulado: el resumen anterior más los mensajes que salen de la
+    ventana de contexto. Si el LLM falla se guarda un extracto literal.
+    """
+    lines = [f"{m['role']}: {m['content']}" for m in messages if m.get("content")]
+    prompt = [
+        {"role": "system",
+         "content": "Summarize this conversation between a course-sales assistant and a lead in a few sentences, "
+                    "in the conversation language. Keep every fact about the lead (name, email, phone, course of "
+                    "interest, prices quoted, requests). Return only the summary."},
+        {"role": "user",
+         "content": (f"Previous summary: {summary}\n\n" if summary else "") + "\n".join(lines)},
+    ]
+    response = call_llm(model, prompt, max_tokens=context_window.summary_tokens)
+    if response is not None and response.choices[0].message.content:
+        return context_window.clip_summary(response.choices[0].message.content)
+    return context_window.clip_summary(" ".join(filter(None, [summary] + lines)))
+
+
+def run_tool(call):
+    """Ejecuta un tool_call (dict) y devuelve el mensaje 'tool' con su resultado."""
+    function_name = call["function"]["name"]
+
+    if function_name in functions_mapping:
+        function_args = json.loads(call["function"]["arguments"] or "{}")
+        tool_result = functions_mapping[function_name](**function_args)
+        print(f"{function_name} : {tool_result}")
+        tool_result = compact_tool_result(tool_result, tool_result_chars)
     else:
-        return f"No response..."
-
-
-
+        # cada tool_call necesita su respuesta o la API rechaza el historial de la sesión
+        tool_result = json.dumps({"error": f"unknown function {function_name}"})
+
+    return {"tool_call_id": call["id"],
+            "role": "tool",
+            "name": function_name,
+            "content": tool_result,
+            }
+
+
+async def run_tool_async(call):
+    """
+    run_tool() en un hilo con `tool_timeout` segundos como máximo. Un fallo
+    o un timeout se devuelven como resultado de error para que el modelo
+    pueda contestar igualmente (el hilo no se puede cancelar y termina solo).
+    """
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(run_tool, call), timeout=tool_timeout)
+    except asyncio.TimeoutError:
+        error = f"timeout after {tool_timeout:g}s"
+    except Exception as e:
+        error = str(e)
+    print(f"{call['function']['name']} : {error}")
+    return {"tool_call_id": call["id"],
+            "role": "tool",
+            "name": call["function"]["name"],
+            "content": json.dumps({"error": error}),
+            }
+
+
+async def chatbot_callback(user_input, role, chat_interface, session_id=None):
+    """
+    Responde a un mensaje del usuario con el historial de su sesión
+    (`session_id`, por defecto el propio ChatInterface). Es un generador
+    asíncrono: cede la respuesta acumulada a medida que llega del LLM y la
+    ChatInterface la va pintando. Los mensajes del turno solo se guardan
+    en la sesión cuando el turno termina.
+    """
+    session_id = session_id or id(chat_interface)
+
+    turn = [{"role": "user",
+             "content": user_input,
+    }]
+
+    # ventana de contexto: los turnos que no caben en el presupuesto pasan al resumen
+    history, folded = context_window.fit(system_message, session_store.history(session_id), turn)
+    summary = session_store.summary(session_id)
+    if folded:
+        summary = await asyncio.to_thread(summarize_history, summary, folded)
+        session_store.replace(session_id, history, summary)
+    history = context_window.prompt(system_message, summary, history, [])
+
+    content = ""
+    tool_calls = {}
+    async for content in stream_llm(model, history + turn, tool_calls, tools=True):
+        yield content
+
+    if tool_calls:
+        calls = [tool_calls[i] for i in sorted(tool_calls)]
+        for call in calls:
+            # funciones sin parámetros: algunos modelos mandan argumentos vacíos
+            call["function"]["arguments"] = call["function"]["arguments"] or "{}"
+        message = {"role": "assistant",
+                    "content": content or None,
+                    "tool_calls": calls,}
+        turn.append(message)
+
+        # las herramientas consultan VTiger (bloqueante): todas a la vez, cada una en un hilo;
+        # gather devuelve los resultados en el orden de los tool_calls
+        turn.extend(await asyncio.gather(*(run_tool_async(call) for call in calls)))
+
+        content = ""
+        async for content in stream_llm(model, history + turn, {}):
+            yield content
+
+    if not content:
+        yield f"No response..."
+        return
+
+    message = {"role": "assistant",
+                "content": content}
+    turn.append(message)
+    session_store.append(session_id, *turn)
@@ -0,0 +1,145 @@
+import json
+
+# contador de tokens exacto opcional (ver ContextWindow.count_text)
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - depende del entorno
+    tiktoken = None
+
+# -------- valores por defecto (sobrescribibles desde el .env, ver chatlogic.py) ----------
+CONTEXT_TOKENS = 3000  # tokens del prompt por llamada: sistema + resumen + historial + turno
+SUMMARY_TOKENS = 300  # tokens reservados para el resumen de los turnos antiguos
+TOOL_RESULT_CHARS = 1500  # caracteres máximos del resultado de una herramienta
+# ------------------------------------------------------------------------------------------
+
+MESSAGE_OVERHEAD = 4  # tokens que añade la API por mensaje (rol y separadores)
+TOOL_LIST_ITEMS = 20  # elementos de una lista que se mantienen al compactar
+TOOL_STRING_CHARS = 200  # caracteres de cada texto al compactar
+FOLD_RATIO = 0.6  # al resumir, el historial se deja en esta fracción de lo disponible
+
+
+def _encoder(model):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # modelos de OpenRouter ("openai/gpt-4o"...) no los conoce tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:  # pragma: no cover - p.ej. sin red para descargar la codificación
+        return None
+
+
+def split_turns(messages):
+    """Agrupa el historial en turnos: cada uno empieza en un mensaje del usuario."""
+    turns = []
+    for m in messages:
+        if m["role"] == "user" or not turns:
+            turns.append([])
+        turns[-1].append(m)
+    return turns
+
+
+def compact_tool_result(content, max_chars=TOOL_RESULT_CHARS):
+    """
+    Reduce el JSON que devuelve una herramienta antes de mandarlo al LLM:
+    quita campos vacíos, corta listas y textos largos y, si aún se pasa de
+    `max_chars`, trunca el texto resultante.
+    """
+    def compact(value):
+        if isinstance(value, dict):
+            return {k: compact(v) for k, v in value.items() if v not in (None, "", [], {})}
+        if isinstance(value, list):
+            items = [compact(v) for v in value[:TOOL_LIST_ITEMS]]
+            if len(value) > TOOL_LIST_ITEMS:
+                items.append(f"... {len(value) - TOOL_LIST_ITEMS} más")
+            return items
+        if isinstance(value, str) and len(value) > TOOL_STRING_CHARS:
+            return value[:TOOL_STRING_CHARS] + "..."
+        return value
+
+    try:
+        content = json.dumps(compact(json.loads(content)), ensure_ascii=False)
+    except (TypeError, ValueError):
+        pass
+    if len(content) > max_chars:
+        content = content[:max_chars] + "..."
+    return content
+
+
+class ContextWindow:
+    """
+    Mantiene el prompt de cada llamada dentro de `budget` tokens: prompt de
+    sistema, resumen de la conversación anterior (hasta `summary_tokens`),
+    los turnos más recientes que quepan y el turno en curso.
+
+    fit() indica qué turnos del historial dejan de caber; chatlogic los
+    resume (junto con el resumen anterior) y guarda el resumen en la sesión,
+    así que solo se llama al LLM para resumir cuando algo sale de la ventana.
+
+    Los tokens se cuentan con tiktoken si está instalado y, si no, se
+    estiman como caracteres / 4.
+    """
+
+    def __init__(self, budget=CONTEXT_TOKENS, summary_tokens=SUMMARY_TOKENS, model=None):
+        self.budget = budget
+        self.summary_tokens = summary_tokens
+        self._encoder = _encoder(model or "gpt-3.5-turbo")
+
+    def count_text(self, text):
+        if not text:
+            return 0
+        if self._encoder is not None:
+            return len(self._encoder.encode(text))
+        return len(text) // 4 + 1
+
+    def count(self, messages):
+        total = 0
+        for m in messages:
+            total += MESSAGE_OVERHEAD + self.count_text(m.get("content"))
+            for call in m.get("tool_calls") or []:
+                total += self.count_text(call["function"]["name"]) + self.count_text(call["function"]["arguments"])
+        return total
+
+    def fit(self, system_message, history, turn):
+        """
+        Reparte el presupuesto y devuelve (historial que cabe, mensajes que
+        quedan fuera). El corte es siempre por turnos completos y, si hay
+        que resumir, deja sitio libre (FOLD_RATIO) para que los turnos
+        siguientes quepan sin volver a resumir en cada uno.
+        """
+        # el resumen va en su propio mensaje: se reserva también su prefijo
+        head = [system_message, self.summary_message("")]
+        available = self.budget - self.summary_tokens - self.count(head + turn)
+        if self.count(history) <= available:
+            return history, []
+        available *= FOLD_RATIO
+        turns = split_turns(history)
+        kept = 0
+        used = 0
+        for t in reversed(turns):
+            tokens = self.count(t)
+            if used + tokens > available:
+                break
+            used += tokens
+            kept += 1
+        cut = len(turns) - kept
+        folded = [m for t in turns[:cut] for m in t]
+        return [m for t in turns[cut:] for m in t], folded
+
+    def summary_message(self, summary):
+        return {"role": "system", "content": f"Resumen de la conversación anterior con este usuario: {summary}"}
+
+    def prompt(self, system_message, summary, history, turn):
+        """Mensajes que se mandan al LLM."""
+        head = [system_message] + ([self.summary_message(summary)] if summary else [])
+        return head + history + turn
+
+    def clip_summary(self, text):
+        """Recorta un resumen a `summary_tokens` (por si el modelo se alarga)."""
+        if self.count_text(text) <= self.summary_tokens:
+            return text
+        if self._encoder is not None:
+            return self._encoder.decode(self._encoder.encode(text)[-self.summary_tokens:])
+        # count_text() estima len // 4 + 1: caben (summary_tokens - 1) * 4 caracteres
+        return text[len(text) - (self.summary_tokens - 1) * 4:]
@@ -0,0 +1,260 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# -------- valores por defecto (sobrescribibles desde el .env, ver chatlogic.py) ----------
+MAX_SESSIONS = 500  # sesiones de chat guardadas a la vez (LRU)
+MAX_MESSAGES = 40  # mensajes por sesión, sin contar el prompt de sistema
+IDLE_TTL = 1800  # segundos sin actividad tras los que se descarta una sesión
+# ------------------------------------------------------------------------------------------
+
+
+def trim_history(messages, max_messages):
+    """
+    Deja como mucho los `max_messages` mensajes más recientes, empezando
+    siempre en un mensaje del usuario: un turno cortado (respuesta 'tool' sin
+    el 'assistant' con sus tool_calls) lo rechaza la API del LLM.
+    Si el último turno por sí solo pasa de `max_messages` se guarda entero:
+    vaciar la sesión perdería la conversación en curso.
+    """
+    if len(messages) <= max_messages:
+        return messages
+    users = [i for i, m in enumerate(messages) if m["role"] == "user"]
+    if not users:
+        return []
+    start = len(messages) - max_messages
+    return messages[next((i for i in users if i >= start), users[-1]):]
+
+
+class SessionStore:
+    """
+    Historial de conversación por sesión de Panel, en memoria.
+
+    - `max_messages`: mensajes guardados por sesión; al pasarse se descartan
+      los turnos más antiguos completos (ver trim_history).
+    - `max_sessions`: sesiones a la vez; al pasarse se expulsa la usada
+      hace más tiempo (LRU).
+    - `idle_ttl`: segundos sin actividad tras los que la sesión se descarta.
+
+    El prompt de sistema no se guarda: lo añade chatlogic en cada llamada.
+    Cada sesión guarda además el resumen de los turnos que ya no caben en
+    el prompt (ver context_window.py), que se sustituye junto con el
+    historial con replace().
+    """
+
+    def __init__(self, max_sessions=MAX_SESSIONS, max_messages=MAX_MESSAGES, idle_ttl=IDLE_TTL):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self.evicted = 0
+        self._sessions = OrderedDict()  # session_id -> [last_seen, mensajes, resumen]; la más antigua primero
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        while self._sessions:
+            session_id, (last_seen, _, _) = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and last_seen >= now - self.idle_ttl:
+                break
+            del self._sessions[session_id]
+            self.evicted += 1
+
+    def history(self, session_id):
+        """Copia de los mensajes guardados de la sesión (lista vacía si no existe)."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[0] < time.monotonic() - self.idle_ttl:
+                return []
+            return list(entry[1])
+
+    def summary(self, session_id):
+        """Resumen de los turnos antiguos de la sesión ("" si no hay)."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[0] < time.monotonic() - self.idle_ttl:
+                return ""
+            return entry[2]
+
+    def _update(self, session_id, change):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is None or entry[0] < now - self.idle_ttl:
+                entry = [now, [], ""]
+            entry[0] = now
+            change(entry)
+            entry[1] = trim_history(entry[1], self.max_messages)
+            self._sessions[session_id] = entry
+            self._evict(now)
+
+    def append(self, session_id, *messages):
+        def change(entry):
+            entry[1] = entry[1] + list(messages)
+        self._update(session_id, change)
+
+    def replace(self, session_id, messages, summary):
+        """Sustituye historial y resumen (al pasar turnos antiguos al resumen)."""
+        def change(entry):
+            entry[1] = list(messages)
+            entry[2] = summary
+        self._update(session_id, change)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            self._evict(time.monotonic())
+            return {"sessions": len(self._sessions), "evicted": self.evicted}
+
+
+class SQLiteSessionStore:
+    """
+    Misma interfaz que SessionStore pero con los historiales en SQLite, para
+    que la memoria del proceso no crezca con el número de sesiones y las
+    conversaciones sobrevivan a un reinicio del servidor.
+    """
+
+    def __init__(self, path, max_sessions=MAX_SESSIONS, max_messages=MAX_MESSAGES, idle_ttl=IDLE_TTL):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chat_sessions (
+                session_id TEXT PRIMARY KEY,
+                last_seen REAL NOT NULL,
+                summary TEXT NOT NULL DEFAULT ''
+            );
+            CREATE INDEX IF NOT EXISTS chat_sessions_last_seen ON chat_sessions (last_seen);
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            );
+            """
+        )
+        try:
+            # ficheros creados antes de guardar el resumen
+            self._conn.execute("ALTER TABLE chat_sessions ADD COLUMN summary TEXT NOT NULL DEFAULT ''")
+        except sqlite3.OperationalError:
+            pass
+        self._conn.commit()
+
+    def _rows(self, session_id):
+        return self._conn.execute(
+            "SELECT seq, message FROM chat_messages WHERE session_id = ? ORDER BY seq", (session_id,)
+        ).fetchall()
+
+    def _delete(self, session_ids):
+        for session_id in session_ids:
+            self._conn.execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+        self.evicted += len(session_ids)
+
+    def _evict(self, now):
+        # tiempo de reloj (no monotonic) porque la tabla sobrevive al proceso
+        idle = [r[0] for r in self._conn.execute(
+            "SELECT session_id FROM chat_sessions WHERE last_seen < ?", (now - self.idle_ttl,)
+        )]
+        sobrantes = [r[0] for r in self._conn.execute(
+            "SELECT session_id FROM chat_sessions WHERE last_seen >= ? "
+            "ORDER BY last_seen DESC LIMIT -1 OFFSET ?", (now - self.idle_ttl, self.max_sessions)
+        )]
+        self._delete(idle + sobrantes)
+
+    def history(self, session_id):
+        session_id = str(session_id)
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT last_seen FROM chat_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if fila is None or fila[0] < time.time() - self.idle_ttl:
+                return []
+            return [json.loads(m) for _, m in self._rows(session_id)]
+
+    def summary(self, session_id):
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT last_seen, summary FROM chat_sessions WHERE session_id = ?", (str(session_id),)
+            ).fetchone()
+            if fila is None or fila[0] < time.time() - self.idle_ttl:
+                return ""
+            return fila[1]
+
+    def _touch(self, session_id, now):
+        fila = self._conn.execute(
+            "SELECT last_seen FROM chat_sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if fila is not None and fila[0] < now - self.idle_ttl:
+            self._delete([session_id])
+        self._conn.execute(
+            "INSERT INTO chat_sessions (session_id, last_seen) VALUES (?, ?) "
+            "ON CONFLICT (session_id) DO UPDATE SET last_seen = excluded.last_seen",
+            (session_id, now),
+        )
+
+    def replace(self, session_id, messages, summary):
+        session_id = str(session_id)
+        now = time.time()
+        with self._lock:
+            self._touch(session_id, now)
+            self._conn.execute("UPDATE chat_sessions SET summary = ? WHERE session_id = ?", (summary, session_id))
+            self._conn.execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
+            messages = trim_history(list(messages), self.max_messages)
+            self._conn.executemany(
+                "INSERT INTO chat_messages (session_id, seq, message) VALUES (?, ?, ?)",
+                [(session_id, i, json.dumps(m)) for i, m in enumerate(messages)],
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def append(self, session_id, *messages):
+        session_id = str(session_id)
+        now = time.time()
+        with self._lock:
+            self._touch(session_id, now)
+            rows = self._rows(session_id)
+            seq = rows[-1][0] + 1 if rows else 0
+            self._conn.executemany(
+                "INSERT INTO chat_messages (session_id, seq, message) VALUES (?, ?, ?)",
+                [(session_id, seq + i, json.dumps(m)) for i, m in enumerate(messages)],
+            )
+            total = len(rows) + len(messages)
+            if total > self.max_messages:
+                todos = [json.loads(m) for _, m in rows] + list(messages)
+                primero = seq + len(messages) - len(trim_history(todos, self.max_messages))
+                self._conn.execute(
+                    "DELETE FROM chat_messages WHERE session_id = ? AND seq < ?", (session_id, primero)
+                )
+            self._evict(now)
+            self._conn.commit()
+
+    def discard(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM chat_messages WHERE session_id = ?", (str(session_id),))
+            self._conn.execute("DELETE FROM chat_sessions WHERE session_id = ?", (str(session_id),))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM chat_sessions").fetchone()[0]
+        return {"sessions": total, "evicted": self.evicted}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_session_store(path=None, **kwargs):
+    """SQLiteSessionStore si se indica `path`; si no, SessionStore en memoria."""
+    if path:
+        return SQLiteSessionStore(path, **kwargs)
+    return SessionStore(**kwargs)
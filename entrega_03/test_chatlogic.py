@@ -0,0 +1,197 @@
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import time
+import types
+from types import SimpleNamespace as NS
+
+import pytest
+
+
+def stub_module(name, **attrs):
+    # dependencias del chat que no hacen falta para probar la lógica (openai, panel...)
+    if name not in sys.modules and importlib.util.find_spec(name) is None:
+        sys.modules[name] = types.ModuleType(name)
+        sys.modules[name].__dict__.update(attrs)
+
+
+class FakeOpenAI:
+    def __init__(self, **kwargs):
+        pass
+
+
+stub_module("openai", OpenAI=FakeOpenAI, AsyncOpenAI=FakeOpenAI)
+stub_module("dotenv", load_dotenv=lambda *args, **kwargs: None)
+stub_module("panel")
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
+
+import chatlogic  # noqa: E402
+import context_window  # noqa: E402
+from session_store import SessionStore  # noqa: E402
+
+
+# -------- trozos con la forma de openai.types.chat.ChatCompletionChunk ----------
+
+def texto(content):
+    return NS(choices=[NS(delta=NS(content=content, tool_calls=None))])
+
+
+def tool_delta(index, id=None, name=None, arguments=None):
+    part = NS(index=index, id=id, function=NS(name=name, arguments=arguments))
+    return NS(choices=[NS(delta=NS(content=None, tool_calls=[part]))])
+
+
+class FakeStream:
+    """Stream asíncrono: cede los trozos y, si `error`, se corta después."""
+
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+        if self.error:
+            raise self.error
+
+    async def close(self):
+        self.closed = True
+
+
+class APIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+
+
+class FakeCompletions:
+    """chat.completions de AsyncOpenAI: cada create() consume la siguiente respuesta del guion."""
+
+    def __init__(self, guion):
+        self.guion = list(guion)
+        self.llamadas = []
+        self.streams = []
+
+    async def create(self, **params):
+        self.llamadas.append(params)
+        respuesta = self.guion.pop(0)
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        self.streams.append(respuesta)
+        return respuesta
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    monkeypatch.setattr(context_window, "tiktoken", None)
+    monkeypatch.setattr(chatlogic, "session_store", SessionStore())
+    monkeypatch.setattr(chatlogic, "llm_retry_wait", lambda error, attempt: 0)
+
+    def guion(*respuestas):
+        completions = FakeCompletions(respuestas)
+        monkeypatch.setattr(chatlogic, "aclient", NS(chat=NS(completions=completions)))
+        return completions
+
+    return guion
+
+
+def responder(user_input, session_id="s1"):
+    async def recoger():
+        return [c async for c in chatlogic.chatbot_callback(user_input, "user", None, session_id=session_id)]
+    return asyncio.run(recoger())
+
+
+def test_tool_call_deltas_are_merged_by_index(llm):
+    completions = llm(FakeStream([
+        tool_delta(0, id="call_a", name="retrieve_", arguments=""),
+        tool_delta(1, id="call_b", name="retrieve_prices", arguments='{"course'),
+        tool_delta(0, name="courses"),
+        tool_delta(1, arguments='_name": "Salud"}'),
+        NS(choices=[]),  # trozo final con el uso de tokens
+    ]))
+    tool_calls = {}
+
+    async def recoger():
+        return [c async for c in chatlogic.stream_llm("m", [], tool_calls, tools=True)]
+
+    assert asyncio.run(recoger()) == []
+    assert tool_calls == {
+        0: {"id": "call_a", "type": "function", "function": {"name": "retrieve_courses", "arguments": ""}},
+        1: {"id": "call_b", "type": "function", "function": {"name": "retrieve_prices",
+                                                             "arguments": '{"course_name": "Salud"}'}},
+    }
+    assert completions.llamadas[0]["stream"] is True
+    assert completions.streams[0].closed
+
+
+def test_tool_turn_normalises_empty_arguments(llm, monkeypatch):
+    monkeypatch.setitem(chatlogic.functions_mapping, "retrieve_courses", lambda: '["Salud"]')
+    completions = llm(
+        FakeStream([tool_delta(0, id="call_a", name="retrieve_courses", arguments="")]),
+        FakeStream([texto("Tenemos "), texto("Salud.")]),
+    )
+    assert responder("¿qué cursos hay?") == ["Tenemos ", "Tenemos Salud."]
+    *_, assistant, tool = completions.llamadas[1]["messages"]
+    assert assistant["tool_calls"][0]["function"]["arguments"] == "{}"
+    assert tool == {"tool_call_id": "call_a", "role": "tool", "name": "retrieve_courses", "content": '["Salud"]'}
+    # el turno completo queda en la sesión
+    historial = chatlogic.session_store.history("s1")
+    assert [m["role"] for m in historial] == ["user", "assistant", "tool", "assistant"]
+    assert historial[-1]["content"] == "Tenemos Salud."
+
+
+def test_partial_text_is_kept_when_stream_breaks(llm):
+    completions = llm(FakeStream([texto("El curso "), texto("cuesta")], error=APIError(503)))
+    assert responder("precio de Salud") == ["El curso ", "El curso cuesta"]
+    # un corte a mitad no se reintenta: se repetiría el texto ya pintado
+    assert len(completions.llamadas) == 1
+    assert completions.streams[0].closed
+    assert chatlogic.session_store.history("s1")[-1] == {"role": "assistant", "content": "El curso cuesta"}
+
+
+def test_retries_only_before_first_chunk(llm):
+    completions = llm(APIError(429), APIError(502), FakeStream([texto("Hola")]))
+    assert responder("hola") == ["Hola"]
+    assert len(completions.llamadas) == 3
+
+
+def test_non_retryable_error_gives_no_response(llm):
+    completions = llm(APIError(400))
+    assert responder("hola") == ["No response..."]
+    assert len(completions.llamadas) == 1
+    assert chatlogic.session_store.history("s1") == []
+
+
+def test_tool_results_keep_tool_call_order(llm, monkeypatch):
+    monkeypatch.setattr(chatlogic, "tool_timeout", 0.05)
+
+    def precio(course_name):
+        if course_name == "Salud":
+            time.sleep(0.2)  # más que tool_timeout; la primera en pedirse es la última en acabar
+        return f"{course_name}: 150€"
+
+    def rota(data):
+        raise ValueError("VTiger caído")
+
+    monkeypatch.setitem(chatlogic.functions_mapping, "retrieve_prices", precio)
+    monkeypatch.setitem(chatlogic.functions_mapping, "retrieve_lead_data", rota)
+    completions = llm(
+        FakeStream([
+            tool_delta(0, id="call_a", name="retrieve_prices", arguments='{"course_name": "Salud"}'),
+            tool_delta(1, id="call_b", name="retrieve_lead_data", arguments='{"data": "Carlos"}'),
+            tool_delta(2, id="call_c", name="retrieve_prices", arguments='{"course_name": "Electricidad"}'),
+        ]),
+        FakeStream([texto("Electricidad cuesta 150€.")]),
+    )
+    assert responder("precios")[-1] == "Electricidad cuesta 150€."
+    resultados = completions.llamadas[1]["messages"][-3:]
+    assert [(m["role"], m["tool_call_id"]) for m in resultados] == [
+        ("tool", "call_a"), ("tool", "call_b"), ("tool", "call_c"),
+    ]
+    # el timeout y la excepción llegan al modelo como resultado de error
+    assert json.loads(resultados[0]["content"]) == {"error": "timeout after 0.05s"}
+    assert json.loads(resultados[1]["content"]) == {"error": "VTiger caído"}
+    assert resultados[2]["content"] == "Electricidad: 150€"
@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+import context_window
+from context_window import ContextWindow, compact_tool_result, split_turns
+
+SYSTEM = {"role": "system", "content": "Eres el asistente de ventas de cursos." * 5}
+
+
+@pytest.fixture(autouse=True)
+def sin_tiktoken(monkeypatch):
+    # recuento estimado (caracteres / 4) para que el resultado no dependa del entorno
+    monkeypatch.setattr(context_window, "tiktoken", None)
+
+
+def conversacion(n_turnos, chars=200):
+    mensajes = []
+    for i in range(n_turnos):
+        mensajes.append({"role": "user", "content": f"pregunta {i} " + "x" * chars})
+        if i % 2:
+            mensajes.append({"role": "assistant", "content": None, "tool_calls": [
+                {"id": f"c{i}", "type": "function", "function": {"name": "retrieve_courses", "arguments": "{}"}},
+            ]})
+            mensajes.append({"role": "tool", "tool_call_id": f"c{i}", "content": '["Salud"]'})
+        mensajes.append({"role": "assistant", "content": f"respuesta {i} " + "y" * chars})
+    return mensajes
+
+
+def test_split_turns_starts_each_turn_at_user():
+    turnos = split_turns(conversacion(4))
+    assert [len(t) for t in turnos] == [2, 4, 2, 4]
+    assert all(t[0]["role"] == "user" for t in turnos)
+
+
+def test_history_that_fits_is_not_folded():
+    cw = ContextWindow(budget=3000, summary_tokens=300)
+    historial = conversacion(3)
+    assert cw.fit(SYSTEM, historial, [{"role": "user", "content": "hola"}]) == (historial, [])
+
+
+def test_fold_happens_at_turn_boundaries():
+    cw = ContextWindow(budget=1000, summary_tokens=100)
+    historial = conversacion(12)
+    turno = [{"role": "user", "content": "¿y el precio?"}]
+    kept, folded = cw.fit(SYSTEM, historial, turno)
+    assert folded and kept
+    assert folded + kept == historial
+    assert kept[0]["role"] == "user"
+    # lo que sale de la ventana son turnos completos (ningún 'tool' sin su 'assistant')
+    assert split_turns(folded) + split_turns(kept) == split_turns(historial)
+    # deja margen para que el siguiente turno quepa sin volver a resumir
+    kept2, folded2 = cw.fit(SYSTEM, kept + turno + [{"role": "assistant", "content": "200€"}], turno)
+    assert folded2 == []
+
+
+@pytest.mark.parametrize("n_turnos", [1, 3, 6, 12, 40])
+def test_prompt_stays_within_budget(n_turnos):
+    cw = ContextWindow(budget=1000, summary_tokens=100)
+    turno = [{"role": "user", "content": "quiero información del curso de Salud"}]
+    # peor caso: resumen del tamaño máximo
+    resumen = cw.clip_summary("el lead se llama Carlos y pregunta por Electricidad. " * 50)
+    assert cw.count_text(resumen) <= cw.summary_tokens
+    # historiales de todos los tamaños, incluidos los que caben justo sin resumir
+    for chars in range(0, 4000 // n_turnos, 4):
+        kept, folded = cw.fit(SYSTEM, conversacion(n_turnos, chars), turno)
+        assert cw.count(cw.prompt(SYSTEM, resumen, kept, turno)) <= cw.budget
+
+
+def test_prompt_puts_summary_after_system_message():
+    cw = ContextWindow()
+    prompt = cw.prompt(SYSTEM, "resumen", [], [{"role": "user", "content": "hola"}])
+    assert prompt[0] == SYSTEM
+    assert prompt[1]["role"] == "system" and prompt[1]["content"].endswith("resumen")
+    assert cw.prompt(SYSTEM, "", [], [])[1:] == []
+
+
+def test_compact_tool_result_json():
+    resultado = {
+        "curso": "Salud",
+        "email": "",
+        "telefono": None,
+        "fechas": [f"2025-10-{d:02d}" for d in range(1, 31)],
+        "descripcion": "d" * 500,
+    }
+    compacto = json.loads(compact_tool_result(json.dumps(resultado), max_chars=10_000))
+    assert "email" not in compacto and "telefono" not in compacto
+    assert compacto["fechas"][:20] == resultado["fechas"][:20]
+    assert compacto["fechas"][20] == "... 10 más"
+    assert compacto["descripcion"] == "d" * context_window.TOOL_STRING_CHARS + "..."
+    # sigue siendo JSON con tildes legibles
+    assert compact_tool_result('{"curso": "Hostelería"}') == '{"curso": "Hostelería"}'
+
+
+def test_compact_tool_result_non_json_and_max_chars():
+    assert compact_tool_result("timeout after 10s") == "timeout after 10s"
+    assert compact_tool_result("z" * 50, max_chars=10) == "z" * 10 + "..."
+    largo = json.dumps([{"curso": f"Curso {i}", "precio": "200€"} for i in range(20)])
+    assert len(compact_tool_result(largo, max_chars=100)) == 103
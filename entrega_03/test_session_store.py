@@ -0,0 +1,146 @@
+import pytest
+
+import session_store
+from session_store import SessionStore, SQLiteSessionStore, trim_history
+
+
+def user(texto):
+    return {"role": "user", "content": texto}
+
+
+def assistant(texto):
+    return {"role": "assistant", "content": texto}
+
+
+def tool_turn(texto, n_tools):
+    """Turno con una llamada a herramientas: user, assistant con tool_calls, n respuestas tool y la respuesta final."""
+    calls = [{"id": f"c{i}", "type": "function", "function": {"name": "cursos", "arguments": "{}"}} for i in range(n_tools)]
+    return (
+        [user(texto), {"role": "assistant", "content": None, "tool_calls": calls}]
+        + [{"role": "tool", "tool_call_id": f"c{i}", "content": "[]"} for i in range(n_tools)]
+        + [assistant("respuesta")]
+    )
+
+
+class Reloj:
+    """Sustituye a time en session_store: monotonic() y time() avanzan a mano."""
+
+    def __init__(self):
+        self.ahora = 1_000_000.0
+
+    def monotonic(self):
+        return self.ahora
+
+    def time(self):
+        return self.ahora
+
+
+@pytest.fixture(params=["memoria", "sqlite"])
+def make_store(request, tmp_path, monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(session_store, "time", reloj)
+    stores = []
+
+    def make(**kwargs):
+        if request.param == "memoria":
+            store = SessionStore(**kwargs)
+        else:
+            store = SQLiteSessionStore(str(tmp_path / f"chat{len(stores)}.sqlite"), **kwargs)
+        stores.append(store)
+        return store
+
+    make.reloj = reloj
+    yield make
+    for store in stores:
+        if isinstance(store, SQLiteSessionStore):
+            store.close()
+
+
+def test_trim_history_cuts_at_turn_boundary():
+    mensajes = [user("a"), assistant("1")] + tool_turn("b", 1) + [user("c"), assistant("3")]
+    assert trim_history(mensajes, 10) == mensajes
+    # los 5 últimos empiezan en mitad del turno "b": se descarta entero
+    assert trim_history(mensajes, 5) == [user("c"), assistant("3")]
+    assert trim_history(mensajes, 6) == tool_turn("b", 1) + [user("c"), assistant("3")]
+
+
+def test_trim_history_keeps_oversized_last_turn():
+    turno = tool_turn("b", 6)  # 9 mensajes
+    mensajes = [user("a"), assistant("1")] + turno
+    assert trim_history(mensajes, 4) == turno
+    assert trim_history([assistant("sin usuario")] * 5, 4) == []
+
+
+def test_append_trims_oldest_turns(make_store):
+    store = make_store(max_messages=4)
+    for i in range(3):
+        store.append("s1", user(f"p{i}"), assistant(f"r{i}"))
+    assert store.history("s1") == [user("p1"), assistant("r1"), user("p2"), assistant("r2")]
+    store.append("s1", *tool_turn("p3", 1))
+    assert store.history("s1") == tool_turn("p3", 1)
+
+
+def test_oversized_turn_does_not_wipe_session(make_store):
+    store = make_store(max_messages=4)
+    store.append("s1", user("p0"), assistant("r0"))
+    store.append("s1", *tool_turn("p1", 5))
+    assert store.history("s1") == tool_turn("p1", 5)
+    store.append("s1", user("p2"), assistant("r2"))
+    assert store.history("s1") == [user("p2"), assistant("r2")]
+
+
+def test_replace_sets_history_and_summary(make_store):
+    store = make_store(max_messages=4)
+    store.append("s1", user("p0"), assistant("r0"), user("p1"), assistant("r1"))
+    store.replace("s1", [user("p1"), assistant("r1")], "el usuario preguntó por Salud")
+    assert store.history("s1") == [user("p1"), assistant("r1")]
+    assert store.summary("s1") == "el usuario preguntó por Salud"
+    store.append("s1", user("p2"), assistant("r2"))
+    assert store.history("s1") == [user("p1"), assistant("r1"), user("p2"), assistant("r2")]
+    assert store.summary("s2") == ""
+
+
+def test_lru_evicts_least_recently_used_session(make_store):
+    store = make_store(max_sessions=2)
+    store.append("s1", user("a"))
+    make_store.reloj.ahora += 1
+    store.append("s2", user("b"))
+    make_store.reloj.ahora += 1
+    store.append("s1", assistant("a2"))  # s1 pasa a ser la más reciente
+    make_store.reloj.ahora += 1
+    store.append("s3", user("c"))
+    assert store.history("s2") == []
+    assert store.history("s1") == [user("a"), assistant("a2")]
+    assert store.stats() == {"sessions": 2, "evicted": 1}
+
+
+def test_idle_session_is_discarded(make_store):
+    store = make_store(idle_ttl=60)
+    store.append("s1", user("a"), assistant("b"))
+    store.replace("s2", [user("x")], "resumen")
+    make_store.reloj.ahora += 61
+    assert store.history("s1") == []
+    assert store.summary("s2") == ""
+    # al volver a escribir empieza una sesión nueva, sin los mensajes caducados
+    store.append("s1", user("c"))
+    assert store.history("s1") == [user("c")]
+    assert store.stats()["sessions"] == 1
+
+
+def test_sqlite_seq_stays_consistent_across_trims(tmp_path):
+    path = str(tmp_path / "chat.sqlite")
+    store = SQLiteSessionStore(path, max_messages=5)
+    for i in range(6):
+        store.append("s1", user(f"p{i}"), assistant(f"r{i}"))
+    store.append("s1", *tool_turn("p6", 2))
+    filas = store._rows("s1")
+    # se borran los seq más antiguos y los nuevos siguen numerándose tras el último
+    assert [seq for seq, _ in filas] == list(range(12, 17))
+    store.close()
+
+    # el historial sobrevive a un reinicio y sigue donde estaba
+    store = SQLiteSessionStore(path, max_messages=5)
+    assert store.history("s1") == tool_turn("p6", 2)
+    store.append("s1", user("p7"))
+    assert [seq for seq, _ in store._rows("s1")] == [17]
+    store.close()
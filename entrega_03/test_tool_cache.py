@@ -0,0 +1,134 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tool_cache import ToolCache, cached_tool
+
+
+def esperar(condicion, timeout=5):
+    limite = time.monotonic() + timeout
+    while not condicion():
+        assert time.monotonic() < limite, "timeout esperando a los hilos"
+        time.sleep(0.001)
+
+
+def test_concurrent_misses_compute_once():
+    cache = ToolCache()
+    liberar = threading.Event()
+    llamadas = []
+
+    def compute():
+        llamadas.append(1)
+        liberar.wait(5)
+        return ["Salud", "Electricidad"]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futuros = [pool.submit(cache.get_or_compute, ("cursos",), compute) for _ in range(8)]
+        # todos menos el primero quedan esperando al cálculo en curso
+        esperar(lambda: cache.stats()["coalesced"] == 7)
+        liberar.set()
+        resultados = [f.result() for f in futuros]
+    assert resultados == [["Salud", "Electricidad"]] * 8
+    assert len(llamadas) == 1
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["coalesced"] == 7
+    assert cache.get_or_compute(("cursos",), compute) == ["Salud", "Electricidad"]
+    assert cache.stats()["hits"] == 1
+
+
+def test_error_reaches_every_waiter_and_is_not_cached():
+    cache = ToolCache()
+    liberar = threading.Event()
+
+    def falla():
+        liberar.wait(5)
+        raise RuntimeError("VTiger caído")
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futuros = [pool.submit(cache.get_or_compute, ("precio", "Salud"), falla) for _ in range(4)]
+        esperar(lambda: cache.stats()["coalesced"] == 3)
+        liberar.set()
+        for f in futuros:
+            with pytest.raises(RuntimeError, match="VTiger caído"):
+                f.result()
+    # el siguiente intento vuelve a ejecutar la función
+    assert cache.get_or_compute(("precio", "Salud"), lambda: "200€") == "200€"
+    assert cache.stats()["size"] == 1
+
+
+def test_invalidate_during_compute_does_not_store_value():
+    cache = ToolCache()
+    empezado = threading.Event()
+    liberar = threading.Event()
+
+    def compute():
+        empezado.set()
+        liberar.wait(5)
+        return "viejo"
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        futuro = pool.submit(cache.get_or_compute, ("cursos",), compute)
+        assert empezado.wait(5)
+        cache.invalidate("cursos")
+        liberar.set()
+        # quien lo pidió recibe su resultado, pero no queda en cache
+        assert futuro.result() == "viejo"
+    assert cache.stats()["size"] == 0
+    assert cache.get_or_compute(("cursos",), lambda: "nuevo") == "nuevo"
+
+
+@pytest.mark.parametrize("invalidar, guardado", [("precio", True), ("cursos", False), (None, False)])
+def test_invalidate_only_discards_computes_of_that_tool(invalidar, guardado):
+    cache = ToolCache()
+    empezado = threading.Event()
+    liberar = threading.Event()
+
+    def compute():
+        empezado.set()
+        liberar.wait(5)
+        return ["Salud"]
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        futuro = pool.submit(cache.get_or_compute, ("cursos",), compute)
+        assert empezado.wait(5)
+        cache.invalidate(invalidar)
+        liberar.set()
+        assert futuro.result() == ["Salud"]
+    assert cache.stats()["size"] == (1 if guardado else 0)
+
+
+def test_ttl_and_lru_eviction():
+    cache = ToolCache(maxsize=2, ttl=0)
+    cache.get_or_compute(("a",), lambda: 1)
+    # con ttl=0 la entrada ya no vale en la siguiente petición
+    assert cache.get_or_compute(("a",), lambda: 2) == 2
+
+    cache = ToolCache(maxsize=2)
+    for key in "abc":
+        cache.get_or_compute((key,), lambda: key)
+    stats = cache.stats()
+    assert stats["size"] == 2 and stats["evictions"] == 1
+    assert cache.get_or_compute(("a",), lambda: "otra vez") == "otra vez"
+
+
+def test_cached_tool_invalidates_only_its_results():
+    cache = ToolCache()
+    llamadas = []
+
+    @cached_tool(cache)
+    def precio(curso):
+        llamadas.append(curso)
+        return len(llamadas)
+
+    @cached_tool(cache)
+    def cursos():
+        return ["Salud"]
+
+    assert precio("Salud") == precio("Salud") == 1
+    assert precio(curso="Salud") == 2  # otra clave: argumento por nombre
+    cursos()
+    precio.invalidate()
+    assert cache.stats()["size"] == 1
+    assert precio("Salud") == 3
@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+import vtiger
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeHTTP:
+    """Webservice de vtiger mínimo: cada login da una sesión nueva y solo la última vale."""
+
+    def __init__(self):
+        self.logins = 0
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def get(self, url, params):
+        if params["operation"] == "getchallenge":
+            return FakeResponse({"success": True, "result": {"token": "t"}})
+        with self._lock:
+            self.queries.append(params["sessionName"])
+            valida = params["sessionName"] == f"s{self.logins}"
+        if not valida:
+            return FakeResponse({"success": False, "error": {"code": "INVALID_SESSIONID"}})
+        return FakeResponse({"success": True, "result": [{"productname": "Salud"}]})
+
+    def post(self, url, data):
+        with self._lock:
+            self.logins += 1
+            return FakeResponse({"success": True, "result": {"sessionName": f"s{self.logins}"}})
+
+
+@pytest.fixture
+def http(monkeypatch):
+    fake = FakeHTTP()
+    monkeypatch.setenv("VTIGER_BASE_URL", "http://crm")
+    monkeypatch.setenv("VTIGER_USERNAME", "bot")
+    monkeypatch.setenv("VTIGER_ACCESS_KEY", "k")
+    monkeypatch.setattr(vtiger, "get_session", lambda: fake)
+    monkeypatch.setattr(vtiger, "_session_cache", vtiger.SessionCache(vtiger._login, ttl=60))
+    return fake
+
+
+def test_parallel_tools_share_one_login(http):
+    hilos = [threading.Thread(target=vtiger.vtiger_query, args=("SELECT productname FROM Products;",)) for _ in range(8)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    assert http.logins == 1
+    assert http.queries == ["s1"] * 8
+
+
+def test_expired_session_is_renewed_once(http):
+    vtiger.vtiger_query("SELECT productname FROM Products;")
+    http.logins += 1  # el servidor caduca s1
+    assert vtiger.vtiger_query("SELECT productname FROM Products;") == [{"productname": "Salud"}]
+    assert http.queries == ["s1", "s1", "s3"]
+    assert vtiger._session_cache.stats()["refreshes"] == 1
+
+
+def test_query_values_escape_backslash_and_quote(monkeypatch):
+    consultas = []
+    monkeypatch.setenv("USAR_VTIGER", "1")
+    monkeypatch.setattr(vtiger, "vtiger_query", lambda q: consultas.append(q) or [])
+    assert vtiger.get_precio_curso("Salud\\") is None
+    assert vtiger.get_leads_data("o'neil\\' OR 1=1 --") is None
+    assert consultas[0] == r"SELECT unit_price FROM Products WHERE productname = 'Salud\\' LIMIT 1;"
+    assert r"WHERE email = 'o\'neil\\\' OR 1=1 --' OR phone" in consultas[1]
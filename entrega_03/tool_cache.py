@@ -0,0 +1,118 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# -------- valores por defecto (sobrescribibles desde el .env, ver chatlogic.py) ----------
+TOOL_CACHE_SIZE = 256  # resultados guardados a la vez (LRU)
+TOOL_CACHE_TTL = 300  # segundos que un resultado se da por bueno
+# ------------------------------------------------------------------------------------------
+
+
+class ToolCache:
+    """
+    Cache en memoria de los resultados de las herramientas del chatbot:
+    LRU de `maxsize` entradas, cada una válida `ttl` segundos.
+
+    - single-flight: si varias conversaciones piden a la vez la misma clave
+      que no está en cache, solo la primera ejecuta la función (la consulta
+      a VTiger); el resto espera su resultado.
+    - invalidate(): borra todo o solo lo de una herramienta (el primer
+      elemento de la clave); lo que esa herramienta esté calculándose en ese
+      momento no se guarda, para no reponer un valor anterior a la
+      invalidación. Los cálculos de otras herramientas no se ven afectados.
+    - stats(): aciertos, fallos, esperas compartidas y tasa de acierto.
+    Los errores no se cachean: se propagan a todos los que esperaban.
+    """
+
+    def __init__(self, maxsize=TOOL_CACHE_SIZE, ttl=TOOL_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # clave -> (valor, expires_at)
+        self._inflight = {}  # clave -> Future de la ejecución en curso
+        self._generation = 0  # sube con invalidate() de todo
+        self._tool_generation = {}  # nombre de herramienta -> generación propia
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "invalidations": 0}
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[1] >= time.monotonic():
+                    self._data.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return entry[0]
+                del self._data[key]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                generation = self._generation_of(key)
+                self.counters["misses"] += 1
+            else:
+                self.counters["coalesced"] += 1
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._inflight.pop(key, None)
+            if generation == self._generation_of(key):
+                self._data[key] = (value, time.monotonic() + self.ttl)
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.counters["evictions"] += 1
+        future.set_result(value)
+        return value
+
+    def _generation_of(self, key):
+        return self._generation, self._tool_generation.get(key[0], 0)
+
+    def invalidate(self, name=None):
+        """Borra los resultados de la herramienta `name` (o todos)."""
+        with self._lock:
+            self.counters["invalidations"] += 1
+            if name is None:
+                self._generation += 1
+                self._data.clear()
+            else:
+                self._tool_generation[name] = self._tool_generation.get(name, 0) + 1
+                for key in [k for k in self._data if k[0] == name]:
+                    del self._data[key]
+
+    def stats(self):
+        with self._lock:
+            peticiones = self.counters["hits"] + self.counters["misses"] + self.counters["coalesced"]
+            return {
+                **self.counters,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hit_rate": round((self.counters["hits"] + self.counters["coalesced"]) / peticiones, 3)
+                if peticiones else 0.0,
+            }
+
+
+def cached_tool(cache):
+    """
+    Decorador: cachea el resultado de una herramienta en `cache` con clave
+    (nombre de la función, argumentos). La función decorada tiene
+    `invalidate()` para borrar solo sus resultados.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (fn.__name__,) + args + tuple(sorted(kwargs.items()))
+            return cache.get_or_compute(key, lambda: fn(*args, **kwargs))
+
+        wrapper.invalidate = lambda: cache.invalidate(fn.__name__)
+        return wrapper
+    return decorator
@@ -1,6 +1,14 @@
+import os
+import sys
+import json
+import hashlib
+
+# paquete común vtiger_http en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vtiger_http import SessionCache, get_session, is_invalid_session, iter_query, vtql_literal
 
 # aqui podemos dejar la logica de conexion a VTiger
-# para el prototipo de bot, tenemos datos dummy
+# para el prototipo de bot, tenemos datos dummy salvo que USAR_VTIGER=1 en el .env
 
 
 leads = [
@@ -103,7 +111,63 @@ cursos_disponibles = [
 
 
 
+# -------- conexión real a VTiger (opcional) ----------
+SESSION_TTL = 1800  # segundos que se reutiliza el sessionName antes de pedir otro
+
+
+def usar_vtiger():
+    # se lee en cada llamada porque chatlogic carga el .env después de importar este módulo
+    return os.environ.get("USAR_VTIGER", "0") == "1"
+
+
+def _webservice_url():
+    return os.environ["VTIGER_BASE_URL"].rstrip("/") + "/webservice.php"
+
+
+def _login():
+    http = get_session()
+    username = os.environ["VTIGER_USERNAME"]
+    r = http.get(_webservice_url(), params={"operation": "getchallenge", "username": username})
+    r.raise_for_status()
+    token = r.json()["result"]["token"]
+    key = hashlib.md5((token + os.environ["VTIGER_ACCESS_KEY"]).encode()).hexdigest()
+    r = http.post(_webservice_url(), data={"operation": "login", "username": username, "accessKey": key})
+    r.raise_for_status()
+    return r.json()["result"]["sessionName"]
+
+
+# las herramientas se ejecutan en hilos en paralelo: la cache hace un solo login a la vez
+_session_cache = SessionCache(_login, ttl=SESSION_TTL)
+
+
+def vtiger_query(query):
+    session = _session_cache.get()
+    for attempt in range(2):
+        r = get_session().get(_webservice_url(), params={"operation": "query", "sessionName": session, "query": query})
+        r.raise_for_status()
+        data = r.json()
+        if attempt == 0 and is_invalid_session(data):
+            # sesión caducada en el servidor: se renueva una vez y se repite la consulta
+            session = _session_cache.refresh(session)
+            continue
+        break
+    if not data.get("success"):
+        raise RuntimeError(f"Query fallida: {json.dumps(data)}")
+    return data["result"]
+
+
+# ------------------------------------------------------
+
+
 def get_leads_data(lead_data):
+    if usar_vtiger():
+        v = vtql_literal(lead_data)
+        rows = vtiger_query(
+            f"SELECT firstname, lastname, email, phone, leadstatus, leadsource FROM Leads "
+            f"WHERE email = {v} OR phone = {v} OR lastname = {v} LIMIT 1;"
+        )
+        return rows[0] if rows else None
+
     for lead in leads:
         if lead_data in list(lead.values()):
             return lead
@@ -111,10 +175,18 @@ def get_leads_data(lead_data):
 
 
 def get_cursos_disponibles():
+    if usar_vtiger():
+        # los cursos se modelan como Products en VTiger
+        # paginado: vtiger devuelve como máximo 100 filas por consulta
+        q = "SELECT productname FROM Products WHERE discontinued = 1 ORDER BY productname"
+        return [r["productname"] for r in iter_query(vtiger_query, q)]
     cursos = [c.get("curso") for c in cursos_disponibles]
     return cursos
 
 def get_precio_curso(curso):
+    if usar_vtiger():
+        rows = vtiger_query(f"SELECT unit_price FROM Products WHERE productname = {vtql_literal(curso)} LIMIT 1;")
+        return rows[0]["unit_price"] if rows else None
     for c in cursos_disponibles:
         if c.get("curso") == curso:
             return c.get("precio")
@@ -0,0 +1,47 @@
+"""
+Capa HTTP común para hablar con la API webservice de vtiger desde las tres
+entregas (distribuidor de leads, integración VoIP y chatbot).
+"""
+from .aio import AsyncVtigerClient
+from .paging import (
+    MAX_PAGE_SIZE,
+    aiter_pages,
+    aiter_query,
+    iter_pages,
+    iter_pages_since,
+    iter_query,
+    iter_query_since,
+    vtql_literal,
+)
+from .ratelimit import RateLimiter, TokenBucket, get_limiter
+from .sessions import INVALID_SESSION_CODES, SessionCache, is_invalid_session
+from .transport import (
+    RETRY_STATUS,
+    TimeoutHTTPAdapter,
+    build_session,
+    ensure_pool_size,
+    get_session,
+)
+
+__all__ = [
+    "AsyncVtigerClient",
+    "MAX_PAGE_SIZE",
+    "aiter_pages",
+    "aiter_query",
+    "iter_pages",
+    "iter_pages_since",
+    "iter_query",
+    "iter_query_since",
+    "vtql_literal",
+    "RateLimiter",
+    "TokenBucket",
+    "get_limiter",
+    "INVALID_SESSION_CODES",
+    "SessionCache",
+    "is_invalid_session",
+    "RETRY_STATUS",
+    "TimeoutHTTPAdapter",
+    "build_session",
+    "ensure_pool_size",
+    "get_session",
+]
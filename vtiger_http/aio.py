@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import json
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - httpx solo es necesario para el cliente asíncrono
+    httpx = None
+
+from .paging import MAX_PAGE_SIZE, aiter_pages, aiter_query
+from .sessions import is_invalid_session
+from .transport import DEFAULT_BACKOFF, DEFAULT_POOL_SIZE, DEFAULT_RETRIES, DEFAULT_TIMEOUT, RETRY_STATUS
+
+
+class AsyncVtigerClient:
+    """
+    Cliente asíncrono (httpx.AsyncClient) de la API webservice de vtiger con
+    las mismas operaciones que VtigerClient: login, query, create, update y lookup,
+    más iter_query() / iter_pages() para recorrer consultas de más de 100 filas.
+
+    - `max_connections`: conexiones keep-alive del pool httpx.
+    - `concurrency`: peticiones en vuelo como máximo (semáforo); por defecto
+      igual a `max_connections`, el resto espera sin ocupar conexiones.
+    - `retries` / `backoff`: reintentos con backoff exponencial en 429/5xx y
+      errores de red, respetando Retry-After. Igual que build_session(), los
+      POST (create/update) solo se reintentan si la petición no llegó a
+      enviarse: tras un 429/5xx no se sabe si vtiger llegó a crear el
+      registro, y repetirlo podría duplicarlo.
+      Los reintentos son cancelables: una cancelación (timeout del llamante,
+      apagado del worker) se propaga en el acto y libera el semáforo.
+    - `cache`: SessionCache compartida con los clientes síncronos del proceso
+      (se consulta en un hilo); sin ella el cliente hace su propio login.
+    - `limiter`: RateLimiter (normalmente el mismo que el de la sesión
+      requests); se espera turno antes de ocupar el semáforo.
+    """
+
+    def __init__(self, url, username=None, access_key=None, *, cache=None,
+                 max_connections=DEFAULT_POOL_SIZE, concurrency=None, timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, limiter=None, transport=None):
+        if httpx is None:
+            raise RuntimeError("AsyncVtigerClient necesita httpx (pip install httpx)")
+        if cache is None and not (username and access_key):
+            raise ValueError("Hace falta una SessionCache o username + access_key")
+        self.base = url.rstrip("/")
+        self.username = username
+        self.access_key = access_key
+        self.cache = cache
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = limiter
+        self.session_name = None
+        self._login_lock = asyncio.Lock()
+        self._sem = asyncio.Semaphore(concurrency or max_connections)
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout,
+            transport=transport,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    # ------------------------------------------------------------------ HTTP
+
+    def _espera(self, intento, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff * (2 ** intento)
+
+    async def _request(self, method, data):
+        """Petición con reintentos; devuelve el JSON de la respuesta."""
+        operation = data.get("operation", "")
+        intento = 0
+        while True:
+            try:
+                if self.limiter is not None:
+                    await self.limiter.aacquire(operation)
+                async with self._sem:
+                    if method == "GET":
+                        r = await self._client.get(self.base, params=data)
+                    else:
+                        r = await self._client.post(self.base, data=data)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                # la petición no llegó a enviarse: se puede repetir incluso un POST
+                if intento >= self.retries:
+                    raise
+                await asyncio.sleep(self._espera(intento))
+            except httpx.TransportError:
+                if method != "GET" or intento >= self.retries:
+                    raise
+                await asyncio.sleep(self._espera(intento))
+            else:
+                if self.limiter is not None:
+                    self.limiter.record(operation, r.status_code)
+                reintentable = method == "GET" and r.status_code in RETRY_STATUS
+                if not reintentable or intento >= self.retries:
+                    r.raise_for_status()
+                    return r.json()
+                await asyncio.sleep(self._espera(intento, r))
+            intento += 1
+
+    # ---------------------------------------------------------------- sesión
+
+    async def _vtiger_login(self):
+        data = await self._request("GET", {"operation": "getchallenge", "username": self.username})
+        token = (data.get("result") or {}).get("token")
+        if not token:
+            raise RuntimeError("No challenge token received from Vtiger")
+        access_key = hashlib.md5((token + self.access_key).encode()).hexdigest()
+        data = await self._request("POST", {
+            "operation": "login",
+            "username": self.username,
+            "accessKey": access_key,
+        })
+        session_name = (data.get("result") or {}).get("sessionName")
+        if not session_name:
+            raise RuntimeError("Login failed to get sessionName")
+        return session_name
+
+    async def login(self):
+        if self.cache is not None:
+            # SessionCache es síncrona (lock de hilos): se consulta fuera del event loop
+            self.session_name = await asyncio.to_thread(self.cache.get)
+            return self.session_name
+        async with self._login_lock:
+            if self.session_name is None:
+                self.session_name = await self._vtiger_login()
+        return self.session_name
+
+    async def _refresh(self, stale):
+        if self.cache is not None:
+            self.session_name = await asyncio.to_thread(self.cache.refresh, stale)
+            return self.session_name
+        async with self._login_lock:
+            # otra corrutina pudo renovarla mientras esperábamos el lock
+            if self.session_name == stale:
+                self.session_name = await self._vtiger_login()
+        return self.session_name
+
+    async def _call(self, method, payload):
+        """
+        Ejecuta una operación con el sessionName actual; si vtiger la rechaza
+        por sesión inválida se renueva una vez y se repite.
+        """
+        session_name = self.session_name or await self.login()
+        for attempt in range(2):
+            data = await self._request(method, {**payload, "sessionName": session_name})
+            if attempt == 0 and is_invalid_session(data):
+                session_name = await self._refresh(session_name)
+                continue
+            return data
+
+    # ----------------------------------------------------------- operaciones
+
+    async def query(self, query):
+        return await self._call("GET", {"operation": "query", "query": query})
+
+    async def query_records(self, query):
+        """Lista `result` de una consulta; RuntimeError si vtiger no la acepta."""
+        data = await self.query(query)
+        if not data.get("success"):
+            raise RuntimeError(f"Query fallida: {data}")
+        return data["result"]
+
+    def iter_query(self, query, page_size=MAX_PAGE_SIZE, columns=None, prefetch=True):
+        """
+        Iterador asíncrono de todos los registros de `query` (sin LIMIT),
+        paginando de 100 en 100 y pidiendo la página siguiente por adelantado.
+        """
+        return aiter_query(self.query_records, query, page_size, columns, prefetch)
+
+    def iter_pages(self, query, page_size=MAX_PAGE_SIZE, columns=None, prefetch=True):
+        """Como iter_query() pero por páginas (listas de registros)."""
+        return aiter_pages(self.query_records, query, page_size, columns, prefetch)
+
+    async def create(self, element_type, element):
+        return await self._call("POST", {
+            "operation": "create",
+            "elementType": element_type,
+            "element": json.dumps(element),
+        })
+
+    async def update(self, element_type, element):
+        return await self._call("POST", {
+            "operation": "update",
+            "elementType": element_type,
+            "element": json.dumps(element),
+        })
+
+    async def lookup(self, value, typ="phone", modules=None):
+        payload = {"operation": "lookup", "type": typ, "value": value}
+        if modules:
+            # {"Contacts": ["phone", "mobile"]} o lista de módulos (todos sus campos del tipo)
+            campos = modules if isinstance(modules, dict) else {module: [] for module in modules}
+            payload["searchIn"] = json.dumps(campos)
+        return await self._call("GET", payload)
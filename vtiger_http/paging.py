@@ -0,0 +1,179 @@
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# vtiger devuelve como máximo 100 registros por llamada a la operación query
+MAX_PAGE_SIZE = 100
+
+_SELECT = re.compile(r"^\s*SELECT\s+.+?\s+FROM\s+", re.IGNORECASE | re.DOTALL)
+_LIMIT = re.compile(r"\bLIMIT\b", re.IGNORECASE)
+_WHERE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+_ORDER_BY = re.compile(r"\bORDER\s+BY\b", re.IGNORECASE)
+
+
+def base_query(query, columns=None):
+    """
+    Normaliza una consulta para paginarla: sin ';' final y, con `columns`,
+    con la lista del SELECT sustituida por esas columnas (proyección).
+    La consulta no puede llevar LIMIT: lo añade cada página.
+    """
+    query = query.strip().rstrip(";").rstrip()
+    if _LIMIT.search(query):
+        raise ValueError(f"La consulta a paginar no debe llevar LIMIT: {query}")
+    if columns:
+        if not _SELECT.match(query):
+            raise ValueError(f"No se reconoce el SELECT ... FROM de la consulta: {query}")
+        query = _SELECT.sub("SELECT {0} FROM ".format(", ".join(columns)), query, count=1)
+    return query
+
+
+def vtql_literal(valor):
+    """Valor entre comillas para una consulta vtiger; se escapa primero la barra y luego la comilla."""
+    return "'" + str(valor).replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def page_query(query, offset, size):
+    return "{0} LIMIT {1}, {2};".format(query, offset, size)
+
+
+def _page_size(page_size):
+    # con más de 100 vtiger recortaría la página y se tomaría por la última
+    return max(1, min(page_size or MAX_PAGE_SIZE, MAX_PAGE_SIZE))
+
+
+def iter_pages(fetch, query, page_size=MAX_PAGE_SIZE, columns=None, prefetch=True):
+    """
+    Generador de páginas (listas de registros) de una consulta vtiger,
+    paginada con LIMIT offset, n hasta recibir una página incompleta.
+
+    - `fetch(query)`: ejecuta una consulta y devuelve la lista `result`.
+    - `columns`: proyección; sustituye la lista del SELECT.
+    - `prefetch`: pide la página siguiente en un hilo mientras el llamante
+      procesa la actual, así la descarga y el proceso se solapan y en
+      memoria hay como mucho dos páginas.
+
+    Para que el offset sea estable la consulta debería llevar ORDER BY.
+    """
+    query = base_query(query, columns)
+    size = _page_size(page_size)
+    if not prefetch:
+        offset = 0
+        while True:
+            rows = fetch(page_query(query, offset, size))
+            if rows:
+                yield rows
+            if len(rows) < size:
+                return
+            offset += size
+
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vtiger-prefetch")
+    try:
+        pending = pool.submit(fetch, page_query(query, 0, size))
+        offset = 0
+        while True:
+            rows = pending.result()
+            offset += size
+            pending = pool.submit(fetch, page_query(query, offset, size)) if len(rows) == size else None
+            if rows:
+                yield rows
+            if pending is None:
+                return
+    finally:
+        # el llamante puede abandonar el generador: la petición adelantada se descarta
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_query(fetch, query, page_size=MAX_PAGE_SIZE, columns=None, prefetch=True):
+    """Como iter_pages() pero devuelve los registros uno a uno."""
+    for rows in iter_pages(fetch, query, page_size, columns, prefetch):
+        yield from rows
+
+
+def since_query(query, column, since):
+    """Añade a `query` el filtro `column` >= `since` (si lo hay) y ORDER BY `column`."""
+    if since is not None:
+        query = "{0} {1} {2} >= {3}".format(
+            query, "AND" if _WHERE.search(query) else "WHERE", column, vtql_literal(since)
+        )
+    return "{0} ORDER BY {1}".format(query, column)
+
+
+def iter_pages_since(fetch, query, column, since=None, page_size=MAX_PAGE_SIZE, key="id", columns=None):
+    """
+    Generador de páginas de una consulta vtiger recorrida por marca (keyset)
+    sobre `column` (p. ej. modifiedtime) en vez de por offset: cada página
+    se pide con `column` >= último valor visto. Con LIMIT offset, n, un
+    registro modificado a mitad del recorrido pasa al final y desplaza las
+    filas siguientes, así que una se salta; por marca eso no ocurre.
+
+    - `since`: valor inicial de la marca (None: desde el principio).
+    - `key`: columna única (id) con la que se descartan los registros que se
+      repiten al volver a pedir desde la última marca; la consulta tiene que
+      incluir `key` y `column`.
+    - Al cambiar de marca se vuelve a pedir desde el offset 0 y los empates
+      ya vistos se descartan por `key`: con un offset, un empate modificado
+      entretanto desplazaría a los demás. Solo si una página entera comparte
+      el mismo valor de `column` se avanza con offset dentro de ese empate.
+
+    La consulta no puede llevar ORDER BY ni LIMIT. Cada página depende de la
+    anterior, así que aquí no hay prefetch.
+    """
+    query = base_query(query, columns)
+    if _ORDER_BY.search(query):
+        raise ValueError(f"La consulta a paginar por marca no debe llevar ORDER BY: {query}")
+    size = _page_size(page_size)
+    seen = set()  # keys ya devueltas con `column` == since
+    skip = 0
+    while True:
+        rows = fetch(page_query(since_query(query, column, since), skip, size))
+        new = [r for r in rows if r[key] not in seen]
+        if new:
+            yield new
+        if len(rows) < size:
+            return
+        last = rows[-1][column]
+        if last == since:
+            seen.update(r[key] for r in rows)
+            skip = len(seen)
+        else:
+            since, skip = last, 0
+            seen = {r[key] for r in rows if r[column] == last}
+
+
+def iter_query_since(fetch, query, column, since=None, page_size=MAX_PAGE_SIZE, key="id", columns=None):
+    """Como iter_pages_since() pero devuelve los registros uno a uno."""
+    for rows in iter_pages_since(fetch, query, column, since, page_size, key, columns):
+        yield from rows
+
+
+async def aiter_pages(fetch, query, page_size=MAX_PAGE_SIZE, columns=None, prefetch=True):
+    """
+    Versión asíncrona de iter_pages(): `fetch` es una corrutina y la página
+    siguiente se pide en una tarea mientras se consume la actual.
+    """
+    query = base_query(query, columns)
+    size = _page_size(page_size)
+    offset = 0
+    pending = asyncio.ensure_future(fetch(page_query(query, 0, size)))
+    try:
+        while pending is not None:
+            rows = await pending
+            offset += size
+            pending = None
+            if len(rows) == size:
+                nxt = fetch(page_query(query, offset, size))
+                pending = asyncio.ensure_future(nxt) if prefetch else nxt
+            if rows:
+                yield rows
+    finally:
+        if asyncio.isfuture(pending):
+            pending.cancel()
+        elif pending is not None:
+            pending.close()
+
+
+async def aiter_query(fetch, query, page_size=MAX_PAGE_SIZE, columns=None, prefetch=True):
+    """Como aiter_pages() pero devuelve los registros uno a uno."""
+    async for rows in aiter_pages(fetch, query, page_size, columns, prefetch):
+        for row in rows:
+            yield row
@@ -0,0 +1,178 @@
+import asyncio
+import os
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+# -------- valores por defecto (sobrescribibles por variables de entorno) ----------
+DEFAULT_RATE_READ = float(os.environ.get("VTIGER_RATE_READ", 20))  # peticiones/s de lectura (0 = sin límite)
+DEFAULT_RATE_WRITE = float(os.environ.get("VTIGER_RATE_WRITE", 10))  # peticiones/s de escritura (0 = sin límite)
+DEFAULT_RATE_MAX_FACTOR = float(os.environ.get("VTIGER_RATE_MAX_FACTOR", 4))  # techo AIMD = rate * factor
+# ------------------------------------------------------------------------------------
+
+# respuestas que indican que vtiger (o el proxy delante) está saturado
+THROTTLE_STATUS = (429, 500, 502, 503, 504)
+
+# clase de presupuesto de cada operación de la API webservice
+WRITE_OPERATIONS = frozenset({"create", "update", "revise", "delete", "convertlead"})
+
+
+def operation_class(operation):
+    """'escritura' para operaciones que modifican registros, 'lectura' para el resto."""
+    return "escritura" if operation in WRITE_OPERATIONS else "lectura"
+
+
+class TokenBucket:
+    """
+    Token bucket con adaptación AIMD del ritmo.
+
+    - `rate`: peticiones/s iniciales; `burst`: tokens acumulables (por defecto 1 s de ritmo).
+    - on_success() sube el ritmo de forma aditiva (~`increase` peticiones/s por
+      segundo de éxito) hasta `max_rate`; on_throttle() (429/5xx) lo multiplica
+      por `decrease`, como mucho una vez por `cooldown` segundos para que una
+      ráfaga de errores no lo hunda, y sin bajar de `min_rate`.
+    - acquire() / aacquire() reservan un token y esperan lo necesario; los
+      que esperan a la vez forman la cola (`waiting`).
+    """
+
+    def __init__(self, rate, burst=None, min_rate=0.5, max_rate=None,
+                 increase=1.0, decrease=0.5, cooldown=1.0):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate))
+        self.min_rate = min_rate
+        self.max_rate = max_rate or self.rate * DEFAULT_RATE_MAX_FACTOR
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.tokens = self.burst
+        self.waiting = 0
+        self.acquired = 0
+        self.throttled = 0
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Toma un token (el saldo puede quedar negativo) y devuelve los segundos de espera."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= 1
+            self.acquired += 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self):
+        espera = self._reserve()
+        if espera:
+            with self._lock:
+                self.waiting += 1
+            try:
+                time.sleep(espera)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+        return espera
+
+    async def aacquire(self):
+        espera = self._reserve()
+        if espera:
+            with self._lock:
+                self.waiting += 1
+            try:
+                await asyncio.sleep(espera)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+        return espera
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttled += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._last_decrease = now
+
+    def record(self, status_code):
+        """Ajusta el ritmo según el código HTTP de la respuesta."""
+        if status_code in THROTTLE_STATUS:
+            self.on_throttle()
+        else:
+            self.on_success()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate": round(self.rate, 2),
+                "max_rate": self.max_rate,
+                "tokens": round(self.tokens, 2),
+                "waiting": self.waiting,
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+            }
+
+
+class RateLimiter:
+    """
+    Presupuesto de peticiones a vtiger por clase de operación (lectura /
+    escritura), cada una con su TokenBucket. Un mismo RateLimiter se comparte
+    entre la sesión requests y el cliente asíncrono de un proceso.
+    Una clase con ritmo 0 no se limita.
+    """
+
+    def __init__(self, read_rate=DEFAULT_RATE_READ, write_rate=DEFAULT_RATE_WRITE, **bucket_kwargs):
+        self.buckets = {}
+        for clase, rate in (("lectura", read_rate), ("escritura", write_rate)):
+            if rate and rate > 0:
+                self.buckets[clase] = TokenBucket(rate, **bucket_kwargs)
+
+    def bucket(self, operation):
+        return self.buckets.get(operation_class(operation))
+
+    def acquire(self, operation):
+        bucket = self.bucket(operation)
+        return bucket.acquire() if bucket else 0.0
+
+    async def aacquire(self, operation):
+        bucket = self.bucket(operation)
+        return await bucket.aacquire() if bucket else 0.0
+
+    def record(self, operation, status_code):
+        bucket = self.bucket(operation)
+        if bucket:
+            bucket.record(status_code)
+
+    def stats(self):
+        return {clase: bucket.stats() for clase, bucket in self.buckets.items()}
+
+
+def url_operation(url):
+    """Operación vtiger del query string de una URL ('' si no la lleva)."""
+    return (parse_qs(urlsplit(url or "").query).get("operation") or [""])[0]
+
+
+def request_operation(request):
+    """Operación vtiger ('query', 'create'...) de un requests.PreparedRequest."""
+    params = parse_qs(urlsplit(request.url).query)
+    if "operation" not in params and request.body:
+        body = request.body.decode() if isinstance(request.body, bytes) else str(request.body)
+        params = parse_qs(body)
+    return (params.get("operation") or [""])[0]
+
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+
+def get_limiter():
+    """RateLimiter compartido por el proceso (se crea en el primer uso)."""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter()
+        return _shared_limiter
@@ -0,0 +1,80 @@
+import threading
+import time
+
+# códigos de error con los que vtiger indica que el sessionName ya no vale
+INVALID_SESSION_CODES = ("INVALID_SESSIONID", "AUTHENTICATION_REQUIRED")
+
+
+def is_invalid_session(data):
+    """True si la respuesta JSON de vtiger es un error de sesión caducada/inválida."""
+    if not isinstance(data, dict) or data.get("success", True):
+        return False
+    error = data.get("error") or {}
+    return isinstance(error, dict) and error.get("code") in INVALID_SESSION_CODES
+
+
+class SessionCache:
+    """
+    Cache de proceso del sessionName de vtiger con TTL.
+
+    `login_func` es una función sin argumentos que hace getchallenge + login
+    y devuelve el sessionName. Solo un hilo hace login a la vez; el resto
+    espera y reutiliza la sesión obtenida (sin tormenta de logins).
+    """
+
+    def __init__(self, login_func, ttl=1800):
+        self.login_func = login_func
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._session_name = None
+        self._expires_at = 0.0
+        self._created_at = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def _valid(self):
+        return self._session_name is not None and time.monotonic() < self._expires_at
+
+    def _login(self):
+        self._session_name = self.login_func()
+        self._created_at = time.monotonic()
+        self._expires_at = self._created_at + self.ttl
+        return self._session_name
+
+    def get(self):
+        """Devuelve un sessionName válido, haciendo login solo si no hay ninguno vigente."""
+        with self._lock:
+            if self._valid():
+                self.hits += 1
+                return self._session_name
+            self.misses += 1
+            return self._login()
+
+    def refresh(self, stale_session):
+        """
+        Fuerza un login nuevo cuando vtiger rechaza `stale_session`.
+        Si otro hilo ya la renovó, devuelve la nueva sin repetir el login.
+        """
+        with self._lock:
+            if self._valid() and self._session_name != stale_session:
+                self.hits += 1
+                return self._session_name
+            self.refreshes += 1
+            return self._login()
+
+    def invalidate(self):
+        with self._lock:
+            self._session_name = None
+            self._expires_at = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "ttl": self.ttl,
+                "active": self._valid(),
+                "age_seconds": round(time.monotonic() - self._created_at, 1) if self._valid() else None,
+            }
@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from vtiger_http import AsyncVtigerClient, SessionCache
+
+
+def make_client(handler, **kwargs):
+    kwargs.setdefault("backoff", 0)
+    return AsyncVtigerClient(
+        "https://crm.example.com/webservice.php", "api", "key",
+        transport=httpx.MockTransport(handler), **kwargs
+    )
+
+
+def vtiger_handler(calls, create_status=None):
+    def handler(request):
+        params = dict(request.url.params)
+        data = dict(httpx.QueryParams(request.content.decode())) if request.method == "POST" else {}
+        op = params.get("operation") or data.get("operation")
+        calls.append(op)
+        if op == "getchallenge":
+            return httpx.Response(200, json={"success": True, "result": {"token": "tok"}})
+        if op == "login":
+            return httpx.Response(200, json={"success": True, "result": {"sessionName": f"s{calls.count('login')}"}})
+        if op == "query":
+            return httpx.Response(200, json={"success": True, "result": [{"id": "12x1"}]})
+        if op == "create":
+            if create_status:
+                return httpx.Response(create_status.pop(0), json={})
+            return httpx.Response(200, json={"success": True, "result": {"id": "9x1"}})
+        return httpx.Response(400, json={"success": False})
+    return handler
+
+
+def test_login_once_for_concurrent_calls():
+    calls = []
+
+    async def run():
+        async with make_client(vtiger_handler(calls), concurrency=4) as vt:
+            return await asyncio.gather(*(vt.query("SELECT id FROM Contacts;") for _ in range(20)))
+
+    results = asyncio.run(run())
+    assert all(r["result"] == [{"id": "12x1"}] for r in results)
+    assert calls.count("login") == 1
+    assert calls.count("query") == 20
+
+
+def test_get_retries_on_5xx():
+    calls = []
+    base = vtiger_handler(calls)
+    fallos = [503, 502]
+
+    def handler(request):
+        if dict(request.url.params).get("operation") == "query" and fallos:
+            calls.append("fallo")
+            return httpx.Response(fallos.pop(0))
+        return base(request)
+
+    async def run():
+        async with make_client(handler, retries=3) as vt:
+            return await vt.query("SELECT id FROM Contacts;")
+
+    assert asyncio.run(run())["success"]
+    assert calls.count("fallo") == 2
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_post_not_retried_on_status(status):
+    # misma política que build_session(): allowed_methods={"GET"}
+    calls = []
+
+    async def run():
+        async with make_client(vtiger_handler(calls, create_status=[status]), retries=3) as vt:
+            return await vt.create("Calls", {"subject": "x"})
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(run())
+    assert calls.count("create") == 1
+
+
+def test_post_retried_when_not_sent():
+    calls = []
+    base = vtiger_handler(calls)
+    fallos = [httpx.ConnectError("connection refused")]
+
+    def handler(request):
+        if request.method == "POST" and b"operation=create" in request.content and fallos:
+            raise fallos.pop(0)
+        return base(request)
+
+    async def run():
+        async with make_client(handler, retries=3) as vt:
+            return await vt.create("Calls", {"subject": "x"})
+
+    assert asyncio.run(run())["result"]["id"] == "9x1"
+    assert calls.count("create") == 1
+
+
+def test_invalid_session_refreshes_shared_cache():
+    logins = []
+    cache = SessionCache(lambda: logins.append(1) or f"cached-{len(logins)}", ttl=60)
+    vistos = []
+
+    def handler(request):
+        session = dict(request.url.params).get("sessionName")
+        vistos.append(session)
+        if session == "cached-1":
+            return httpx.Response(200, json={"success": False, "error": {"code": "INVALID_SESSIONID"}})
+        return httpx.Response(200, json={"success": True, "result": []})
+
+    async def run():
+        vt = AsyncVtigerClient("https://crm.example.com", cache=cache, transport=httpx.MockTransport(handler))
+        try:
+            return await vt.query("SELECT id FROM Calls;")
+        finally:
+            await vt.aclose()
+
+    assert asyncio.run(run())["success"]
+    assert vistos == ["cached-1", "cached-2"]
+    assert len(logins) == 2
+
+
+def test_cancellation_releases_semaphore():
+    async def run():
+        bloqueo = asyncio.Event()
+
+        async def handler(request):
+            await bloqueo.wait()
+            return httpx.Response(200, json={"success": True, "result": []})
+
+        vt = AsyncVtigerClient(
+            "https://crm.example.com", "api", "key", concurrency=1, transport=httpx.MockTransport(handler)
+        )
+        vt.session_name = "s1"
+        tarea = asyncio.create_task(vt.query("SELECT 1;"))
+        await asyncio.sleep(0)
+        tarea.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tarea
+        # el hueco del semáforo quedó libre para la siguiente petición
+        bloqueo.set()
+        resultado = await asyncio.wait_for(vt.query("SELECT 1;"), timeout=1)
+        await vt.aclose()
+        return resultado
+
+    assert asyncio.run(run())["success"]
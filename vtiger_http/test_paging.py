@@ -0,0 +1,143 @@
+import asyncio
+import re
+import threading
+
+import pytest
+
+from vtiger_http import aiter_query, iter_pages, iter_pages_since, iter_query, iter_query_since, vtql_literal
+from vtiger_http.paging import base_query, since_query
+
+
+def fake_table(n, consultas):
+    filas = [{"id": f"12x{i}", "phone": str(600000000 + i)} for i in range(n)]
+
+    def fetch(q):
+        consultas.append(q)
+        m = re.search(r"LIMIT (\d+), (\d+);$", q)
+        offset, size = int(m.group(1)), int(m.group(2))
+        return filas[offset:offset + size]
+
+    return filas, fetch
+
+
+def test_iter_query_reads_every_page():
+    consultas = []
+    filas, fetch = fake_table(250, consultas)
+    assert list(iter_query(fetch, "SELECT id, phone FROM Contacts ORDER BY id;")) == filas
+    assert consultas == [
+        "SELECT id, phone FROM Contacts ORDER BY id LIMIT 0, 100;",
+        "SELECT id, phone FROM Contacts ORDER BY id LIMIT 100, 100;",
+        "SELECT id, phone FROM Contacts ORDER BY id LIMIT 200, 100;",
+    ]
+
+
+def test_page_size_is_capped_and_exact_multiple_ends():
+    consultas = []
+    _, fetch = fake_table(200, consultas)
+    paginas = list(iter_pages(fetch, "SELECT id FROM Contacts", page_size=500, prefetch=False))
+    assert [len(p) for p in paginas] == [100, 100]
+    # la tercera consulta llega vacía y cierra la iteración
+    assert len(consultas) == 3
+
+
+def test_projection_and_limit_rejected():
+    assert base_query("SELECT * FROM Leads WHERE x = 1;", ["id", "email"]) == "SELECT id, email FROM Leads WHERE x = 1"
+    with pytest.raises(ValueError):
+        base_query("SELECT id FROM Leads LIMIT 5")
+
+
+def test_prefetch_overlaps_next_page():
+    consultas = []
+    _, base_fetch = fake_table(300, consultas)
+    pedida = threading.Event()
+
+    def fetch(q):
+        filas = base_fetch(q)
+        if "LIMIT 100," in q:
+            pedida.set()
+        return filas
+
+    paginas = iter_pages(fetch, "SELECT id FROM Contacts")
+    next(paginas)
+    # la segunda página se pide mientras el llamante tiene la primera
+    assert pedida.wait(1)
+    paginas.close()
+
+
+def test_async_iter_query():
+    consultas = []
+    filas, fetch = fake_table(150, consultas)
+
+    async def afetch(q):
+        await asyncio.sleep(0)
+        return fetch(q)
+
+    async def run():
+        return [r async for r in aiter_query(afetch, "SELECT id, phone FROM Contacts", columns=["id"])]
+
+    assert asyncio.run(run()) == filas
+    assert consultas[0] == "SELECT id FROM Contacts LIMIT 0, 100;"
+    assert len(consultas) == 2
+
+
+def fake_modified_table(filas, consultas):
+    """Como vtiger: WHERE modifiedtime >= x ORDER BY modifiedtime LIMIT offset, n."""
+
+    def fetch(q):
+        consultas.append(q)
+        m = re.search(r"(?:WHERE modifiedtime >= '([^']*)' )?ORDER BY modifiedtime LIMIT (\d+), (\d+);$", q)
+        desde, offset, size = m.group(1) or "", int(m.group(2)), int(m.group(3))
+        orden = sorted((r for r in filas if r["modifiedtime"] >= desde), key=lambda r: r["modifiedtime"])
+        return [dict(r) for r in orden[offset:offset + size]]
+
+    return fetch
+
+
+def test_since_query_adds_filter_and_order():
+    assert since_query("SELECT id FROM Leads", "modifiedtime", None) == "SELECT id FROM Leads ORDER BY modifiedtime"
+    assert since_query("SELECT id FROM Leads WHERE leadstatus = 'Hot'", "modifiedtime", "2025-07-28 10:00:00") == (
+        "SELECT id FROM Leads WHERE leadstatus = 'Hot' AND modifiedtime >= '2025-07-28 10:00:00' ORDER BY modifiedtime"
+    )
+    with pytest.raises(ValueError):
+        list(iter_pages_since(lambda q: [], "SELECT id FROM Leads ORDER BY id", "modifiedtime"))
+
+
+def test_vtql_literal_escapes_backslash_before_quote():
+    assert vtql_literal("O'Brien") == r"'O\'Brien'"
+    # una barra final no puede escapar la comilla de cierre
+    assert vtql_literal("a\\") == r"'a\\'"
+    assert vtql_literal("x\\' OR 1=1 -- ") == r"'x\\\' OR 1=1 -- '"
+    assert vtql_literal(600111222) == "'600111222'"
+    assert since_query("SELECT id FROM Leads", "modifiedtime", "2025\\") == (
+        r"SELECT id FROM Leads WHERE modifiedtime >= '2025\\' ORDER BY modifiedtime"
+    )
+
+
+def test_record_modified_mid_walk_is_not_skipped():
+    filas = [{"id": f"10x{i}", "modifiedtime": f"2025-07-28 10:00:{i:02d}"} for i in range(10)]
+    consultas = []
+    fetch = fake_modified_table(filas, consultas)
+    vistos = []
+    for pagina in iter_pages_since(fetch, "SELECT id, modifiedtime FROM Leads", "modifiedtime", page_size=4):
+        vistos.extend(r["id"] for r in pagina)
+        if len(vistos) == 4:
+            # alguien modifica un lead ya leído: pasa al final del orden
+            filas[1]["modifiedtime"] = "2025-07-28 11:00:00"
+    # con LIMIT offset, n la fila 10x4 se habría saltado; por marca llegan todas
+    assert sorted(set(vistos)) == sorted(r["id"] for r in filas)
+    assert vistos[-1] == "10x1"
+    assert len(vistos) == len(set(vistos)) + 1  # 10x1 vuelve a llegar con su nueva modifiedtime
+    assert "modifiedtime >= '2025-07-28 10:00:03'" in consultas[1]
+
+
+def test_ties_longer_than_a_page_advance_by_offset():
+    filas = [{"id": f"10x{i}", "modifiedtime": "2025-07-28 10:00:00"} for i in range(7)]
+    filas.append({"id": "10x7", "modifiedtime": "2025-07-28 10:00:01"})
+    consultas = []
+    fetch = fake_modified_table(filas, consultas)
+    ids = [r["id"] for r in iter_query_since(fetch, "SELECT id, modifiedtime FROM Leads", "modifiedtime",
+                                             since="2025-07-28 00:00:00", page_size=3)]
+    assert ids == [f"10x{i}" for i in range(8)]
+    # al cambiar de marca se empieza en 0 (los empates ya vistos se descartan por id);
+    # solo cuando una página entera es del mismo valor se avanza con offset
+    assert [re.search(r"LIMIT (\d+),", q).group(1) for q in consultas] == ["0", "0", "3", "6"]
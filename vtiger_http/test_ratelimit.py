@@ -0,0 +1,57 @@
+import asyncio
+
+import requests
+
+from vtiger_http import RateLimiter, TokenBucket
+from vtiger_http.ratelimit import operation_class, request_operation
+
+
+def test_bucket_waits_when_empty():
+    bucket = TokenBucket(rate=100, burst=1)
+    assert bucket.acquire() == 0
+    espera = bucket.acquire()
+    assert 0 < espera <= 0.011
+    assert bucket.stats()["acquired"] == 2
+
+
+def test_async_acquire_counts_queue_depth():
+    bucket = TokenBucket(rate=50, burst=1)
+
+    async def run():
+        tareas = [asyncio.create_task(bucket.aacquire()) for _ in range(5)]
+        await asyncio.sleep(0)
+        profundidad = bucket.stats()["waiting"]
+        await asyncio.gather(*tareas)
+        return profundidad
+
+    assert asyncio.run(run()) == 4
+    assert bucket.stats()["waiting"] == 0
+
+
+def test_aimd_adaptation():
+    bucket = TokenBucket(rate=10, max_rate=12, cooldown=60)
+    bucket.record(429)
+    assert bucket.rate == 5
+    # varios errores seguidos solo cuentan una vez por cooldown
+    bucket.record(503)
+    assert bucket.rate == 5 and bucket.stats()["throttled"] == 2
+    for _ in range(200):
+        bucket.record(200)
+    assert bucket.rate == 12
+
+
+def test_limiter_budgets_per_operation():
+    limiter = RateLimiter(read_rate=20, write_rate=0)
+    assert operation_class("query") == "lectura"
+    assert operation_class("create") == "escritura"
+    assert limiter.bucket("create") is None  # escritura sin límite
+    limiter.acquire("query")
+    assert limiter.stats()["lectura"]["acquired"] == 1
+    assert "escritura" not in limiter.stats()
+
+
+def test_request_operation_from_query_and_body():
+    get = requests.Request("GET", "https://crm/webservice.php", params={"operation": "query", "query": "x"}).prepare()
+    post = requests.Request("POST", "https://crm/webservice.php", data={"operation": "create"}).prepare()
+    assert request_operation(get) == "query"
+    assert request_operation(post) == "create"
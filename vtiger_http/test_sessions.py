@@ -0,0 +1,55 @@
+import threading
+
+from vtiger_http import SessionCache, is_invalid_session
+
+
+def make_cache(ttl=60):
+    logins = []
+
+    def login():
+        logins.append(1)
+        return f"session-{len(logins)}"
+
+    return SessionCache(login, ttl=ttl), logins
+
+
+def test_cache_hits_after_first_login():
+    cache, logins = make_cache()
+    assert cache.get() == "session-1"
+    assert cache.get() == "session-1"
+    assert len(logins) == 1
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["hits"] == 1 and stats["active"]
+
+
+def test_expired_session_logs_in_again():
+    cache, logins = make_cache(ttl=0)
+    cache.get()
+    cache.get()
+    assert len(logins) == 2
+
+
+def test_refresh_is_single_flight():
+    cache, logins = make_cache()
+    stale = cache.get()
+    assert cache.refresh(stale) == "session-2"
+    # otro hilo que vio la misma sesión caducada reutiliza la renovada
+    assert cache.refresh(stale) == "session-2"
+    assert len(logins) == 2
+    assert cache.stats()["refreshes"] == 1
+
+
+def test_concurrent_get_logs_in_once():
+    cache, logins = make_cache()
+    hilos = [threading.Thread(target=cache.get) for _ in range(20)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    assert len(logins) == 1
+
+
+def test_is_invalid_session():
+    assert is_invalid_session({"success": False, "error": {"code": "INVALID_SESSIONID"}})
+    assert not is_invalid_session({"success": False, "error": {"code": "ACCESS_DENIED"}})
+    assert not is_invalid_session({"success": True, "result": []})
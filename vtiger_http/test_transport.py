@@ -0,0 +1,84 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from vtiger_http import RateLimiter, TimeoutHTTPAdapter, build_session, ensure_pool_size, get_session
+
+
+def test_build_session_mounts_pooled_adapter():
+    s = build_session(pool_size=7, timeout=3, retries=2, backoff=0.1)
+    adapter = s.get_adapter("https://crm.example.com/webservice.php")
+    assert isinstance(adapter, TimeoutHTTPAdapter)
+    assert adapter._pool_maxsize == 7
+    assert adapter.timeout == 3
+    retry = adapter.max_retries
+    assert retry.total == 2
+    assert 429 in retry.status_forcelist and 503 in retry.status_forcelist
+    # los POST (create/update) no se reintentan por estado
+    assert "POST" not in retry.allowed_methods
+
+
+def test_default_timeout_applied(monkeypatch):
+    vistos = {}
+
+    def fake_send(self, request, **kwargs):
+        vistos["timeout"] = kwargs.get("timeout")
+        r = requests.Response()
+        r.status_code = 200
+        return r
+
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", fake_send)
+    s = build_session(timeout=4)
+    s.get("https://crm.example.com/webservice.php")
+    assert vistos["timeout"] == 4
+    s.get("https://crm.example.com/webservice.php", timeout=1)
+    assert vistos["timeout"] == 1
+
+
+def test_ensure_pool_size_grows_pool():
+    s = build_session(pool_size=2)
+    ensure_pool_size(s, 16)
+    assert s.get_adapter("https://crm.example.com")._pool_maxsize == 16
+
+
+def test_shared_session_is_singleton():
+    assert get_session() is get_session()
+
+
+def test_retried_429_goes_through_limiter():
+    peticiones = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            peticiones.append(self.path)
+            # una de cada dos peticiones recibe 429
+            status = 429 if len(peticiones) % 2 else 200
+            body = json.dumps({"success": status == 200, "result": []}).encode()
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        limiter = RateLimiter(read_rate=1000, write_rate=0, cooldown=0)
+        s = build_session(retries=3, backoff=0, limiter=limiter)
+        url = f"http://127.0.0.1:{server.server_address[1]}/webservice.php"
+        for _ in range(5):
+            assert s.get(url, params={"operation": "query", "query": "x"}).status_code == 200
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    stats = limiter.stats()["lectura"]
+    assert len(peticiones) == 10
+    # cada intento (también los reintentos de urllib3) toma token y cada 429 cuenta
+    assert stats["acquired"] == 10
+    assert stats["throttled"] == 5
+    assert stats["rate"] < 1000
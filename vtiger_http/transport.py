@@ -0,0 +1,148 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .ratelimit import get_limiter, request_operation, url_operation
+
+# -------- valores por defecto (sobrescribibles por variables de entorno) ----------
+DEFAULT_POOL_SIZE = int(os.environ.get("VTIGER_POOL_SIZE", 10))
+DEFAULT_TIMEOUT = float(os.environ.get("VTIGER_TIMEOUT", 10))
+DEFAULT_RETRIES = int(os.environ.get("VTIGER_RETRIES", 3))
+DEFAULT_BACKOFF = float(os.environ.get("VTIGER_BACKOFF", 0.5))
+# ------------------------------------------------------------------------------------
+
+# respuestas que vtiger (o el proxy delante) devuelve cuando conviene reintentar
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class LimitedRetry(Retry):
+    """
+    Retry de urllib3 que pasa por el RateLimiter cada intento repetido: los
+    reintentos por 429/5xx ocurren dentro de HTTPAdapter.send, así que sin
+    esto el limitador solo vería el estado final de cada petición. Cada
+    respuesta reintentada se registra (AIMD) y, tras el backoff, el nuevo
+    intento espera su token. La operación se toma de la URL (las peticiones
+    GET, las únicas que se reintentan por estado, la llevan ahí).
+    """
+
+    def __init__(self, *args, limiter=None, operation="", **kwargs):
+        self.limiter = limiter
+        self.operation = operation
+        super().__init__(*args, **kwargs)
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.limiter = self.limiter
+        retry.operation = self.operation
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        # si se agotan los intentos lanza MaxRetryError y el estado final lo registra el adaptador
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        if self.limiter is not None:
+            retry.operation = url_operation(url)
+            if response is not None:
+                self.limiter.record(retry.operation, response.status)
+        return retry
+
+    def sleep(self, response=None):
+        super().sleep(response)
+        if self.limiter is not None:
+            self.limiter.acquire(self.operation)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter que aplica un timeout por defecto si la llamada no indica
+    ninguno y, con `limiter` (RateLimiter), espera turno según la operación
+    vtiger de la petición y ajusta el ritmo con el código de la respuesta.
+    """
+
+    def __init__(self, *args, timeout=DEFAULT_TIMEOUT, limiter=None, **kwargs):
+        self.timeout = timeout
+        self.limiter = limiter
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        if self.limiter is None:
+            return super().send(request, **kwargs)
+        operation = request_operation(request)
+        self.limiter.acquire(operation)
+        response = super().send(request, **kwargs)
+        self.limiter.record(operation, response.status_code)
+        return response
+
+
+def build_session(pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                  retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, limiter=None):
+    """
+    Crea un requests.Session con pool de conexiones keep-alive hacia vtiger.
+
+    - `pool_size`: conexiones reutilizables por host (ajustar al nº de workers).
+    - `timeout`: timeout por defecto (s) de cada petición.
+    - `retries` / `backoff`: reintentos con backoff exponencial en 429/5xx.
+      Los reintentos por estado o por error de lectura solo se aplican a GET
+      (query, lookup, getchallenge): un POST create/update repetido podría
+      duplicar registros. Los errores de conexión se reintentan siempre,
+      porque la petición no llegó a enviarse.
+    - `limiter`: RateLimiter (ver ratelimit.py) que reparte el presupuesto de
+      peticiones por tipo de operación; None para no limitar. También
+      cuenta los reintentos de urllib3 (ver LimitedRetry).
+    """
+    retry = LimitedRetry(
+        limiter=limiter,
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=frozenset({"GET"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry,
+        timeout=timeout,
+        limiter=limiter,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def ensure_pool_size(session, pool_size):
+    """
+    Amplía el pool de una sesión creada con build_session() si hay más hilos
+    concurrentes que conexiones (si no, urllib3 abre y descarta conexiones extra).
+    """
+    for prefix, adapter in list(session.adapters.items()):
+        if isinstance(adapter, TimeoutHTTPAdapter) and adapter._pool_maxsize < pool_size:
+            session.mount(prefix, TimeoutHTTPAdapter(
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+                max_retries=adapter.max_retries,
+                timeout=adapter.timeout,
+                limiter=adapter.limiter,
+            ))
+
+
+_shared_session = None
+_shared_lock = threading.Lock()
+
+
+def get_session():
+    """Sesión HTTP compartida por todo el proceso (se crea en el primer uso)."""
+    global _shared_session
+    with _shared_lock:
+        if _shared_session is None:
+            _shared_session = build_session(limiter=get_limiter())
+        return _shared_session